@@ -274,6 +274,32 @@ CREATE TABLE AirQuality_DW.dbo.Fact_WindSpeed
 
 CREATE UNIQUE CLUSTERED INDEX UC_IDX_SiteDateTimeID ON AirQuality_DW.dbo.Fact_WindSpeed ( Full_Site_Number, Date_Time_Local )
 
+--=============================================================================
+-- Create a table to hold the EPA daily summaries used for long-horizon history
+--=============================================================================
+IF OBJECT_ID( 'AirQuality_DW.dbo.Fact_Daily_Summary' ) IS NOT NULL
+	DROP TABLE AirQuality_DW.dbo.Fact_Daily_Summary
+CREATE TABLE AirQuality_DW.dbo.Fact_Daily_Summary
+(
+	Full_Site_Number CHAR(11) NOT NULL
+	, Date_Local DATE NOT NULL
+	, Parameter_Code CHAR(5) NOT NULL
+	, Parameter_Name VARCHAR(50)
+	, Sample_Duration VARCHAR(25) NOT NULL
+	, Pollutant_Standard VARCHAR(50) NOT NULL
+	, Units_of_Measure VARCHAR(50)
+	, Observation_Count SMALLINT
+	, Observation_Percent DECIMAL(5, 1)
+	, Validity_Indicator CHAR(1)
+	, Arithmetic_Mean DECIMAL(12, 6)
+	, First_Max_Value DECIMAL(12, 6)
+	, First_Max_Hour TINYINT
+	, AQI SMALLINT
+	, src VARCHAR(25)
+)
+
+CREATE UNIQUE CLUSTERED INDEX UC_IDX_SiteParamDate ON AirQuality_DW.dbo.Fact_Daily_Summary ( Full_Site_Number, Parameter_Code, Date_Local, Sample_Duration, Pollutant_Standard )
+
 GO
 
 USE AirQuality_Staging
@@ -284,6 +310,73 @@ GO
 --Create data loading staging table shells
 --=============================================================================
 
+--=============================================================================
+-- Monthly partitions shared by the staging tables.  The update tasks split in
+-- the upcoming months as time passes (AirQualityDBHandler.ensureStagingLayout)
+--=============================================================================
+IF NOT EXISTS ( SELECT 1 FROM sys.partition_functions WHERE name = 'pf_Staging_Month' )
+BEGIN
+	DECLARE @Boundary DATE = '2014-01-01'
+	DECLARE @Boundaries NVARCHAR(MAX) = N''
+	WHILE @Boundary <= DATEADD( MONTH, 3, GETDATE() )
+	BEGIN
+		SET @Boundaries += CASE WHEN @Boundaries = N'' THEN N'' ELSE N', ' END + N'''' + CONVERT( NCHAR(10), @Boundary, 23 ) + N''''
+		SET @Boundary = DATEADD( MONTH, 1, @Boundary )
+	END
+	EXEC( N'CREATE PARTITION FUNCTION pf_Staging_Month ( DATE ) AS RANGE RIGHT FOR VALUES ( ' + @Boundaries + N' )' )
+END
+IF NOT EXISTS ( SELECT 1 FROM sys.partition_schemes WHERE name = 'ps_Staging_Month' )
+	CREATE PARTITION SCHEME ps_Staging_Month AS PARTITION pf_Staging_Month ALL TO ( [PRIMARY] )
+
+--=============================================================================
+-- Dimensions of the long strings repeated on staging rows (source urls, data
+-- sources, methods, units).  Staging rows hold their ids
+-- (AirQualitySourceDictionary)
+--=============================================================================
+IF OBJECT_ID( 'AirQuality_Staging.dbo.dim_URL_Source' ) IS NULL
+BEGIN
+	CREATE TABLE AirQuality_Staging.dbo.dim_URL_Source
+	(
+		ID INT IDENTITY(1, 1) PRIMARY KEY
+		, Value VARCHAR(1000) NOT NULL
+		, Value_Hash AS CONVERT( BINARY(32), HASHBYTES( 'SHA2_256', Value ) ) PERSISTED
+	)
+	CREATE UNIQUE INDEX UX_dim_URL_Source_Value_Hash ON AirQuality_Staging.dbo.dim_URL_Source ( Value_Hash )
+END
+
+IF OBJECT_ID( 'AirQuality_Staging.dbo.dim_Data_Source' ) IS NULL
+BEGIN
+	CREATE TABLE AirQuality_Staging.dbo.dim_Data_Source
+	(
+		ID INT IDENTITY(1, 1) PRIMARY KEY
+		, Value VARCHAR(1000) NOT NULL
+		, Value_Hash AS CONVERT( BINARY(32), HASHBYTES( 'SHA2_256', Value ) ) PERSISTED
+	)
+	CREATE UNIQUE INDEX UX_dim_Data_Source_Value_Hash ON AirQuality_Staging.dbo.dim_Data_Source ( Value_Hash )
+END
+
+IF OBJECT_ID( 'AirQuality_Staging.dbo.dim_Method' ) IS NULL
+BEGIN
+	CREATE TABLE AirQuality_Staging.dbo.dim_Method
+	(
+		ID INT IDENTITY(1, 1) PRIMARY KEY
+		, Value VARCHAR(100) NOT NULL
+		, Value_Hash AS CONVERT( BINARY(32), HASHBYTES( 'SHA2_256', Value ) ) PERSISTED
+	)
+	CREATE UNIQUE INDEX UX_dim_Method_Value_Hash ON AirQuality_Staging.dbo.dim_Method ( Value_Hash )
+END
+
+IF OBJECT_ID( 'AirQuality_Staging.dbo.dim_Units' ) IS NULL
+BEGIN
+	CREATE TABLE AirQuality_Staging.dbo.dim_Units
+	(
+		ID INT IDENTITY(1, 1) PRIMARY KEY
+		, Value VARCHAR(50) NOT NULL
+		, Value_Hash AS CONVERT( BINARY(32), HASHBYTES( 'SHA2_256', Value ) ) PERSISTED
+	)
+	CREATE UNIQUE INDEX UX_dim_Units_Value_Hash ON AirQuality_Staging.dbo.dim_Units ( Value_Hash )
+END
+
 --=============================================================================
 -- A staging table to hold the data from the AirNow data provider
 --=============================================================================
@@ -300,10 +393,16 @@ CREATE TABLE AirQuality_Staging.dbo.AirNowData
 	, Parameter_Name VARCHAR(10)
 	, Reporting_Units VARCHAR(8)
 	, Reported_Value DECIMAL(9, 5)
-	, Reported_Data_Source VARCHAR(100)	
-	, URL_Source VARCHAR(1000)
+	, Data_Source_ID INT
+	, URL_Source_ID INT
+	, Valid_DateTime AS CONVERT( DATETIME, Valid_Date ) + CONVERT( DATETIME, Valid_Time ) PERSISTED
 )
 
+CREATE CLUSTERED INDEX CX_AirNowData_Date ON AirQuality_Staging.dbo.AirNowData ( Valid_Date, recID ) ON ps_Staging_Month ( Valid_Date )
+CREATE INDEX IX_AirNowData_NaturalKey ON AirQuality_Staging.dbo.AirNowData ( AQSID, Parameter_Name, Valid_Date, Valid_Time ) INCLUDE ( GMT_Offset, Reporting_Units, Reported_Value, Data_Source_ID ) ON ps_Staging_Month ( Valid_Date )
+CREATE INDEX IX_AirNowData_SiteDateTime ON AirQuality_Staging.dbo.AirNowData ( AQSID, Valid_DateTime ) ON ps_Staging_Month ( Valid_Date )
+CREATE INDEX IX_AirNowData_recID ON AirQuality_Staging.dbo.AirNowData ( recID ) INCLUDE ( AQSID, Parameter_Name, Valid_DateTime, GMT_Offset, Reporting_Units, Reported_Value ) ON ps_Staging_Month ( Valid_Date )
+
 --=============================================================================
 -- A staging table to hold the data from the EPA API
 --=============================================================================
@@ -326,7 +425,7 @@ CREATE TABLE AirQuality_Staging.dbo.EPA_API_Raw
 	, date_gmt DATE
 	, time_gmt TIME
 	, sample_measurement DECIMAL(9, 5)
-	, units_of_measure VARCHAR(50)
+	, units_of_measure_id INT
 	, units_of_measure_code CHAR(3)
 	, sample_duration VARCHAR(25)
 	, sample_duration_code VARCHAR(25)
@@ -335,11 +434,102 @@ CREATE TABLE AirQuality_Staging.dbo.EPA_API_Raw
 	, uncertainty VARCHAR(25)
 	, qualifier VARCHAR(100)
 	, method_type VARCHAR(25)
-	, method VARCHAR(100)
+	, method_id INT
 	, method_code CHAR(3)
 	, state VARCHAR(50)
 	, county VARCHAR(50)
 	, date_of_last_change DATE
 	, cbsa_code CHAR(5)
-	, URL_Source VARCHAR(1000)
-)
\ No newline at end of file
+	, URL_Source_ID INT
+	, datetime_local AS CONVERT( DATETIME, date_local ) + CONVERT( DATETIME, time_local ) PERSISTED
+)
+
+CREATE CLUSTERED INDEX CX_EPA_API_Raw_Date ON AirQuality_Staging.dbo.EPA_API_Raw ( date_local, recID ) ON ps_Staging_Month ( date_local )
+CREATE INDEX IX_EPA_API_Raw_NaturalKey ON AirQuality_Staging.dbo.EPA_API_Raw ( state_code, county_code, site_number, parameter_code, date_local, time_local, poc ) INCLUDE ( date_gmt, time_gmt, sample_measurement ) ON ps_Staging_Month ( date_local )
+CREATE INDEX IX_EPA_API_Raw_recID ON AirQuality_Staging.dbo.EPA_API_Raw ( recID ) ON ps_Staging_Month ( date_local )
+
+--=============================================================================
+-- A staging table to hold the daily summaries from the EPA API
+--=============================================================================
+IF OBJECT_ID( 'AirQuality_Staging.dbo.EPA_API_Daily' ) IS NOT NULL
+	DROP TABLE AirQuality_Staging.dbo.EPA_API_Daily
+CREATE TABLE AirQuality_Staging.dbo.EPA_API_Daily
+(
+	recID INT IDENTITY(1, 1)
+	, state_code CHAR(2)
+	, county_code CHAR(3)
+	, site_number CHAR(4)
+	, parameter_code CHAR(5)
+	, poc TINYINT
+	, latitude DECIMAL(9, 6)
+	, longitude DECIMAL(9, 6)
+	, datum CHAR(5)
+	, parameter VARCHAR(50)
+	, sample_duration_code VARCHAR(25)
+	, sample_duration VARCHAR(25)
+	, pollutant_standard VARCHAR(50)
+	, date_local DATE
+	, units_of_measure_id INT
+	, event_type VARCHAR(25)
+	, observation_count SMALLINT
+	, observation_percent DECIMAL(5, 1)
+	, validity_indicator CHAR(1)
+	, arithmetic_mean DECIMAL(12, 6)
+	, first_max_value DECIMAL(12, 6)
+	, first_max_hour TINYINT
+	, aqi SMALLINT
+	, method_code CHAR(3)
+	, method_id INT
+	, local_site_name VARCHAR(100)
+	, site_address VARCHAR(100)
+	, state VARCHAR(50)
+	, county VARCHAR(50)
+	, city VARCHAR(50)
+	, cbsa_code CHAR(5)
+	, cbsa VARCHAR(100)
+	, date_of_last_change DATE
+	, URL_Source_ID INT
+)
+
+GO
+
+--=============================================================================
+-- A staging table to hold the AirNow daily files used to catch up whole days
+--=============================================================================
+IF OBJECT_ID( 'AirQuality_Staging.dbo.AirNowDailyData' ) IS NOT NULL
+	DROP TABLE AirQuality_Staging.dbo.AirNowDailyData
+CREATE TABLE AirQuality_Staging.dbo.AirNowDailyData
+(
+	recID INT IDENTITY(1, 1)
+	, Valid_Date DATE
+	, AQSID CHAR(9)
+	, SiteName VARCHAR(64)
+	, Parameter_Name VARCHAR(12)
+	, Reporting_Units VARCHAR(8)
+	, Reported_Value DECIMAL(9,5)
+	, Averaging_Period TINYINT
+	, Data_Source_ID INT
+	, URL_Source_ID INT
+)
+
+GO
+
+--=============================================================================
+-- Staging tables with the dictionary encoded strings decoded
+--=============================================================================
+CREATE OR ALTER VIEW dbo.vw_AirNowData AS
+SELECT t.*, d0.Value AS Reported_Data_Source, d1.Value AS URL_Source
+FROM AirQuality_Staging.dbo.AirNowData t
+LEFT JOIN AirQuality_Staging.dbo.dim_Data_Source d0 ON d0.ID = t.Data_Source_ID
+LEFT JOIN AirQuality_Staging.dbo.dim_URL_Source d1 ON d1.ID = t.URL_Source_ID
+
+GO
+
+CREATE OR ALTER VIEW dbo.vw_EPA_API_Raw AS
+SELECT t.*, d0.Value AS units_of_measure, d1.Value AS method, d2.Value AS URL_Source
+FROM AirQuality_Staging.dbo.EPA_API_Raw t
+LEFT JOIN AirQuality_Staging.dbo.dim_Units d0 ON d0.ID = t.units_of_measure_id
+LEFT JOIN AirQuality_Staging.dbo.dim_Method d1 ON d1.ID = t.method_id
+LEFT JOIN AirQuality_Staging.dbo.dim_URL_Source d2 ON d2.ID = t.URL_Source_ID
+
+GO
\ No newline at end of file
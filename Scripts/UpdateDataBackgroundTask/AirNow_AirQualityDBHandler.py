@@ -1,7 +1,9 @@
 import sqlalchemy as SA
-import pandas as pd
 import logging
 from AirQualityDBHandler import AirQualityDBHandler
+from AirQualityRecordBatch import RecordBatch
+from AirQualityFactTables import DW_DATABASE, FACT_TABLES, DAILY_FACT_TABLE, SRC_AIRNOW, SRC_EPA
+from AirQualityFactLoader import AirQualityFactLoader
 
 class AirNow_AirQualityDBHandler(AirQualityDBHandler):
     """
@@ -12,9 +14,46 @@ class AirNow_AirQualityDBHandler(AirQualityDBHandler):
             self.Log (inherited)
             self.Engine (inherited)
             self.StagingTable
+            self.FileStateTable
+            self.DailyStagingTable
+            self.HourlyBackfillTable
+            self.FactLoaderWorkers
     """
-    def __init__( self, server: str, database: str, username: str, password: str, port: int = None, log: logging = None ):
+
+    # Staging layout (see AirQualityDBHandler.ensureStagingLayout).  The natural key index covers the
+    # staging MERGE match and the revision diff, the site / datetime index getLastInsertedDate and the
+    # recID index the fact loader's watermark read and the archive's promoted filter.
+    STAGING_DATE_COLUMN = 'Valid_Date'
+    STAGING_DATETIME_COLUMN = ( 'Valid_DateTime', 'CONVERT( DATETIME, Valid_Date ) + CONVERT( DATETIME, Valid_Time )' )
+    STAGING_INDEXES = {
+        'NaturalKey': ( [ 'AQSID', 'Parameter_Name', 'Valid_Date', 'Valid_Time' ], [ 'GMT_Offset', 'Reporting_Units', 'Reported_Value', 'Data_Source_ID' ] )
+        , 'SiteDateTime': ( [ 'AQSID', 'Valid_DateTime' ], [] )
+        , 'recID': ( [ 'recID' ], [ 'AQSID', 'Parameter_Name', 'Valid_DateTime', 'GMT_Offset', 'Reporting_Units', 'Reported_Value' ] )
+    }
+    ENCODED_COLUMNS = {
+        'Reported_Data_Source': ( 'Data_Source_ID', 'data_source' )
+        , 'URL_Source': ( 'URL_Source_ID', 'url_source' )
+    }
+    # temp table each RecordSchema is bulk loaded into before it is merged: ( name, columns after Row_Order )
+    BATCH_TABLES = {
+        'AirNowData': ( '#AirNowBatch', """
+            Valid_Date DATE, Valid_Time TIME, AQSID CHAR(9), SiteName VARCHAR(20), GMT_Offset VARCHAR(3)
+            , Parameter_Name VARCHAR(10), Reporting_Units VARCHAR(8), Reported_Value DECIMAL(9,5), Data_Source_ID INT, URL_Source_ID INT
+        """ )
+        , 'AirNowDailyData': ( '#AirNowDailyBatch', """
+            Valid_Date DATE, AQSID CHAR(9), SiteName VARCHAR(64), Parameter_Name VARCHAR(12), Reporting_Units VARCHAR(8)
+            , Reported_Value DECIMAL(9,5), Averaging_Period TINYINT, Data_Source_ID INT, URL_Source_ID INT
+        """ )
+    }
+    def __init__( self, server: str, database: str, username: str, password: str, port: int = None, log: logging = None
+                 , fact_workers: int = None ):
+        """
+            Parameters:
+                fact_workers (int) - fact tables updateDWFactTables writes at the same time (see AirQualityFactLoader)
+        """
         super().__init__( server, database, username, password, port, log )
+        self.FactLoaderWorkers = fact_workers
+        self._factLoader = None
         
     def createStagingTable( self, tableName: str ) -> bool:
         if self.checkIfTableExists( tableName ):
@@ -34,8 +73,8 @@ class AirNow_AirQualityDBHandler(AirQualityDBHandler):
                     , Parameter_Name VARCHAR(10)
                     , Reporting_Units VARCHAR(8)
                     , Reported_Value DECIMAL(9,5)
-                    , Reported_Data_Source VARCHAR(1000)
-                    , URL_Source VARCHAR(1000)
+                    , Data_Source_ID INT
+                    , URL_Source_ID INT
                 )
             """
             try:
@@ -56,7 +95,7 @@ class AirNow_AirQualityDBHandler(AirQualityDBHandler):
                 FROM (
                     SELECT
                         AQSID,
-                        MAX( CONVERT( DATETIME, Valid_Date ) + CONVERT( DATETIME, Valid_Time ) ) AS MX_DateTime
+                        MAX( Valid_DateTime ) AS MX_DateTime
                     FROM {self.Database}.dbo.{self.StagingTable}
                     WHERE AQSID IN ( {','.join( [f"'{aqsid}'" for aqsid in AQSIDs] )} )
                     GROUP BY AQSID
@@ -74,75 +113,487 @@ class AirNow_AirQualityDBHandler(AirQualityDBHandler):
             hour_found = None            
         return date_found, hour_found.hour
     
-    def insertIntoStagingTable( self, df: pd.DataFrame, file_url: str ) -> None:
+    def _loadBatchTable( self, conn, batch: RecordBatch, file_url: str ) -> str:
+        """
+            Bulk loads the batch into its BATCH_TABLES temp table, with each row's position in the
+            file (Row_Order) so the MERGEs can pick one row per key when a file repeats a key.
+
+            Returns:
+                Name of the temp table
+        """
+        tempTable, columnsSQL = self.BATCH_TABLES[batch.Schema.Name]
+        conn.execute( SA.text( f"""
+            DROP TABLE IF EXISTS {tempTable}
+            CREATE TABLE {tempTable} ( Row_Order INT, {columnsSQL} )
+        """ ) )
+        columns, mappings = self._stagingColumns( batch )
+        self._bulkInsert(
+            conn
+            , tempTable
+            , [ 'Row_Order' ] + columns + [ 'URL_Source_ID' ]
+            , batch
+            , mappings
+            , constants = ( self.Sources.id( 'url_source', file_url ), )
+            , row_order = True
+        )
+        return tempTable
+
+    def insertIntoStagingTable( self, batch: RecordBatch, file_url: str ) -> None:
+        """
+            Inserts the rows of an hourly file that are not in staging yet: the batch is bulk loaded
+            into a temp table and merged in one statement (the first row wins when a key repeats).
+            Errors are logged and raised, so the file is not recorded as loaded.
+        """
         try:
-            with self.Engine.connect() as conn:
-                total_inserted = 0
-                for index, row in df.iterrows():
-                    merge_stmt = SA.text( f"""
-                        MERGE 
-                        INTO {self.Database}.dbo.{self.StagingTable} AS target
-                        USING 
-                        ( 
-                            VALUES 
-                            ( 
-                                :Valid_date, :Valid_time, :AQSID, :sitename, :GMT_offset, :parameter_name
-                                , :reporting_units, :Reported_Value, :Reported_Data_Source, :URL_Source
-                            )
-                        ) AS source
+            with self.Engine.begin() as conn:
+                tempTable = self._loadBatchTable( conn, batch, file_url )
+                merge_stmt = SA.text( f"""
+                    MERGE 
+                    INTO {self.Database}.dbo.{self.StagingTable} AS target
+                    USING
+                    (
+                        SELECT *
+                        FROM (
+                            SELECT *, Key_Row = ROW_NUMBER() OVER ( PARTITION BY AQSID, Parameter_Name, Valid_Date, Valid_Time ORDER BY Row_Order )
+                            FROM {tempTable}
+                        ) b
+                        WHERE Key_Row = 1
+                    ) AS source
+                    ON 
+                        target.AQSID = source.AQSID 
+                        AND target.Valid_Date = source.Valid_Date 
+                        AND target.Valid_Time = source.Valid_Time 
+                        AND target.Parameter_Name = source.Parameter_Name
+                    WHEN NOT MATCHED THEN
+                        INSERT 
                         (
-                            Valid_date, Valid_time, AQSID, sitename, GMT_offset, parameter_name
-                            , reporting_units, Reported_Value, Reported_Data_Source, URL_Source 
+                            Valid_Date, Valid_Time, AQSID, SiteName, GMT_Offset, Parameter_Name
+                            , Reporting_Units, Reported_Value, Data_Source_ID, URL_Source_ID
                         )
-                        ON 
-                            target.AQSID = source.AQSID 
-                            AND target.Valid_date = source.Valid_date 
-                            AND target.Valid_time = source.Valid_time 
-                            AND target.parameter_name = source.parameter_name
-                        WHEN NOT MATCHED THEN
-                            INSERT 
-                            (
-                                Valid_date, Valid_time, AQSID, sitename, GMT_offset, parameter_name
-                                , reporting_units, Reported_Value, Reported_Data_Source, URL_Source
-                            )
-                            VALUES 
-                            (
-                                source.Valid_date, source.Valid_time, source.AQSID, source.sitename, source.GMT_offset, source.parameter_name
-                                , source.reporting_units, source.Reported_Value, source.Reported_Data_Source, source.URL_Source
-                            )
-                        OUTPUT $action;
-                    """ )
-                    result = conn.execute( merge_stmt, {
-                        'Valid_date': row['Valid date']
-                        , 'Valid_time': row['valid time']
-                        , 'AQSID': row['AQSID']
-                        , 'sitename': row['sitename']
-                        , 'GMT_offset': row['GMT offset']
-                        , 'parameter_name': row['parameter name']
-                        , 'reporting_units': row['reporting units']
-                        , 'Reported_Value': row['value']
-                        , 'Reported_Data_Source': row['data source']
-                        , 'URL_Source': file_url
-                    } )                    
-                    total_inserted += sum( 1 for row in result if row[0] == 'INSERT' )
-                    conn.commit()
+                        VALUES 
+                        (
+                            source.Valid_Date, source.Valid_Time, source.AQSID, source.SiteName, source.GMT_Offset, source.Parameter_Name
+                            , source.Reporting_Units, source.Reported_Value, source.Data_Source_ID, source.URL_Source_ID
+                        );
+                """ )
+                total_inserted = conn.execute( merge_stmt ).rowcount
 
             log_message = f"Data successfully inserted into SQL Server. Total records inserted: {total_inserted}"
             self.Log.info( log_message ) if self.Log else print( log_message )
         except Exception as e:
             log_message = f"Error inserting data into SQL Server: {e}"
             self.Log.error( log_message ) if self.Log else print( log_message )
+            raise
     
+    def setFileStateTable( self, tableName: str = 'AirNowFileState' ) -> bool:
+        """
+            Sets (and creates if needed) the table that remembers the ETag, Last-Modified
+            header and content hash of every hourly file that has been loaded.
+        """
+        self.FileStateTable = tableName
+        if self.checkIfTableExists( tableName ):
+            return True
+        SQLCode = f"""
+            CREATE TABLE {self.Database}.dbo.{tableName}
+            (
+                File_URL VARCHAR(400) NOT NULL PRIMARY KEY
+                , ETag VARCHAR(200)
+                , Last_Modified VARCHAR(50)
+                , Content_Hash CHAR(64)
+                , Last_Checked DATETIME2(0)
+            )
+        """
+        try:
+            with self.Engine.connect() as conn:
+                conn.execute( SA.text( SQLCode ) )
+                conn.commit()
+            return self.checkIfTableExists( tableName )
+        except Exception as e:
+            log_message = f"Error creating table: {tableName}.  {e}"
+            self.Log.error( log_message ) if self.Log else print( log_message )
+            return False
+
+    def getFileStates( self, fileURLs: list[str] ) -> dict[str, dict]:
+        """
+            Returns the stored ETag, Last-Modified and content hash for each of the given file urls that has been loaded before.
+        """
+        if not fileURLs:
+            return {}
+        SQLCode = SA.text( f"""
+            SELECT File_URL, ETag, Last_Modified, Content_Hash
+            FROM {self.Database}.dbo.{self.FileStateTable}
+            WHERE File_URL IN :fileURLs
+        """ ).bindparams( SA.bindparam( 'fileURLs', expanding = True ) )
+        try:
+            with self.Engine.connect() as conn:
+                rows = conn.execute( SQLCode, { 'fileURLs': list( fileURLs ) } ).fetchall()
+            return { url: { 'etag': etag, 'last_modified': last_modified, 'content_hash': content_hash } for url, etag, last_modified, content_hash in rows }
+        except Exception as e:
+            log_message = f"Error retrieving file states from SQL table: {self.FileStateTable}.  {e}"
+            self.Log.error( log_message ) if self.Log else print( log_message )
+            return {}
+
+    def saveFileState( self, fileURL: str, etag: str, lastModified: str, contentHash: str ) -> None:
+        SQLCode = SA.text( f"""
+            MERGE INTO {self.Database}.dbo.{self.FileStateTable} AS target
+            USING ( VALUES ( :File_URL, :ETag, :Last_Modified, :Content_Hash ) ) AS source ( File_URL, ETag, Last_Modified, Content_Hash )
+            ON target.File_URL = source.File_URL
+            WHEN MATCHED THEN
+                UPDATE SET ETag = source.ETag, Last_Modified = source.Last_Modified, Content_Hash = source.Content_Hash, Last_Checked = SYSUTCDATETIME()
+            WHEN NOT MATCHED THEN
+                INSERT ( File_URL, ETag, Last_Modified, Content_Hash, Last_Checked )
+                VALUES ( source.File_URL, source.ETag, source.Last_Modified, source.Content_Hash, SYSUTCDATETIME() );
+        """ )
+        try:
+            with self.Engine.connect() as conn:
+                conn.execute( SQLCode, { 'File_URL': fileURL, 'ETag': etag, 'Last_Modified': lastModified, 'Content_Hash': contentHash } )
+                conn.commit()
+        except Exception as e:
+            log_message = f"Error saving file state for: {fileURL}.  {e}"
+            self.Log.error( log_message ) if self.Log else print( log_message )
+
+    def reviseStagingRows( self, batch: RecordBatch, file_url: str ) -> int:
+        """
+            Applies a republished hourly file to the staging table.
+
+            The file rows are bulk loaded into a temp table and diffed against staging in one MERGE
+            (the last row wins when a key repeats).  Only rows whose value, units or data source
+            changed are updated (new rows are inserted), and those rows are requeued so the next fact
+            table update rewrites their fact rows (and the ozone rolling averages and combined AQIs
+            that include them).
+
+            Returns:
+                Number of staging rows inserted or updated.  Errors are logged and raised.
+        """
+        if batch.empty:
+            return 0
+
+        try:
+            with self.Engine.begin() as conn:
+                tempTable = self._loadBatchTable( conn, batch, file_url )
+                conn.execute( SA.text( """
+                    DROP TABLE IF EXISTS #AirNowChangedKeys
+                    CREATE TABLE #AirNowChangedKeys ( recID INT )
+                """ ) )
+
+                # AirNow valid dates and times are GMT; the fact tables are keyed on local time
+                merge_stmt = SA.text( f"""
+                    MERGE INTO {self.Database}.dbo.{self.StagingTable} AS target
+                    USING
+                    (
+                        SELECT *
+                        FROM (
+                            SELECT *, Key_Row = ROW_NUMBER() OVER ( PARTITION BY AQSID, Parameter_Name, Valid_Date, Valid_Time ORDER BY Row_Order DESC )
+                            FROM {tempTable}
+                        ) b
+                        WHERE Key_Row = 1
+                    ) AS source
+                    ON
+                        target.AQSID = source.AQSID
+                        AND target.Valid_Date = source.Valid_Date
+                        AND target.Valid_Time = source.Valid_Time
+                        AND target.Parameter_Name = source.Parameter_Name
+                    WHEN MATCHED AND EXISTS (
+                        SELECT source.Reported_Value, source.Reporting_Units, source.Data_Source_ID
+                        EXCEPT
+                        SELECT target.Reported_Value, target.Reporting_Units, target.Data_Source_ID
+                    ) THEN
+                        UPDATE SET
+                            Reported_Value = source.Reported_Value
+                            , Reporting_Units = source.Reporting_Units
+                            , Data_Source_ID = source.Data_Source_ID
+                            , URL_Source_ID = source.URL_Source_ID
+                    WHEN NOT MATCHED THEN
+                        INSERT
+                        (
+                            Valid_Date, Valid_Time, AQSID, SiteName, GMT_Offset, Parameter_Name
+                            , Reporting_Units, Reported_Value, Data_Source_ID, URL_Source_ID
+                        )
+                        VALUES
+                        (
+                            source.Valid_Date, source.Valid_Time, source.AQSID, source.SiteName, source.GMT_Offset, source.Parameter_Name
+                            , source.Reporting_Units, source.Reported_Value, source.Data_Source_ID, source.URL_Source_ID
+                        )
+                    OUTPUT inserted.recID INTO #AirNowChangedKeys ( recID );
+                """ )
+                total_changed = conn.execute( merge_stmt ).rowcount
+
+                if total_changed:
+                    # new rows are past the fact loader's watermark already, requeuing them as well is harmless
+                    self.factLoader().requeue( conn, '#AirNowChangedKeys' )
+
+            log_message = f"Revision of {file_url} applied. Total staging records inserted or updated: {total_changed}"
+            self.Log.info( log_message ) if self.Log else print( log_message )
+            return total_changed
+        except Exception as e:
+            log_message = f"Error applying revision of {file_url} to SQL Server: {e}"
+            self.Log.error( log_message ) if self.Log else print( log_message )
+            raise
+
+    def _promotedFilter( self, conn ) -> tuple[str, dict]:
+        # rows up to the fact loader's watermark have been merged into the fact tables, except requeued revisions
+        loader = self.factLoader()
+        last_recid = loader.lastRecID( conn )
+        if not last_recid:
+            return None, {}
+        return ( f"recID <= :last_recid AND recID NOT IN ( SELECT recID FROM {self.Database}.dbo.{loader.REQUEUE_TABLE} WHERE Source_Table = :source_table )"
+                , { 'last_recid': last_recid, 'source_table': self.StagingTable } )
+
+    def factLoader( self ) -> AirQualityFactLoader:
+        """
+            Fact loader of the staging table, created (with its state tables) on first use.
+        """
+        if self._factLoader is None or self._factLoader.StagingTable != self.StagingTable:
+            self._factLoader = AirQualityFactLoader( self.Engine, self.Database, self.StagingTable, workers = self.FactLoaderWorkers, log = self.Log )
+            self._factLoader.createStateTables()
+        return self._factLoader
+
     def updateDWFactTables( self ) -> None:
+        """
+            Loads the staging rows added or revised since the last update into the fact tables,
+            one pollutant table per pooled connection at the same time, then the combined AQI.
+        """
         log_message = "Updating data warehouse fact tables."
         self.Log.info( log_message ) if self.Log else print( log_message )
+        try:
+            written = self.factLoader().run()
+            log_message = f"Fact tables updated. Total fact records inserted or updated: {written}"
+            self.Log.info( log_message ) if self.Log else print( log_message )
+        except Exception as e:
+            log_message = f"Error updating DW fact tables on SQL server. {e}"
+            self.Log.error( log_message ) if self.Log else print( log_message )
+
+    # =========================================================================
+    # Daily files (catch-up of whole days)
+    # =========================================================================
+    def setDailyStagingTable( self, dailyTable: str = 'AirNowDailyData', createIfNotExists: bool = True ) -> bool:
+        self.DailyStagingTable = dailyTable
+        if not self.checkIfTableExists( self.DailyStagingTable ):
+            if createIfNotExists:
+                return self.createDailyStagingTable( self.DailyStagingTable )
+            return False
+        return True
+
+    def setHourlyBackfillTable( self, tableName: str = 'AirNowHourlyBackfill' ) -> bool:
+        """
+            Sets (and creates if needed) the queue of days caught up from daily files whose hourly
+            files are still to be loaded.  Each staging table has its own queue entries.
+        """
+        self.HourlyBackfillTable = tableName
+        if self.checkIfTableExists( tableName ):
+            return True
+        SQLCode = f"""
+            CREATE TABLE {self.Database}.dbo.{tableName}
+            (
+                Staging_Table VARCHAR(128) NOT NULL
+                , Valid_Date DATE NOT NULL
+                , Queued DATETIME2(0) NOT NULL DEFAULT SYSUTCDATETIME()
+                , PRIMARY KEY ( Staging_Table, Valid_Date )
+            )
+        """
+        try:
+            with self.Engine.connect() as conn:
+                conn.execute( SA.text( SQLCode ) )
+                conn.commit()
+            return self.checkIfTableExists( tableName )
+        except Exception as e:
+            log_message = f"Error creating table: {tableName}.  {e}"
+            self.Log.error( log_message ) if self.Log else print( log_message )
+            return False
+
+    def queueHourlyBackfill( self, days ) -> None:
+        """
+            Queues GMT days for their hourly files (days already queued are kept once).
+        """
+        days = sorted( days )
+        if not days:
+            return
+        with self.Engine.begin() as conn:
+            conn.execute( SA.text( f"""
+                MERGE INTO {self.Database}.dbo.{self.HourlyBackfillTable} AS target
+                USING ( VALUES ( :Staging_Table, :Valid_Date ) ) AS source ( Staging_Table, Valid_Date )
+                ON target.Staging_Table = source.Staging_Table AND target.Valid_Date = source.Valid_Date
+                WHEN NOT MATCHED THEN INSERT ( Staging_Table, Valid_Date ) VALUES ( source.Staging_Table, source.Valid_Date );
+            """ ), [ { 'Staging_Table': self.StagingTable, 'Valid_Date': day } for day in days ] )
+
+    def getHourlyBackfillDays( self, limit: int = None ) -> list:
+        """
+            Queued days, oldest first, at most limit of them.
+        """
+        top = f"TOP ( {int( limit )} )" if limit else ''
+        with self.Engine.connect() as conn:
+            return [ row[0] for row in conn.execute( SA.text( f"""
+                SELECT {top} Valid_Date FROM {self.Database}.dbo.{self.HourlyBackfillTable}
+                WHERE Staging_Table = :t ORDER BY Valid_Date
+            """ ), { 't': self.StagingTable } ) ]
+
+    def clearHourlyBackfill( self, day ) -> None:
+        with self.Engine.begin() as conn:
+            conn.execute( SA.text( f"DELETE FROM {self.Database}.dbo.{self.HourlyBackfillTable} WHERE Staging_Table = :t AND Valid_Date = :d" )
+                          , { 't': self.StagingTable, 'd': day } )
+
+    def createDailyStagingTable( self, tableName: str ) -> bool:
+        """
+            Staging table for AirNow daily files, one row per site, parameter (with its averaging
+            period, e.g. OZONE-8HR) and local day.
+        """
+        SQLCode = f"""
+            CREATE TABLE {self.Database}.dbo.{tableName}
+            (
+                recID INT IDENTITY(1, 1)
+                , Valid_Date DATE
+                , AQSID CHAR(9)
+                , SiteName VARCHAR(64)
+                , Parameter_Name VARCHAR(12)
+                , Reporting_Units VARCHAR(8)
+                , Reported_Value DECIMAL(9,5)
+                , Averaging_Period TINYINT
+                , Data_Source_ID INT
+                , URL_Source_ID INT
+            )
+        """
         try:
             with self.Engine.connect() as conn:
-                SQL_Code = f"EXEC {self.Database}.dbo.spUpdateFactTables_w_AirNow"
-                conn.execute( SA.text( SQL_Code ) )
+                conn.execute( SA.text( SQLCode ) )
                 conn.commit()
-            log_message = "Fact tables updated."
+                log_message = f"{self.Database}.dbo.{tableName} has been successfully created."
+                self.Log.info( log_message ) if self.Log else print( log_message )
+            return self.checkIfTableExists( tableName )
+        except Exception as e:
+            log_message = f"Error creating table: {tableName}.  {e}"
+            self.Log.error( log_message ) if self.Log else print( log_message )
+            return False
+
+    def insertIntoDailyStagingTable( self, batch: RecordBatch, file_url: str ) -> int:
+        """
+            Merges the rows of a daily file into the daily staging table: new keys are inserted and
+            keys whose value changed are updated (the last row wins when a key repeats).
+
+            Returns:
+                Number of daily staging rows inserted or updated.  Errors are logged and raised.
+        """
+        try:
+            with self.Engine.begin() as conn:
+                tempTable = self._loadBatchTable( conn, batch, file_url )
+                total_merged = conn.execute( SA.text( f"""
+                    MERGE INTO {self.Database}.dbo.{self.DailyStagingTable} AS target
+                    USING
+                    (
+                        SELECT *
+                        FROM (
+                            SELECT *, Key_Row = ROW_NUMBER() OVER ( PARTITION BY AQSID, Parameter_Name, Valid_Date ORDER BY Row_Order DESC )
+                            FROM {tempTable}
+                        ) b
+                        WHERE Key_Row = 1
+                    ) AS source
+                    ON
+                        target.AQSID = source.AQSID
+                        AND target.Parameter_Name = source.Parameter_Name
+                        AND target.Valid_Date = source.Valid_Date
+                    WHEN MATCHED AND EXISTS (
+                        SELECT source.Reported_Value, source.Reporting_Units, source.Averaging_Period
+                        EXCEPT
+                        SELECT target.Reported_Value, target.Reporting_Units, target.Averaging_Period
+                    ) THEN
+                        UPDATE SET
+                            Reported_Value = source.Reported_Value
+                            , Reporting_Units = source.Reporting_Units
+                            , Averaging_Period = source.Averaging_Period
+                            , Data_Source_ID = source.Data_Source_ID
+                            , URL_Source_ID = source.URL_Source_ID
+                    WHEN NOT MATCHED THEN
+                        INSERT
+                        (
+                            Valid_Date, AQSID, SiteName, Parameter_Name, Reporting_Units
+                            , Reported_Value, Averaging_Period, Data_Source_ID, URL_Source_ID
+                        )
+                        VALUES
+                        (
+                            source.Valid_Date, source.AQSID, source.SiteName, source.Parameter_Name, source.Reporting_Units
+                            , source.Reported_Value, source.Averaging_Period, source.Data_Source_ID, source.URL_Source_ID
+                        );
+                """ ) ).rowcount
+
+            log_message = f"Daily file {file_url} merged. Total daily staging records inserted or updated: {total_merged}"
             self.Log.info( log_message ) if self.Log else print( log_message )
+            return total_merged
         except Exception as e:
-            log_message = f"Error updating DW fact tables on SQL server. {e}"
-            self.Log.error( log_message ) if self.Log else print( log_message )
\ No newline at end of file
+            log_message = f"Error inserting daily file {file_url} into SQL Server: {e}"
+            self.Log.error( log_message ) if self.Log else print( log_message )
+            raise
+
+    def updateDailyFactTable( self, dw_database: str = DW_DATABASE ) -> int:
+        """
+            MERGEs the daily staging rows loaded since the last run into the daily summary fact table.
+
+            The parameter prefix of the file's parameter name maps to the AQS parameter code and its
+            averaging period becomes the sample duration.  Values of 24 hour averages are stored as
+            the arithmetic mean, shorter averaging periods report the day's maximum and are stored as
+            the first max value.  AirNow's durations and standards do not line up with EPA's, so a
+            site, parameter and day that already has an EPA dailyData (validated) row is skipped, and
+            EPA_AirQualityDBHandler.updateDailyFactTable removes the AirNow rows its rows replace.
+
+            Returns:
+                Number of fact rows inserted or updated
+        """
+        parameter_codes = ', '.join( f"( '{name}', '{code}' )" for name, ( _, _, code ) in FACT_TABLES.items() )
+        with self.Engine.begin() as conn:
+            last_recid = self._getWatermark( conn, self.DailyStagingTable )
+            max_recid = conn.execute( SA.text( f"SELECT MAX( recID ) FROM {self.Database}.dbo.{self.DailyStagingTable}" ) ).scalar() or 0
+            if max_recid <= last_recid:
+                return 0
+
+            rows = conn.execute( SA.text( f"""
+                MERGE INTO {dw_database}.dbo.{DAILY_FACT_TABLE} AS target
+                USING (
+                    SELECT *
+                    FROM (
+                        SELECT
+                            Full_Site_Number = CONVERT( CHAR(11), SUBSTRING( s.AQSID, 1, 2 ) + '-' + SUBSTRING( s.AQSID, 3, 3 ) + '-' + SUBSTRING( s.AQSID, 6, 4 ) )
+                            , Date_Local = s.Valid_Date
+                            , Parameter_Code = p.Parameter_Code
+                            , Parameter_Name = s.Parameter_Name
+                            , Sample_Duration = CONCAT( s.Averaging_Period, ' HOUR' )
+                            , Pollutant_Standard = ''
+                            , Units_of_Measure = s.Reporting_Units
+                            , Arithmetic_Mean = CASE WHEN s.Averaging_Period >= 24 THEN s.Reported_Value END
+                            , First_Max_Value = CASE WHEN s.Averaging_Period < 24 THEN s.Reported_Value END
+                            , rn = ROW_NUMBER() OVER ( PARTITION BY s.AQSID, s.Parameter_Name, s.Valid_Date ORDER BY s.recID DESC )
+                        FROM {self.Database}.dbo.{self.DailyStagingTable} s
+                        JOIN ( VALUES {parameter_codes} ) AS p ( Parameter_Prefix, Parameter_Code )
+                            ON p.Parameter_Prefix = UPPER( LEFT( s.Parameter_Name, CHARINDEX( '-', s.Parameter_Name + '-' ) - 1 ) )
+                        WHERE s.recID > :last_recid AND s.recID <= :max_recid
+                            AND s.Averaging_Period IS NOT NULL
+                    ) AS ranked
+                    WHERE rn = 1
+                        AND NOT EXISTS (
+                            SELECT 1 FROM {dw_database}.dbo.{DAILY_FACT_TABLE} e
+                            WHERE e.Full_Site_Number = ranked.Full_Site_Number
+                                AND e.Parameter_Code = ranked.Parameter_Code
+                                AND e.Date_Local = ranked.Date_Local
+                                AND e.src = :epa_src
+                        )
+                ) AS source
+                ON target.Full_Site_Number = source.Full_Site_Number
+                    AND target.Parameter_Code = source.Parameter_Code
+                    AND target.Date_Local = source.Date_Local
+                    AND target.Sample_Duration = source.Sample_Duration
+                    AND target.Pollutant_Standard = source.Pollutant_Standard
+                WHEN MATCHED AND target.src = :src THEN UPDATE SET
+                    Parameter_Name = source.Parameter_Name
+                    , Units_of_Measure = source.Units_of_Measure
+                    , Arithmetic_Mean = source.Arithmetic_Mean
+                    , First_Max_Value = source.First_Max_Value
+                WHEN NOT MATCHED THEN INSERT
+                    ( Full_Site_Number, Date_Local, Parameter_Code, Parameter_Name, Sample_Duration, Pollutant_Standard, Units_of_Measure
+                    , Arithmetic_Mean, First_Max_Value, src )
+                VALUES
+                    ( source.Full_Site_Number, source.Date_Local, source.Parameter_Code, source.Parameter_Name, source.Sample_Duration, source.Pollutant_Standard, source.Units_of_Measure
+                    , source.Arithmetic_Mean, source.First_Max_Value, :src );
+            """ ), { 'last_recid': last_recid, 'max_recid': max_recid, 'src': SRC_AIRNOW, 'epa_src': SRC_EPA } ).rowcount
+
+            self._setWatermark( conn, self.DailyStagingTable, max_recid )
+
+        log_message = f"Merged {rows} AirNow daily rows into {dw_database}.dbo.{DAILY_FACT_TABLE}"
+        self.Log.info( log_message ) if self.Log else print( log_message )
+        return rows
@@ -1,13 +1,18 @@
 import time
+import hashlib
 import requests
 import logging
+from functools import partial
+from contextlib import nullcontext
 import pandas as pd
 from datetime import datetime, timedelta, timezone
 from io import StringIO
-from bs4 import BeautifulSoup
-from selenium import webdriver
-from selenium.webdriver.chrome.options import Options
 from AirNow_AirQualityDBHandler import AirNow_AirQualityDBHandler
+from AirQualityHotWindow import AirQualityHotWindow
+from AirQualityCoverageIndex import AirQualityCoverageIndex
+from AirQualityProfiler import AirQualityProfiler
+from AirQualityPipeline import AirQualityPipeline
+from AirQualityRecordBatch import RecordBatch, AIRNOW_HOURLY_SCHEMA, AIRNOW_DAILY_SCHEMA
 
 class AirNow_AirQualityDataUpdater:
     """
@@ -16,46 +21,327 @@ class AirNow_AirQualityDataUpdater:
             - Pandas
             - BeautifulSoup
             - Selenium
+            - AirQualityHotWindow (optional, fed with every loaded file)
+            - AirQualityCoverageIndex (optional, marked with every loaded file and used for gap repair)
+            - AirQualityProfiler (optional, profiles runUpdate cycles on demand)
+            - AirQualityPipeline (files are fetched, parsed and loaded by overlapping stages)
+
+        With a daily staging table, days missed entirely (e.g. after an outage) are caught up
+        from the day's daily file instead of its 24 hourly files (see catchUpDays), and queued
+        for their hourly files.  The queue is only drained on request (backfillHourlyDays, the
+        backfill-airnow command) unless hourly_backfill_days is set: loading every caught up
+        day's hourly files would cost more downloads than not catching up at all.
     """
 
-    def __init__( self, database: str, staging_tablename: str, AQSIDs: list[str], DBHandler: AirNow_AirQualityDBHandler, log: logging = None ):
+    # workers per pipeline stage; loading stays on one worker so files are applied in order
+    PIPELINE_WORKERS = { 'fetch': 4, 'parse': 2 }
+
+    # hourly file columns (the files have no header) by AIRNOW_HOURLY_SCHEMA column
+    HOURLY_FILE_COLUMNS = {
+        'Valid_Date': 'Valid date'
+        , 'Valid_Time': 'valid time'
+        , 'AQSID': 'AQSID'
+        , 'SiteName': 'sitename'
+        , 'GMT_Offset': 'GMT offset'
+        , 'Parameter_Name': 'parameter name'
+        , 'Reporting_Units': 'reporting units'
+        , 'Reported_Value': 'value'
+        , 'Reported_Data_Source': 'data source'
+    }
+    HOURLY_FILE_DATE_FORMAT = '%m/%d/%y'
+
+    # daily file columns by AIRNOW_DAILY_SCHEMA column
+    DAILY_FILE_COLUMNS = {
+        'Valid_Date': 'Valid date'
+        , 'AQSID': 'AQSID'
+        , 'SiteName': 'sitename'
+        , 'Parameter_Name': 'parameter name'
+        , 'Reporting_Units': 'reporting units'
+        , 'Reported_Value': 'value'
+        , 'Averaging_Period': 'averaging period'
+        , 'Reported_Data_Source': 'data source'
+    }
+
+    def __init__( self, database: str, staging_tablename: str, AQSIDs: list[str], DBHandler: AirNow_AirQualityDBHandler, log: logging = None, revision_window_hours: int = 48, hot_window: AirQualityHotWindow = None, coverage: AirQualityCoverageIndex = None, profiler: AirQualityProfiler = None
+                 , pipeline_workers: dict[str, int] = None, pipeline_queue_size: int = 4, daily_tablename: str = None, hourly_backfill_days: int = 0 ):
         self.Database = database
         self.airNowTable = staging_tablename
         self.AQSIDs = AQSIDs
         self.DBHandler = DBHandler
         self.Log = log
+        self.RevisionWindowHours = revision_window_hours
+        self.HotWindow = hot_window
+        self.Coverage = coverage
+        self.Profiler = profiler
+        self.PipelineWorkers = { **self.PIPELINE_WORKERS, **( pipeline_workers or {} ) }
+        self.PipelineQueueSize = pipeline_queue_size
         
         # Ensure AirNow table exists in the database.  If not, create it.
         self.DBHandler.setStagingTable( self.airNowTable, True )
+        self.DBHandler.setFileStateTable()
+
+        # Daily files are optional, only used for catch-up when a daily staging table is given
+        self.DailyTable = daily_tablename
+        self.HourlyBackfillDays = hourly_backfill_days
+        if self.DailyTable:
+            self.DBHandler.setDailyStagingTable( self.DailyTable, True )
+            self.DBHandler.createDailyFactTable()
+            self.DBHandler.setHourlyBackfillTable()
 
     def runUpdate( self ) -> None:
         """
             Main driver of class
             - get the last inserted date and hour (DB Handler)
+            - catch up the days after the last inserted date and before today from daily files and
+              queue them for their hourly files (daily table only)
             - check for available files 
-                - starting with the last inserted date going until now
-            - download and process files
+                - starting with the last inserted date going until now, skipping caught up days
+            - download, parse and load the files in a pipeline (listing the next day overlaps with loading the current one)
                 - get the file
                 - read pipe-delimited csv into dataframe
                 - insert pertinent records into the AirNow staging table (DB Handler)
-            - update DW fact tables (DB Handler)
+            - re-check the trailing revision window for republished files
+            - load the hourly files of the oldest queued caught up days (daily table and hourly_backfill_days only)
+            - update DW fact tables (DB Handler), and the daily summary fact table (daily table only)
+        """
+        with self._cycle( 'AirNow_runUpdate' ):
+            with self._stage( 'getLastInsertedDate' ):
+                lastDateFound, lastHourFound = self.DBHandler.getLastInsertedDate( self.AQSIDs )
+            
+            current_date = datetime.now( timezone.utc ).date() #file names are based on GMT time
+            caught_up = set()
+            if self.DailyTable:
+                # the last inserted day is partly loaded and today is still in progress, both stay hourly
+                with self._stage( 'catchUpDays' ):
+                    caught_up = self.catchUpDays( lastDateFound + timedelta( days = 1 ), current_date - timedelta( days = 1 ) )
+                    self.DBHandler.queueHourlyBackfill( caught_up )
+            self._loadFiles( self._newFiles( lastDateFound, lastHourFound, current_date, caught_up ) )
+            with self._stage( 'recheckRecentFiles' ):
+                self.recheckRecentFiles()
+            if self.DailyTable and self.HourlyBackfillDays:
+                with self._stage( 'backfillHourlyDays' ):
+                    self.backfillHourlyDays( self.HourlyBackfillDays )
+            with self._stage( 'updateDWFactTables' ):
+                self.DBHandler.updateDWFactTables()
+                if self.DailyTable:
+                    self.DBHandler.updateDailyFactTable()
+
+    def _newFiles( self, lastDateFound, lastHourFound: int, current_date, skip_dates: set = frozenset() ):
+        """
+            Yields the ( date, hour ) of every file published after the last inserted one.
+            Runs on the pipeline's feeding thread, so each day is listed while the files
+            of the previous day are still being loaded.
+
+            Parameters:
+                skip_dates (set) - days already loaded from their daily file, neither listed nor fetched
         """
-        lastDateFound, lastHourFound = self.DBHandler.getLastInsertedDate( self.AQSIDs )
-        
-        current_date = datetime.now( timezone.utc ).date() #file names are based on GMT time
-        
         # Iterate through each day from the last inserted date to the current date
         date_to_check = lastDateFound
         while date_to_check <= current_date:
-            available_files = self.check_for_available_files( date_to_check )
+            if date_to_check in skip_dates:
+                date_to_check += timedelta( days = 1 )
+                continue
+            with self._stage( 'check_for_available_files' ):
+                available_files = self.check_for_available_files( date_to_check )
             for file_date, hour in available_files:
                 if file_date == lastDateFound and hour <= lastHourFound:
                     # skip
                     self.Log.debug( f"Skipping file with date: {file_date} and hour: {hour}" )
                 else:
-                    self.download_and_process_files( file_date, hour )
+                    yield file_date, hour
             date_to_check += timedelta( days = 1 )
-        self.DBHandler.updateDWFactTables()
+
+    def _loadFiles( self, files ) -> int:
+        """
+            Fetches, parses and loads hourly files through a bounded fetch -> parse -> load pipeline.
+            A file that fails to download or parse is logged and skipped; a load failure cancels the
+            remaining files and is raised.
+
+            Parameters:
+                files (iterable) - ( date, hour ) of the files to load
+
+            Returns:
+                Number of files loaded
+        """
+        pipeline = AirQualityPipeline( 'AirNow', queue_size = self.PipelineQueueSize, log = self.Log )
+        pipeline.addStage( 'fetch', self._fetch_file, workers = self.PipelineWorkers['fetch'] )
+        pipeline.addStage( 'parse', self._parse_file, workers = self.PipelineWorkers['parse'] )
+        pipeline.addStage( 'load', self._load_file, ordered = True )
+        stats = pipeline.run( files )
+        return stats['load']['items'] - stats['load']['dropped']
+
+    def _cycle( self, name: str ):
+        return self.Profiler.cycle( name ) if self.Profiler is not None else nullcontext()
+
+    def _stage( self, name: str ):
+        return self.Profiler.stage( name ) if self.Profiler is not None else nullcontext()
+
+    def recheckRecentFiles( self, hours: int = None ) -> int:
+        """
+            AirNow republishes hourly files as late data arrives.  Re-checks the files for the
+            trailing window of hours with conditional GETs (ETag / Last-Modified) and only
+            re-processes a file when its content hash differs from the one stored when it was
+            last loaded.
+
+            Parameters:
+                hours (int) - size of the trailing window, defaults to self.RevisionWindowHours
+
+            Returns:
+                Number of files that had changed and were re-applied
+        """
+        hours = hours if hours is not None else self.RevisionWindowHours
+        now = datetime.now( timezone.utc ).replace( minute = 0, second = 0, microsecond = 0 )
+        file_hours = [ now - timedelta( hours = h ) for h in range( 1, hours + 1 ) ]
+        file_urls = { self._file_url( fh.date(), fh.hour ): fh for fh in file_hours }
+        states = self.DBHandler.getFileStates( list( file_urls ) )
+
+        files_revised = 0
+        for file_url in file_urls:
+            state = states.get( file_url )
+            if state is None:
+                # never loaded (or loaded before file states were tracked), the regular update handles new files
+                continue
+            headers = {}
+            if state['etag']:
+                headers['If-None-Match'] = state['etag']
+            if state['last_modified']:
+                headers['If-Modified-Since'] = state['last_modified']
+            try:
+                response = requests.get( file_url, headers = headers )
+                if response.status_code == 304:
+                    self.Log.debug( f"Not modified: {file_url}" )
+                    continue
+                response.raise_for_status()
+            except requests.exceptions.RequestException as e:
+                self.Log.error( f"Failed to re-check {file_url}: {e}" )
+                continue
+
+            content_hash = hashlib.sha256( response.content ).hexdigest()
+            if content_hash != state['content_hash']:
+                self.Log.info( f"Applying revised file: {file_url}" )
+                if self._process_file( response.text, file_url, revision = True ):
+                    files_revised += 1
+                else:
+                    continue
+            self.DBHandler.saveFileState( file_url, response.headers.get( 'ETag' ), response.headers.get( 'Last-Modified' ), content_hash )
+        return files_revised
+
+    def repairGaps( self, start: datetime, end: datetime, parameters: list[str] = None ) -> int:
+        """
+            Downloads only the hourly files the coverage index reports as missing for our
+            AQSIDs between start and end (GMT), instead of everything after a watermark.
+            Without parameters every parameter a site has reported is checked.
+
+            Returns:
+                Number of files fetched
+        """
+        if self.Coverage is None:
+            raise RuntimeError( "repairGaps requires a coverage index." )
+        files = self.Coverage.planAirNowFetches( self.AQSIDs, parameters, start, end )
+        self.Log.info( f"Gap repair planned {len( files )} AirNow hourly files between {start} and {end}." )
+        self._loadFiles( files )
+        return len( files )
+
+    # =========================================================================
+    # Catch-up from daily files
+    # =========================================================================
+    def catchUpDays( self, first, last ) -> set:
+        """
+            Loads the days first through last from their daily files (daily_data.dat in the day's
+            directory) into the daily staging table: one download per day instead of 24 hourly
+            files, without listing the day's directory.  A daily file holds one value per site,
+            parameter and averaging period (e.g. OZONE-8HR), so these days have daily summaries
+            but no hourly staging rows until backfillHourlyDays loads their hourly files.
+
+            Returns:
+                Days loaded.  Days whose daily file could not be fetched or loaded are left to the hourly files.
+        """
+        days = [ first + timedelta( days = n ) for n in range( ( last - first ).days + 1 ) ]
+        if not days:
+            return set()
+        self.Log.info( f"Catching up {len( days )} days from AirNow daily files: {first} through {last}" )
+        loaded = set()
+        pipeline = AirQualityPipeline( 'AirNow_daily', queue_size = self.PipelineQueueSize, log = self.Log )
+        pipeline.addStage( 'fetch', self._fetch_daily_file, workers = self.PipelineWorkers['fetch'] )
+        pipeline.addStage( 'parse', self._parse_daily_file, workers = self.PipelineWorkers['parse'] )
+        pipeline.addStage( 'load', partial( self._load_daily_file, loaded = loaded ), ordered = True )
+        pipeline.run( days )
+        return loaded
+
+    def backfillHourlyDays( self, max_days: int = None ) -> int:
+        """
+            Loads the 24 hourly files of the oldest days queued by catchUpDays, so those days reach
+            the hourly staging and fact tables, the hot window and the coverage index.  File names
+            are known, so the day's directory is not listed.  A day leaves the queue once its files
+            have been through the pipeline (a missing file is left to repairGaps); a load failure
+            keeps it queued.
+
+            Parameters:
+                max_days (int) - days to load, every queued day by default
+
+            Returns:
+                Number of days loaded
+        """
+        days = self.DBHandler.getHourlyBackfillDays( max_days )
+        for day in days:
+            self.Log.info( f"Loading the hourly files of caught up day {day}" )
+            self._loadFiles( [ ( day, hour ) for hour in range( 24 ) ] )
+            self.DBHandler.clearHourlyBackfill( day )
+        return len( days )
+
+    def _daily_file_url( self, date: datetime ) -> str:
+        return f'https://files.airnowtech.org/airnow/{date.year}/{date.strftime( "%Y%m%d" )}/daily_data.dat'
+
+    def _fetch_daily_file( self, day ) -> tuple:
+        """
+            Pipeline stage: downloads one daily file.  Returns None (day left to the hourly files) when the download fails.
+        """
+        file_url = self._daily_file_url( day )
+        self.Log.debug( f"Fetching file: {file_url}" )
+        try:
+            with self._stage( 'download' ):
+                response = requests.get( file_url )
+                response.raise_for_status()
+            return day, file_url, response
+        except requests.exceptions.RequestException as e:
+            self.Log.error( f"Failed to download {file_url}: {e}" )
+            return None
+
+    def _parse_daily_file( self, fetched: tuple ) -> tuple:
+        """
+            Pipeline stage: reads the daily file and keeps our AQSIDs, with the same filter as the hourly files.
+        """
+        day, file_url, response = fetched
+        self.Log.info( f"Processing file: {file_url}" )
+        try:
+            return day, file_url, response, self._read_file( response.text, daily = True )
+        except Exception as e:
+            self.Log.error( f"Error processing file content: {e}" )
+            return None
+
+    def _load_daily_file( self, parsed: tuple, loaded: set ) -> str:
+        """
+            Pipeline stage: merges the filtered rows into the daily staging table and records the day as loaded.
+        """
+        day, file_url, response, filtered_df = parsed
+        if not filtered_df.empty:
+            with self._stage( 'insert_daily' ):
+                try:
+                    self.DBHandler.insertIntoDailyStagingTable( self.toBatch( filtered_df, daily = True ), file_url )
+                except Exception:
+                    # logged by the handler; the day is left to its hourly files
+                    return None
+        else:
+            self.Log.info( "No matching records found for AQSID list" )
+        content_hash = hashlib.sha256( response.content ).hexdigest()
+        self.DBHandler.saveFileState( file_url, response.headers.get( 'ETag' ), response.headers.get( 'Last-Modified' ), content_hash )
+        loaded.add( day )
+        return file_url
+
+    def _file_url( self, date: datetime, hour: int ) -> str:
+        date_str = date.strftime( '%Y%m%d' )
+        hour_str = str( hour ).zfill( 2 )
+        return f'https://files.airnowtech.org/airnow/{date.year}/{date_str}/HourlyData_{date_str}{hour_str}.dat'
     
     def check_for_available_files( self, dateToCheck: datetime ) -> list[tuple[datetime, int]]:
         """
@@ -69,6 +355,11 @@ class AirNow_AirQualityDataUpdater:
             Returns:
                 List of tuples of dates and hours available for download
         """
+        # Imported here so the revision, repair and catch-up paths never load a browser stack
+        from bs4 import BeautifulSoup
+        from selenium import webdriver
+        from selenium.webdriver.chrome.options import Options
+
         # Set up Chrome options for WebDriver
         chrome_options = Options()
         chrome_options.add_argument( "--headless" )  # Browser window isn't visible
@@ -102,40 +393,114 @@ class AirNow_AirQualityDataUpdater:
     def download_and_process_files( self, date: datetime, hour: int ) -> None:
         """
             Downloads a file from the AirNow website given a date and hour.
-            Calls the process_file function once downloaded.
+            Parses and loads it once downloaded.
         """
-        date_str = date.strftime( '%Y%m%d' )
-        hour_str = str( hour ).zfill( 2 )
-        file_url = f'https://files.airnowtech.org/airnow/{date.year}/{date_str}/HourlyData_{date_str}{hour_str}.dat'
+        fetched = self._fetch_file( ( date, hour ) )
+        parsed = self._parse_file( fetched ) if fetched else None
+        if parsed:
+            try:
+                self._load_file( parsed )
+            except Exception as e:
+                self.Log.error( f"Error processing file content: {e}" )
+
+    def _fetch_file( self, file: tuple[datetime, int] ) -> tuple[str, requests.Response]:
+        """
+            Pipeline stage: downloads one hourly file.  Returns None (file skipped) when the download fails.
+        """
+        file_url = self._file_url( *file )
         self.Log.debug( f"Fetching file: {file_url}" )
         try:
-            response = requests.get( file_url )
-            response.raise_for_status()
-            file_content = response.text
-            self.Log.info( f"Processing file: {file_url}" )
-            self._process_file( file_content, file_url )            
+            with self._stage( 'download' ):
+                response = requests.get( file_url )
+                response.raise_for_status()
+            return file_url, response
         except requests.exceptions.RequestException as e:
             self.Log.error( f"Failed to download {file_url}: {e}" )
+            return None
+
+    def _parse_file( self, fetched: tuple[str, requests.Response] ) -> tuple[str, requests.Response, pd.DataFrame]:
+        """
+            Pipeline stage: reads the file and keeps our AQSIDs.  Returns None (file skipped) when it cannot be parsed.
+        """
+        file_url, response = fetched
+        self.Log.info( f"Processing file: {file_url}" )
+        try:
+            return file_url, response, self._read_file( response.text )
+        except Exception as e:
+            self.Log.error( f"Error processing file content: {e}" )
+            return None
+
+    def _load_file( self, parsed: tuple[str, requests.Response, pd.DataFrame] ) -> str:
+        """
+            Pipeline stage: loads the filtered rows and remembers the file state.  Errors propagate and cancel the pipeline.
+        """
+        file_url, response, filtered_df = parsed
+        self._load_frame( filtered_df, file_url )
+        # remember what was loaded so later revisions of this file can be detected
+        content_hash = hashlib.sha256( response.content ).hexdigest()
+        self.DBHandler.saveFileState( file_url, response.headers.get( 'ETag' ), response.headers.get( 'Last-Modified' ), content_hash )
+        return file_url
 
-    def _process_file( self, file_content: str, file_url: str ) -> None:
+    def _process_file( self, file_content: str, file_url: str, revision: bool = False ) -> bool:
         """
             Reads the file_content into a Pandas data frame. Filters on AQSIDs.
-            Uses the DBHandler to insertIntoAirNowTable if records remain to be loaded.
+            Uses the DBHandler to insertIntoAirNowTable if records remain to be loaded,
+            or to reviseStagingRows when the file is a republished revision.
+
+            Returns:
+                True if the file was processed without errors
         """
-        # Define column headers of the file that will be downloaded as it has no column headers in the file
-        column_headers = ['Valid date', 'valid time', 'AQSID', 'sitename', 'GMT offset', 'parameter name', 'reporting units', 'value', 'data source']
         try:
-            df = pd.read_csv( StringIO( file_content ), delimiter = '|', names = column_headers )
-            filtered_df = df[df['AQSID'].isin( self.AQSIDs )] #only grab records with AQSIDs we're interested in
-            if not filtered_df.empty:
-                self.Log.info( f"Filtered data and sending {len( filtered_df )} records to SQL Server" )
-                self.DBHandler.insertIntoStagingTable( filtered_df, file_url )
-                self.Log.info( f"Successfully processed file: {file_url}" )
-            else:
-                self.Log.info( "No matching records found for AQSID list" )
+            self._load_frame( self._read_file( file_content ), file_url, revision )
+            return True
         except Exception as e:
             self.Log.error( f"Error processing file content: {e}" )
+            return False
+
+    @staticmethod
+    def readHourlyFile( file_content: str ) -> pd.DataFrame:
+        """
+            Reads a whole (national) hourly file.  AQSIDs are kept as strings so leading zeros survive.
+        """
+        column_headers = list( AirNow_AirQualityDataUpdater.HOURLY_FILE_COLUMNS.values() )
+        return pd.read_csv( StringIO( file_content ), delimiter = '|', names = column_headers, dtype = { 'AQSID': str } )
+
+    @classmethod
+    def toBatch( cls, df: pd.DataFrame, daily: bool = False ) -> RecordBatch:
+        """
+            Converts hourly (or daily) file rows to the AIRNOW_HOURLY_SCHEMA (AIRNOW_DAILY_SCHEMA) batch the DB handler loads.
+        """
+        if daily:
+            return RecordBatch.fromFrame( AIRNOW_DAILY_SCHEMA, df, columns = cls.DAILY_FILE_COLUMNS, date_format = cls.HOURLY_FILE_DATE_FORMAT )
+        return RecordBatch.fromFrame( AIRNOW_HOURLY_SCHEMA, df, columns = cls.HOURLY_FILE_COLUMNS, date_format = cls.HOURLY_FILE_DATE_FORMAT )
 
+    @staticmethod
+    def readDailyFile( file_content: str ) -> pd.DataFrame:
+        """
+            Reads a whole (national) daily file.  AQSIDs are kept as strings so leading zeros survive.
+        """
+        column_headers = list( AirNow_AirQualityDataUpdater.DAILY_FILE_COLUMNS.values() )
+        return pd.read_csv( StringIO( file_content ), delimiter = '|', names = column_headers, dtype = { 'AQSID': str } )
 
+    def _read_file( self, file_content: str, daily: bool = False ) -> pd.DataFrame:
+        with self._stage( 'parse' ):
+            df = self.readDailyFile( file_content ) if daily else self.readHourlyFile( file_content )
+            return df[df['AQSID'].isin( self.AQSIDs )] #only grab records with AQSIDs we're interested in
 
-    
+    def _load_frame( self, filtered_df: pd.DataFrame, file_url: str, revision: bool = False ) -> None:
+        if not filtered_df.empty:
+            self.Log.info( f"Filtered data and sending {len( filtered_df )} records to SQL Server" )
+            with self._stage( 'insert' ):
+                batch = self.toBatch( filtered_df )
+                if revision:
+                    self.DBHandler.reviseStagingRows( batch, file_url )
+                else:
+                    self.DBHandler.insertIntoStagingTable( batch, file_url )
+            with self._stage( 'hot_window_and_coverage' ):
+                if self.HotWindow:
+                    self.HotWindow.ingestAirNow( filtered_df )
+                if self.Coverage is not None:
+                    self.Coverage.markAirNow( filtered_df )
+            self.Log.info( f"Successfully processed file: {file_url}" )
+        else:
+            self.Log.info( "No matching records found for AQSID list" )
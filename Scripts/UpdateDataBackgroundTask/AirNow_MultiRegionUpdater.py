@@ -0,0 +1,229 @@
+import hashlib
+import requests
+import logging
+import pandas as pd
+from contextlib import nullcontext
+from datetime import datetime, timedelta, timezone
+from AirNow_AirQualityDataUpdater import AirNow_AirQualityDataUpdater
+from AirQualityProfiler import AirQualityProfiler
+from AirQualityPipeline import AirQualityPipeline
+
+class AirNow_MultiRegionUpdater:
+    """
+        Runs several region configurations (each an AirNow_AirQualityDataUpdater with its own
+        AQSIDs, staging table, DB handler, hot window and coverage index) off one download.
+
+        AirNow hourly files are national, so every file is fetched and parsed once and its rows
+        are routed to the regions in a single hash join against a combined AQSID -> region
+        lookup (a site may belong to several regions).  Each region only receives the files
+        published after its own last inserted hour, so a newly added region catches up from
+        the same downloads.  Adding a region costs one join partition and its own inserts.
+        Daily file catch-up (daily_table) is single region only, so regions with a daily staging
+        table are rejected rather than silently run without it.
+
+        Attributes:
+            self.Regions
+            self.Log
+            self.Profiler
+            self.PipelineWorkers
+            self.PipelineQueueSize
+    """
+
+    def __init__( self, regions: dict[str, AirNow_AirQualityDataUpdater], log: logging = None, profiler: AirQualityProfiler = None
+                 , pipeline_workers: dict[str, int] = None, pipeline_queue_size: int = 4 ):
+        """
+            Parameters:
+                regions (dict) - region name: updater configured for that region
+                pipeline_workers (dict) - workers of the shared fetch and parse stages
+        """
+        if not regions:
+            raise ValueError( "At least one region is required." )
+        daily = [ name for name, region in regions.items() if region.DailyTable ]
+        if daily:
+            raise ValueError( f"Daily file catch-up is not supported with several regions, remove daily_table from: {', '.join( daily )}." )
+        self.Regions = regions
+        self.Log = log
+        self.Profiler = profiler
+        self.PipelineWorkers = { **AirNow_AirQualityDataUpdater.PIPELINE_WORKERS, **( pipeline_workers or {} ) }
+        self.PipelineQueueSize = pipeline_queue_size
+        self._lookup = pd.DataFrame(
+            [ ( aqsid, name ) for name, region in regions.items() for aqsid in dict.fromkeys( region.AQSIDs ) ]
+            , columns = [ 'AQSID', '_region' ]
+        )
+        self._watermarks = {}   # region name: ( date, hour ) of its last inserted file
+
+    # =========================================================================
+    # Update cycle
+    # =========================================================================
+    def runUpdate( self ) -> None:
+        """
+            Same steps as AirNow_AirQualityDataUpdater.runUpdate, with the listing, downloads,
+            parsing and revision checks shared by all regions.
+        """
+        with self._cycle( 'AirNow_MultiRegion_runUpdate' ):
+            with self._stage( 'getLastInsertedDate' ):
+                self._watermarks = { name: region.DBHandler.getLastInsertedDate( region.AQSIDs ) for name, region in self.Regions.items() }
+            first_date, first_hour = min( self._watermarks.values() )
+
+            current_date = datetime.now( timezone.utc ).date() #file names are based on GMT time
+            self._loadFiles( self._first._newFiles( first_date, first_hour, current_date ) )
+            with self._stage( 'recheckRecentFiles' ):
+                self.recheckRecentFiles()
+            with self._stage( 'updateDWFactTables' ):
+                for region in self.Regions.values():
+                    region.DBHandler.updateDWFactTables()
+
+    @property
+    def _first( self ) -> AirNow_AirQualityDataUpdater:
+        return next( iter( self.Regions.values() ) )
+
+    def _loadFiles( self, files ) -> int:
+        """
+            Fetches and parses every file once, then loads the routed rows of each region in file order.
+
+            Returns:
+                Number of files loaded
+        """
+        pipeline = AirQualityPipeline( 'AirNow_MultiRegion', queue_size = self.PipelineQueueSize, log = self.Log )
+        pipeline.addStage( 'fetch', self._fetch_file, workers = self.PipelineWorkers['fetch'] )
+        pipeline.addStage( 'parse', self._parse_file, workers = self.PipelineWorkers['parse'] )
+        pipeline.addStage( 'load', self._load_file, ordered = True )
+        stats = pipeline.run( files )
+        return stats['load']['items'] - stats['load']['dropped']
+
+    def route( self, df: pd.DataFrame ) -> dict[str, pd.DataFrame]:
+        """
+            Splits the rows of a national file by region in one pass.
+
+            Returns:
+                region name: rows of that region's AQSIDs (regions without rows are left out)
+        """
+        with self._stage( 'route' ):
+            routed = df.merge( self._lookup, on = 'AQSID', how = 'inner' )
+            return { name: rows.drop( columns = '_region' ) for name, rows in routed.groupby( '_region', sort = False ) }
+
+    def _fetch_file( self, file: tuple[datetime, int] ) -> tuple:
+        """
+            Pipeline stage: downloads one hourly file, keeping its ( date, hour ) for the region watermarks.
+        """
+        fetched = self._first._fetch_file( file )
+        return ( file, *fetched ) if fetched else None
+
+    def _parse_file( self, fetched: tuple ) -> tuple:
+        """
+            Pipeline stage: reads the national file, hashes it and routes its rows.
+        """
+        file, file_url, response = fetched
+        self.Log.info( f"Processing file: {file_url}" )
+        try:
+            with self._stage( 'parse' ):
+                df = AirNow_AirQualityDataUpdater.readHourlyFile( response.text )
+            return file, file_url, response, hashlib.sha256( response.content ).hexdigest(), self.route( df )
+        except Exception as e:
+            self.Log.error( f"Error processing file content: {e}" )
+            return None
+
+    def _load_file( self, parsed: tuple ) -> str:
+        """
+            Pipeline stage: loads the routed rows into every region the file is new to.
+        """
+        file, file_url, response, content_hash, routed = parsed
+        for name, region in self.Regions.items():
+            watermark = self._watermarks.get( name )
+            if watermark is not None and tuple( file ) <= watermark:
+                # the region already has this file
+                continue
+            region._load_frame( routed.get( name, pd.DataFrame() ), file_url )
+            region.DBHandler.saveFileState( file_url, response.headers.get( 'ETag' ), response.headers.get( 'Last-Modified' ), content_hash )
+        return file_url
+
+    # =========================================================================
+    # Revisions
+    # =========================================================================
+    def recheckRecentFiles( self, hours: int = None ) -> int:
+        """
+            AirNow_AirQualityDataUpdater.recheckRecentFiles for all regions with one conditional
+            GET per file: the file is re-applied to each region whose stored content hash differs.
+
+            Returns:
+                Number of region / file revisions applied
+        """
+        hours = hours if hours is not None else max( region.RevisionWindowHours for region in self.Regions.values() )
+        now = datetime.now( timezone.utc ).replace( minute = 0, second = 0, microsecond = 0 )
+        file_urls = [ self._first._file_url( fh.date(), fh.hour ) for fh in ( now - timedelta( hours = h ) for h in range( 1, hours + 1 ) ) ]
+        states = { name: region.DBHandler.getFileStates( file_urls ) for name, region in self.Regions.items() }
+
+        revisions = 0
+        for file_url in file_urls:
+            loaded = { name: region_states[file_url] for name, region_states in states.items() if file_url in region_states }
+            if not loaded:
+                continue
+            # validators are only sent when every region holds the same version of the file
+            headers = {}
+            etags = { state['etag'] for state in loaded.values() }
+            last_modifieds = { state['last_modified'] for state in loaded.values() }
+            if len( etags ) == 1 and None not in etags:
+                headers['If-None-Match'] = etags.pop()
+            if len( last_modifieds ) == 1 and None not in last_modifieds:
+                headers['If-Modified-Since'] = last_modifieds.pop()
+            try:
+                response = requests.get( file_url, headers = headers )
+                if response.status_code == 304:
+                    self.Log.debug( f"Not modified: {file_url}" )
+                    continue
+                response.raise_for_status()
+            except requests.exceptions.RequestException as e:
+                self.Log.error( f"Failed to re-check {file_url}: {e}" )
+                continue
+
+            content_hash = hashlib.sha256( response.content ).hexdigest()
+            changed = [ name for name, state in loaded.items() if state['content_hash'] != content_hash ]
+            routed = {}
+            if changed:
+                self.Log.info( f"Applying revised file: {file_url} to {', '.join( changed )}" )
+                try:
+                    routed = self.route( AirNow_AirQualityDataUpdater.readHourlyFile( response.text ) )
+                except Exception as e:
+                    self.Log.error( f"Error processing file content: {e}" )
+                    continue
+            for name in loaded:
+                region = self.Regions[name]
+                if name in changed:
+                    try:
+                        region._load_frame( routed.get( name, pd.DataFrame() ), file_url, revision = True )
+                    except Exception as e:
+                        # the stored hash is kept, so the revision is retried next cycle
+                        self.Log.error( f"Error applying revised file {file_url} to {name}: {e}" )
+                        continue
+                    revisions += 1
+                region.DBHandler.saveFileState( file_url, response.headers.get( 'ETag' ), response.headers.get( 'Last-Modified' ), content_hash )
+        return revisions
+
+    # =========================================================================
+    # Gap repair
+    # =========================================================================
+    def repairGaps( self, start: datetime, end: datetime, parameters: list[str] = None ) -> int:
+        """
+            Downloads the union of the hourly files the regions' coverage indexes report as missing,
+            each once.  Regions without a coverage index are skipped.  Without parameters every
+            parameter a site has reported is checked.
+
+            Returns:
+                Number of files fetched
+        """
+        files = set()
+        for region in self.Regions.values():
+            if region.Coverage is not None:
+                files.update( region.Coverage.planAirNowFetches( region.AQSIDs, parameters, start, end ) )
+        files = sorted( files )
+        self.Log.info( f"Gap repair planned {len( files )} AirNow hourly files for {len( self.Regions )} regions between {start} and {end}." )
+        # every region takes the rows it gets, rows it already has are skipped by its staging MERGE
+        self._watermarks = {}
+        self._loadFiles( files )
+        return len( files )
+
+    def _cycle( self, name: str ):
+        return self.Profiler.cycle( name ) if self.Profiler is not None else nullcontext()
+
+    def _stage( self, name: str ):
+        return self.Profiler.stage( name ) if self.Profiler is not None else nullcontext()
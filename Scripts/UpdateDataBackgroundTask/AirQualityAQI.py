@@ -0,0 +1,93 @@
+"""
+    Vectorized Air Quality Index calculations.
+
+    The breakpoints mirror the AirQuality_DW.dbo.lkp_AQI_Breakpoints table loaded by
+    Database_Setup/02_LoadMetaTables.py so values computed in Python match the ones
+    computed in SQL.
+"""
+import numpy as np
+
+# Pollutant: list of ( BreakpointLo, BreakpointHi, AQILo, AQIHi )
+AQI_BREAKPOINTS = {
+    'O3 - 8hr': [
+        ( 0.000, 0.054, 0, 50 ), ( 0.055, 0.070, 51, 100 ), ( 0.071, 0.085, 101, 150 )
+        , ( 0.086, 0.105, 151, 200 ), ( 0.106, 0.200, 201, 300 )
+    ]
+    , 'O3 - 1hr': [
+        ( 0.125, 0.164, 101, 150 ), ( 0.165, 0.204, 151, 200 ), ( 0.205, 0.404, 201, 300 ), ( 0.405, 0.604, 301, 500 )
+    ]
+    , 'PM25': [
+        ( 0.0, 9.0, 0, 50 ), ( 9.1, 35.4, 51, 100 ), ( 35.5, 55.4, 101, 150 )
+        , ( 55.5, 125.4, 151, 200 ), ( 125.5, 225.4, 201, 300 ), ( 225.5, 325.4, 301, 500 )
+    ]
+    , 'PM10': [
+        ( 0, 54, 0, 50 ), ( 55, 154, 51, 100 ), ( 155, 254, 101, 150 )
+        , ( 255, 354, 151, 200 ), ( 355, 424, 201, 300 ), ( 425, 604, 301, 500 )
+    ]
+    , 'CO': [
+        ( 0.0, 4.4, 0, 50 ), ( 4.5, 9.4, 51, 100 ), ( 9.5, 12.4, 101, 150 )
+        , ( 12.5, 15.4, 151, 200 ), ( 15.5, 30.4, 201, 300 ), ( 30.5, 50.4, 301, 500 )
+    ]
+    , 'SO2': [
+        ( 0, 35, 0, 50 ), ( 36, 75, 51, 100 ), ( 76, 185, 101, 150 )
+        , ( 186, 304, 151, 200 ), ( 305, 604, 201, 300 ), ( 605, 1004, 301, 500 )
+    ]
+    , 'NO2': [
+        ( 0, 53, 0, 50 ), ( 54, 100, 51, 100 ), ( 101, 360, 101, 150 )
+        , ( 361, 649, 151, 200 ), ( 650, 1249, 201, 300 ), ( 1250, 2049, 301, 500 )
+    ]
+}
+
+# Concentrations are truncated to the breakpoint precision before the lookup
+AQI_DECIMALS = { 'O3 - 8hr': 3, 'O3 - 1hr': 3, 'PM25': 1, 'PM10': 0, 'CO': 1, 'SO2': 0, 'NO2': 0 }
+
+# AirNow parameter name: breakpoint pollutant for the hourly AQI.  The 1 hour ozone AQI is only
+# defined from 0.125 PPM, lower concentrations are rated by the 8 hour rolling average
+# ('O3 - 8hr', Ozone_8Hr_AQI in the fact tables), so an ozone AQI is the higher of the two.
+PARAMETER_POLLUTANTS = {
+    'OZONE': 'O3 - 1hr'
+    , 'PM2.5': 'PM25'
+    , 'PM10': 'PM10'
+    , 'CO': 'CO'
+    , 'SO2': 'SO2'
+    , 'NO2': 'NO2'
+}
+
+# Ozone breakpoints are in PPM, AirNow reports ozone in PPB
+UNIT_SCALES = { ( 'OZONE', 'PPB' ): 0.001 }
+
+def calculateAQI( pollutant: str, concentrations ) -> np.ndarray:
+    """
+        Calculates the AQI for an array of concentrations of a single breakpoint pollutant.
+
+        Parameters:
+            pollutant (str) - key of AQI_BREAKPOINTS, e.g. 'PM25' or 'O3 - 8hr'
+            concentrations (array-like) - concentrations in the breakpoint units
+
+        Returns:
+            float64 array of rounded AQI values, NaN where the concentration is null or outside the breakpoints
+    """
+    breakpoints = np.asarray( AQI_BREAKPOINTS[pollutant], dtype = np.float64 )
+    bp_lo, bp_hi, aqi_lo, aqi_hi = breakpoints.T
+
+    scale = 10.0 ** AQI_DECIMALS[pollutant]
+    c = np.trunc( np.asarray( concentrations, dtype = np.float64 ) * scale + 1e-9 ) / scale
+
+    idx = np.searchsorted( bp_lo, c, side = 'right' ) - 1
+    in_range = ( idx >= 0 ) & ~np.isnan( c )
+    idx = np.clip( idx, 0, len( bp_lo ) - 1 )
+    in_range &= c <= bp_hi[idx]
+
+    aqi = ( aqi_hi[idx] - aqi_lo[idx] ) / ( bp_hi[idx] - bp_lo[idx] ) * ( c - bp_lo[idx] ) + aqi_lo[idx]
+    return np.where( in_range, np.round( aqi ), np.nan )
+
+def calculateParameterAQI( parameter_name: str, values, units: str = None ) -> np.ndarray:
+    """
+        Calculates the hourly AQI for an AirNow parameter.  Returns all NaN for parameters without an AQI (temperature, wind, ...).
+    """
+    values = np.asarray( values, dtype = np.float64 )
+    pollutant = PARAMETER_POLLUTANTS.get( parameter_name.upper() ) if parameter_name else None
+    if pollutant is None:
+        return np.full( values.shape, np.nan )
+    scale = UNIT_SCALES.get( ( parameter_name.upper(), ( units or '' ).upper() ), 1.0 )
+    return calculateAQI( pollutant, values * scale )
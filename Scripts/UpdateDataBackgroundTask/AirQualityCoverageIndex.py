@@ -0,0 +1,281 @@
+import logging
+import numpy as np
+import pandas as pd
+import sqlalchemy as SA
+from datetime import datetime
+from AirQualityFactTables import DW_DATABASE, FACT_TABLES, parameterForAQSCode
+from AirQualityRecordBatch import RecordBatch
+
+class AirQualityCoverageIndex:
+    """
+        Compact record of which ( AQSID, parameter, hour ) cells have been loaded.
+
+        One bitset per AQSID and parameter, bit i set when the hour Origin + i hours (GMT)
+        is present.  Built from the staging and fact tables, updated by the updaters on
+        every insert, and used to plan the smallest set of AirNow hourly files or EPA
+        date-range requests that fill the gaps.
+
+        Parameters are keyed by AirNow parameter name (e.g. 'OZONE'); EPA parameter codes
+        without an AirNow equivalent are keyed by the code itself.
+
+        Attributes:
+            self.Origin
+            self.GMTOffsets
+            self.Log
+    """
+    def __init__( self, origin: datetime = datetime( 2014, 1, 1 ), log: logging = None ):
+        self.Origin = np.datetime64( origin, 'h' )
+        self.GMTOffsets = {}    # AQSID: hours to add to GMT to get local standard time
+        self.Log = log
+        self._bits = {}         # ( AQSID, parameter ): np.uint8 array of packed bits
+
+    # =========================================================================
+    # Marking
+    # =========================================================================
+    def _hourIndex( self, times ) -> np.ndarray:
+        return ( np.asarray( times ).astype( 'datetime64[h]' ) - self.Origin ).astype( np.int64 )
+
+    def mark( self, aqsids, parameters, times_gmt ) -> None:
+        """
+            Sets the bits of a batch of loaded readings.
+
+            Parameters:
+                aqsids (array-like) - 9 character AQSIDs
+                parameters (array-like) - AirNow parameter names (or AQS codes)
+                times_gmt (array-like) - GMT hour of each reading
+        """
+        hours = self._hourIndex( times_gmt )
+        keys = pd.DataFrame( { 'aqsid': np.asarray( aqsids, dtype = object ), 'parameter': np.asarray( parameters, dtype = object ), 'hour': hours } )
+        keys = keys[keys['hour'] >= 0]
+        for ( aqsid, parameter ), group in keys.groupby( ['aqsid', 'parameter'], sort = False ):
+            key = ( str( aqsid ).zfill( 9 ), str( parameter ).upper() )
+            group_hours = group['hour'].to_numpy()
+            bits = self._bits.get( key, np.zeros( 0, dtype = np.uint8 ) )
+            needed = int( group_hours.max() ) // 8 + 1
+            if needed > len( bits ):
+                # grow a year at a time to avoid resizing every hour
+                grown = np.zeros( max( needed, len( bits ) + 1095 ), dtype = np.uint8 )
+                grown[:len( bits )] = bits
+                bits = grown
+            np.bitwise_or.at( bits, group_hours // 8, ( 1 << ( 7 - group_hours % 8 ) ).astype( np.uint8 ) )
+            self._bits[key] = bits
+
+    def markAirNow( self, df: pd.DataFrame ) -> None:
+        """
+            Marks the rows of an AirNow hourly file (valid dates and times are GMT).
+        """
+        if df.empty:
+            return
+        times = pd.to_datetime( df['Valid date'].astype( str ) + ' ' + df['valid time'].astype( str ), format = '%m/%d/%y %H:%M' )
+        aqsids = df['AQSID'].astype( str ).str.zfill( 9 ).to_numpy()
+        for aqsid, offset in zip( aqsids, pd.to_numeric( df['GMT offset'], errors = 'coerce' ) ):
+            if not np.isnan( offset ):
+                self.GMTOffsets[aqsid] = int( offset )
+        self.mark( aqsids, df['parameter name'].astype( str ).to_numpy(), times.to_numpy() )
+
+    def markEPA( self, batch: RecordBatch ) -> None:
+        """
+            Marks the rows of a decoded EPA sampleData response.
+        """
+        if batch.empty:
+            return
+        aqsids = ( batch['state_code'].astype( str ) + batch['county_code'].astype( str ) + batch['site_number'].astype( str ) ).to_numpy()
+        parameters = [ parameterForAQSCode( code ) or code for code in batch['parameter_code'].astype( str ) ]
+        times = pd.to_datetime( batch['date_gmt'] ) + pd.to_timedelta( batch['time_gmt'].astype( str ) + ':00' )
+        local = pd.to_datetime( batch['date_local'] ) + pd.to_timedelta( batch['time_local'].astype( str ) + ':00' )
+        offsets = ( ( local - times ) / pd.Timedelta( hours = 1 ) ).to_numpy()
+        for aqsid, offset in zip( aqsids, offsets ):
+            if not np.isnan( offset ):
+                self.GMTOffsets[aqsid] = int( offset )
+        self.mark( aqsids, parameters, times.to_numpy() )
+
+    # =========================================================================
+    # Building from the database
+    # =========================================================================
+    def buildFromDatabase( self, engine: SA.Engine, staging_database: str, airnow_table: str = None, epa_table: str = None, dw_database: str = DW_DATABASE, include_facts: bool = True, epa_archive_table: str = None ) -> None:
+        """
+            Marks every hour present in the AirNow and EPA staging tables and (optionally) in the DW fact tables.
+            Fact times are local standard time and are converted to GMT with Sites.GMT_Offset.
+
+            An EPA backfill should pass include_facts = False so hours that only have preliminary
+            AirNow facts still count as missing validated data.  Rows moved out of EPA staging by
+            the retention job are read from epa_archive_table.
+        """
+        with engine.connect() as conn:
+            if airnow_table:
+                rows = pd.read_sql( SA.text( f"""
+                    SELECT DISTINCT AQSID, Parameter_Name, CONVERT( DATETIME, Valid_Date ) + CONVERT( DATETIME, Valid_Time ) AS Time_GMT, GMT_Offset
+                    FROM {staging_database}.dbo.{airnow_table}
+                """ ), conn )
+                for aqsid, offset in rows[['AQSID', 'GMT_Offset']].drop_duplicates( 'AQSID' ).itertuples( index = False ):
+                    self.GMTOffsets[aqsid] = int( offset )
+                self.mark( rows['AQSID'].to_numpy(), rows['Parameter_Name'].to_numpy(), rows['Time_GMT'].to_numpy() )
+            for table in [ table for table in ( epa_table, epa_archive_table ) if table ]:
+                rows = pd.read_sql( SA.text( f"""
+                    SELECT DISTINCT state_code + county_code + site_number AS AQSID, parameter_code
+                        , CONVERT( DATETIME, date_gmt ) + CONVERT( DATETIME, time_gmt ) AS Time_GMT
+                    FROM {staging_database}.dbo.{table}
+                """ ), conn )
+                self.mark( rows['AQSID'].to_numpy(), [ parameterForAQSCode( code ) or code for code in rows['parameter_code'] ], rows['Time_GMT'].to_numpy() )
+            for parameter_name, ( fact_table, _, _ ) in ( FACT_TABLES.items() if include_facts else [] ):
+                rows = pd.read_sql( SA.text( f"""
+                    SELECT REPLACE( f.Full_Site_Number, '-', '' ) AS AQSID, DATEADD( HOUR, -ISNULL( s.GMT_Offset, 0 ), f.Date_Time_Local ) AS Time_GMT
+                    FROM {dw_database}.dbo.{fact_table} f
+                    LEFT JOIN {dw_database}.dbo.Sites s ON s.Full_Site_Number = f.Full_Site_Number
+                """ ), conn )
+                self.mark( rows['AQSID'].to_numpy(), np.full( len( rows ), parameter_name ), rows['Time_GMT'].to_numpy() )
+        log_message = f"Coverage index built for {len( self._bits )} site / parameter pairs."
+        self.Log.info( log_message ) if self.Log else print( log_message )
+
+    def save( self, path: str ) -> None:
+        np.savez_compressed(
+            path
+            , origin = self.Origin
+            , keys = np.array( [ f"{aqsid}|{parameter}" for aqsid, parameter in self._bits ], dtype = str )
+            , offsets = np.array( [ f"{aqsid}|{offset}" for aqsid, offset in self.GMTOffsets.items() ], dtype = str )
+            , **{ f"bits_{i}": bits for i, bits in enumerate( self._bits.values() ) }
+        )
+
+    @classmethod
+    def load( cls, path: str, log: logging = None ) -> 'AirQualityCoverageIndex':
+        data = np.load( path )
+        index = cls( log = log )
+        index.Origin = data['origin'].astype( 'datetime64[h]' )
+        for i, key in enumerate( data['keys'] ):
+            aqsid, parameter = str( key ).split( '|' )
+            index._bits[( aqsid, parameter )] = data[f"bits_{i}"]
+        for entry in data['offsets']:
+            aqsid, offset = str( entry ).split( '|' )
+            index.GMTOffsets[aqsid] = int( offset )
+        return index
+
+    # =========================================================================
+    # Queries
+    # =========================================================================
+    def present( self, aqsid: str, parameter: str, start: datetime, end: datetime ) -> np.ndarray:
+        """
+            Boolean array with one entry per GMT hour in [start, end).
+        """
+        first, last = self._hourIndex( [start, end] )
+        first = max( int( first ), 0 )
+        bits = self._bits.get( ( aqsid, parameter.upper() ) )
+        result = np.zeros( max( int( last ) - first, 0 ), dtype = bool )
+        if bits is None or len( result ) == 0:
+            return result
+        unpacked = np.unpackbits( bits[first // 8:( int( last ) + 7 ) // 8] ).astype( bool )
+        unpacked = unpacked[first % 8:first % 8 + len( result )]
+        result[:len( unpacked )] = unpacked
+        return result
+
+    def missingHours( self, aqsid: str, parameter: str, start: datetime, end: datetime ) -> np.ndarray:
+        """
+            GMT hours in [start, end) that have not been loaded, as datetime64[h].
+        """
+        start = np.datetime64( start, 'h' )
+        return start + np.flatnonzero( ~self.present( aqsid, parameter, start, end ) ).astype( 'timedelta64[h]' )
+
+    def completeness( self, aqsids: list[str], parameters: list[str], start: datetime, end: datetime ) -> pd.DataFrame:
+        """
+            Share of hours present per AQSID and parameter over [start, end).
+        """
+        rows = []
+        for aqsid in aqsids:
+            for parameter in parameters:
+                present = self.present( aqsid, parameter, start, end )
+                rows.append( {
+                    'AQSID': aqsid, 'Parameter': parameter.upper(), 'Hours_Expected': len( present )
+                    , 'Hours_Present': int( present.sum() ), 'Completeness': float( present.mean() ) if len( present ) else None
+                } )
+        return pd.DataFrame( rows )
+
+    # =========================================================================
+    # Planning
+    # =========================================================================
+    def planParameters( self, aqsid: str, parameters: list[str] = None, configured: list[str] = None ) -> list[str]:
+        """
+            Parameters worth planning for a site: those it has reported (a bitset exists) plus the
+            ones configured for it, limited to parameters when given.  A parameter a site never
+            measures would otherwise count as missing every hour.
+        """
+        candidates = { parameter for site, parameter in self._bits if site == aqsid }
+        candidates.update( parameter.upper() for parameter in ( configured or [] ) )
+        if parameters is not None:
+            candidates &= { parameter.upper() for parameter in parameters }
+        return sorted( candidates )
+
+    def planAirNowFetches( self, aqsids: list[str], parameters: list[str], start: datetime, end: datetime, configured: dict[str, list[str]] = None ) -> list[tuple[datetime, int]]:
+        """
+            AirNow hourly files are national, so one file fills a given hour for every site
+            and parameter.  Returns the ( GMT date, hour ) of every file needed to fill the
+            gaps of the requested sites and parameters in [start, end).
+
+            Parameters:
+                parameters (list) - AirNow parameter names, None for every parameter a site reports
+                configured (dict) - AQSID: parameters expected from the site even without loaded rows
+        """
+        configured = configured or {}
+        missing = np.zeros( 0, dtype = bool )
+        for aqsid in aqsids:
+            for parameter in self.planParameters( aqsid, parameters, configured.get( aqsid ) ):
+                gaps = ~self.present( aqsid, parameter, start, end )
+                missing = gaps if len( missing ) == 0 else missing | gaps
+        start = np.datetime64( start, 'h' )
+        hours = start + np.flatnonzero( missing ).astype( 'timedelta64[h]' )
+        return [ ( h.astype( datetime ).date(), h.astype( datetime ).hour ) for h in hours ]
+
+    def planEPARequests( self, aqsids: list[str], parameter_codes: list[str], start: datetime, end: datetime, merge_gap_days: int = 7, max_params: int = 5
+                        , configured: dict[str, list[str]] = None ) -> list[dict]:
+        """
+            Turns the gaps into EPA sampleData requests.
+
+            Only the codes a site has reported or is configured for are planned.  Missing hours
+            are converted to local dates, runs of missing dates closer than merge_gap_days are
+            merged into a single window, windows are split at year ends (the API requires bdate
+            and edate in the same year) and each window only asks for the parameters that
+            actually have gaps in it, max_params per request.
+
+            Parameters:
+                configured (dict) - AQSID: parameter codes expected from the site even without loaded rows
+
+            Returns:
+                list of { 'aqsid', 'params', 'bdate', 'edate' }
+        """
+        configured = configured or {}
+        plan = []
+        for aqsid in aqsids:
+            offset = np.timedelta64( self.GMTOffsets.get( aqsid, 0 ), 'h' )
+            planned = set( self.planParameters( aqsid, None, [ parameterForAQSCode( code ) or code for code in configured.get( aqsid, [] ) ] ) )
+            missing_days = {}
+            for code in parameter_codes:
+                parameter = ( parameterForAQSCode( code ) or code ).upper()
+                if parameter not in planned:
+                    continue
+                hours = self.missingHours( aqsid, parameter, start, end )
+                if len( hours ):
+                    missing_days[code] = np.unique( ( hours + offset ).astype( 'datetime64[D]' ) )
+            if not missing_days:
+                continue
+
+            for window_start, window_end in self._windows( np.unique( np.concatenate( list( missing_days.values() ) ) ), merge_gap_days ):
+                codes = [ code for code, days in missing_days.items() if ( ( days >= window_start ) & ( days <= window_end ) ).any() ]
+                for i in range( 0, len( codes ), max_params ):
+                    plan.append( {
+                        'aqsid': aqsid
+                        , 'params': codes[i:i + max_params]
+                        , 'bdate': window_start.astype( datetime )
+                        , 'edate': window_end.astype( datetime )
+                    } )
+        return plan
+
+    @staticmethod
+    def _windows( days: np.ndarray, merge_gap_days: int ) -> list[tuple[np.datetime64, np.datetime64]]:
+        windows = []
+        breaks = np.flatnonzero( np.diff( days ).astype( np.int64 ) > merge_gap_days )
+        for run in np.split( days, breaks + 1 ):
+            first, last = run[0], run[-1]
+            while first.astype( datetime ).year != last.astype( datetime ).year:
+                year_end = np.datetime64( f"{first.astype( datetime ).year}-12-31" )
+                windows.append( ( first, year_end ) )
+                first = year_end + np.timedelta64( 1, 'D' )
+            windows.append( ( first, last ) )
+        return windows
@@ -1,6 +1,10 @@
 import sqlalchemy as SA
-import pandas as pd
 import logging
+from datetime import date, timedelta
+from AirQualitySourceDictionary import AirQualitySourceDictionary
+from AirQualityRecordBatch import RecordBatch
+from AirQualityFactTables import DW_DATABASE, DAILY_FACT_TABLE
+from AirQualityReconciler import AirQualityReconciler
 
 class AirQualityDBHandler:
     """
@@ -8,11 +12,34 @@ class AirQualityDBHandler:
 
         TODO: Add default start date option parameter for example a new table is created
 
+        Staging tables are partitioned by month on their date column, clustered on ( date, recID )
+        so inserts append to the latest partition, and carry a persisted computed datetime column
+        and covering indexes on their natural keys (see ensureStagingLayout).  Rows already
+        promoted to the fact tables are moved to a compressed archive by archivePromotedRows.
+        Long repeated strings are stored as ids into the AirQualitySourceDictionary dimensions
+        (ENCODED_COLUMNS), with a vw_<staging table> view exposing them decoded.
+        Rows arrive as a RecordBatch of the source's schema and are bulk inserted from its
+        arrays (see _bulkInsert).
+
         Attributes:
             self.Database
             self.Log
             self.Engine
+            self.Sources
     """
+
+    # Monthly partitions shared by the staging tables of a database
+    PARTITION_FUNCTION = 'pf_Staging_Month'
+    PARTITION_SCHEME = 'ps_Staging_Month'
+    PARTITION_ORIGIN = date( 2014, 1, 1 )
+    PARTITION_MONTHS_AHEAD = 3
+
+    # Staging layout, set by the subclasses
+    STAGING_DATE_COLUMN = None          # partitioning column
+    STAGING_DATETIME_COLUMN = None      # ( name, expression ) of the persisted computed datetime column
+    STAGING_INDEXES = {}                # index suffix: ( key columns, included columns )
+    ENCODED_COLUMNS = {}                # string column: ( id column, AirQualitySourceDictionary dimension )
+
     def __init__( self, server: str, database: str, username: str, password: str, port:int = None, log: logging = None ):
         self.Database = database
         self.Log = log
@@ -29,6 +56,7 @@ class AirQualityDBHandler:
         )
         try:
             self.Engine = SA.create_engine( alchemy_url_object, fast_executemany = True )
+            self.Sources = AirQualitySourceDictionary( self.Engine, self.Database, log )
         except Exception as e:
             log_message = f"Error creating SQL engine with url: {alchemy_url_object}. Exception received: {e}"
             self.Log.error( log_message ) if self.Log else print( log_message )            
@@ -37,10 +65,15 @@ class AirQualityDBHandler:
         self.StagingTable = stagingTable
         if not self.checkIfTableExists( self.StagingTable ):
             if createIfNotExists:
-                return self.createStagingTable( self.StagingTable )
+                created = self.createStagingTable( self.StagingTable )
+                if created:
+                    self.ensureStagingLayout()
+                return created
             else:
                 return False
         else:
+            # indexes and partitions are only created when missing, an existing heap is converted once
+            self.ensureStagingLayout()
             return True
     
     def checkIfTableExists( self, tableName: str ) -> bool:
@@ -61,10 +94,333 @@ class AirQualityDBHandler:
             self.Log.error( log_message ) if self.Log else print( log_message )
             return False
         
+    # =========================================================================
+    # Staging layout: partitions, indexes and archive
+    # =========================================================================
+    def ensureStagingLayout( self, tableName: str = None ) -> bool:
+        """
+            Creates whatever is missing of the staging table layout:
+                - monthly partitions on STAGING_DATE_COLUMN, extended PARTITION_MONTHS_AHEAD months ahead
+                - the persisted computed datetime column (STAGING_DATETIME_COLUMN)
+                - a partitioned clustered index on ( date, recID ), so new rows append to the latest partition
+                - partition aligned covering indexes on the natural keys (STAGING_INDEXES)
+                - id columns in place of the ENCODED_COLUMNS strings (a table created with the strings is converted once)
+                - the vw_<table> view with the strings decoded
+
+            Returns:
+                True if the layout is in place
+        """
+        tableName = tableName if tableName else self.StagingTable
+        if self.STAGING_DATE_COLUMN is None:
+            return True
+        table = f"{self.Database}.dbo.{tableName}"
+        on_scheme = f"ON {self.PARTITION_SCHEME} ( {self.STAGING_DATE_COLUMN} )"
+        try:
+            with self.Engine.begin() as conn:
+                # partitions first, so a heap being converted is split once when its clustered index is built
+                self._extendPartitions( conn )
+
+                datetime_column, expression = self.STAGING_DATETIME_COLUMN
+                if conn.execute( SA.text( "SELECT COL_LENGTH( :table, :column )" ), { 'table': table, 'column': datetime_column } ).scalar() is None:
+                    conn.execute( SA.text( f"ALTER TABLE {table} ADD {datetime_column} AS {expression} PERSISTED" ) )
+
+                self._encodeStringColumns( conn, table )
+
+                indexes = { name: index_type for name, index_type in conn.execute( SA.text( f"""
+                    SELECT ISNULL( name, '' ), type FROM {self.Database}.sys.indexes WHERE object_id = OBJECT_ID( :table )
+                """ ), { 'table': table } ) }
+                if 0 in indexes.values():
+                    conn.execute( SA.text( f"CREATE CLUSTERED INDEX CX_{tableName}_Date ON {table} ( {self.STAGING_DATE_COLUMN}, recID ) {on_scheme}" ) )
+                for suffix, ( keys, includes ) in self.STAGING_INDEXES.items():
+                    if f"IX_{tableName}_{suffix}" not in indexes:
+                        include = f"INCLUDE ( {', '.join( includes )} )" if includes else ''
+                        conn.execute( SA.text( f"CREATE INDEX IX_{tableName}_{suffix} ON {table} ( {', '.join( keys )} ) {include} {on_scheme}" ) )
+                self._createDecodedView( conn, tableName )
+            return True
+        except Exception as e:
+            log_message = f"Error creating the indexes and partitions of table: {tableName}.  {e}"
+            self.Log.error( log_message ) if self.Log else print( log_message )
+            return False
+
+    def _encodeStringColumns( self, conn, table: str ) -> None:
+        """
+            Replaces each ENCODED_COLUMNS string column still on the table by its id column:
+            the distinct values are added to the dimension, the ids set in one UPDATE and the
+            string column (and any index including it) dropped.
+        """
+        column_length = SA.text( "SELECT COL_LENGTH( :table, :column )" )
+        for column, ( id_column, dimension ) in self.ENCODED_COLUMNS.items():
+            if conn.execute( column_length, { 'table': table, 'column': id_column } ).scalar() is not None:
+                continue
+            conn.execute( SA.text( f"ALTER TABLE {table} ADD {id_column} INT NULL" ) )
+            if conn.execute( column_length, { 'table': table, 'column': column } ).scalar() is None:
+                continue
+
+            self.Sources.createTables()
+            dim_table = self.Sources.table( dimension )
+            conn.execute( SA.text( f"""
+                INSERT INTO {dim_table} ( Value )
+                SELECT DISTINCT s.{column}
+                FROM {table} s
+                WHERE s.{column} IS NOT NULL
+                    AND NOT EXISTS ( SELECT 1 FROM {dim_table} d WHERE d.Value_Hash = CONVERT( BINARY(32), HASHBYTES( 'SHA2_256', s.{column} ) ) )
+            """ ) )
+            conn.execute( SA.text( f"""
+                UPDATE s SET {id_column} = d.ID
+                FROM {table} s
+                JOIN {dim_table} d ON d.Value_Hash = CONVERT( BINARY(32), HASHBYTES( 'SHA2_256', s.{column} ) )
+            """ ) )
+            for ( index_name, ) in conn.execute( SA.text( f"""
+                SELECT DISTINCT i.name
+                FROM {self.Database}.sys.indexes i
+                JOIN {self.Database}.sys.index_columns ic ON ic.object_id = i.object_id AND ic.index_id = i.index_id
+                JOIN {self.Database}.sys.columns c ON c.object_id = ic.object_id AND c.column_id = ic.column_id
+                WHERE i.object_id = OBJECT_ID( :table ) AND c.name = :column
+            """ ), { 'table': table, 'column': column } ).fetchall():
+                conn.execute( SA.text( f"DROP INDEX {index_name} ON {table}" ) )
+            conn.execute( SA.text( f"ALTER TABLE {table} DROP COLUMN {column}" ) )
+            log_message = f"Encoded {table}.{column} as {id_column} into {dim_table}"
+            self.Log.info( log_message ) if self.Log else print( log_message )
+
+    def _createDecodedView( self, conn, tableName: str ) -> None:
+        if not self.ENCODED_COLUMNS:
+            return
+        self.Sources.createTables()
+        columns = [ "t.*" ] + [ f"d{n}.Value AS {column}" for n, column in enumerate( self.ENCODED_COLUMNS ) ]
+        joins = [ f"LEFT JOIN {self.Sources.table( dimension )} d{n} ON d{n}.ID = t.{id_column}"
+                 for n, ( id_column, dimension ) in enumerate( self.ENCODED_COLUMNS.values() ) ]
+        conn.execute( SA.text( f"""
+            CREATE OR ALTER VIEW dbo.vw_{tableName} AS
+            SELECT {', '.join( columns )}
+            FROM {self.Database}.dbo.{tableName} t
+            {' '.join( joins )}
+        """ ) )
+
+    def extendPartitions( self ) -> None:
+        with self.Engine.begin() as conn:
+            self._extendPartitions( conn )
+
+    def _extendPartitions( self, conn ) -> None:
+        """
+            Creates the monthly partition function and scheme, or splits in the months that have
+            come within PARTITION_MONTHS_AHEAD since (splitting empty partitions moves no data).
+        """
+        today = date.today()
+        last = self._addMonths( date( today.year, today.month, 1 ), self.PARTITION_MONTHS_AHEAD )
+        highest = conn.execute( SA.text( """
+            SELECT MAX( CONVERT( DATE, v.value ) )
+            FROM sys.partition_functions f
+            LEFT JOIN sys.partition_range_values v ON v.function_id = f.function_id
+            WHERE f.name = :function
+            HAVING COUNT(*) > 0
+        """ ), { 'function': self.PARTITION_FUNCTION } ).fetchone()
+
+        if highest is None:
+            boundaries = ', '.join( f"'{month.isoformat()}'" for month in self._months( self.PARTITION_ORIGIN, last ) )
+            conn.execute( SA.text( f"CREATE PARTITION FUNCTION {self.PARTITION_FUNCTION} ( DATE ) AS RANGE RIGHT FOR VALUES ( {boundaries} )" ) )
+            conn.execute( SA.text( f"CREATE PARTITION SCHEME {self.PARTITION_SCHEME} AS PARTITION {self.PARTITION_FUNCTION} ALL TO ( [PRIMARY] )" ) )
+            log_message = f"Created monthly partition function {self.PARTITION_FUNCTION} through {last.isoformat()}"
+            self.Log.info( log_message ) if self.Log else print( log_message )
+            return
+
+        for month in self._months( self._addMonths( highest[0], 1 ), last ):
+            conn.execute( SA.text( f"ALTER PARTITION SCHEME {self.PARTITION_SCHEME} NEXT USED [PRIMARY]" ) )
+            conn.execute( SA.text( f"ALTER PARTITION FUNCTION {self.PARTITION_FUNCTION}() SPLIT RANGE ( '{month.isoformat()}' )" ) )
+            log_message = f"Added partition {month.isoformat()} to {self.PARTITION_FUNCTION}"
+            self.Log.info( log_message ) if self.Log else print( log_message )
+
+    @staticmethod
+    def _addMonths( month: date, months: int ) -> date:
+        index = month.year * 12 + month.month - 1 + months
+        return date( index // 12, index % 12 + 1, 1 )
+
+    @classmethod
+    def _months( cls, first: date, last: date ) -> list[date]:
+        months = []
+        month = date( first.year, first.month, 1 )
+        while month <= last:
+            months.append( month )
+            month = cls._addMonths( month, 1 )
+        return months
+
+    def archivePromotedRows( self, archiveTable: str = None, retainDays: int = 30, batchSize: int = 50000, compression: str = 'COLUMNSTORE' ) -> int:
+        """
+            Moves the staging rows already promoted to the fact tables (see _promotedFilter) and
+            more than retainDays older than the latest loaded date to a compressed archive table,
+            so the hot staging table and its indexes stay small and insert cost stays flat.
+
+            Each batch is a single DELETE ... OUTPUT INTO, so a row is never in both tables or in
+            neither.  The cutoff is on the partitioning column, so only the old partitions are read.
+
+            Parameters:
+                archiveTable (str) - defaults to <staging table>_Archive, created when missing
+                retainDays (int) - days kept in staging before the latest loaded date
+                batchSize (int) - rows moved per transaction
+                compression (str) - 'COLUMNSTORE' (clustered columnstore) or 'PAGE' (page compressed rowstore)
+
+            Returns:
+                Number of rows archived
+        """
+        archiveTable = archiveTable if archiveTable else f"{self.StagingTable}_Archive"
+        table = f"{self.Database}.dbo.{self.StagingTable}"
+        archive = f"{self.Database}.dbo.{archiveTable}"
+        try:
+            with self.Engine.begin() as conn:
+                columns = [ name for ( name, ) in conn.execute( SA.text( f"""
+                    SELECT name FROM {self.Database}.sys.columns WHERE object_id = OBJECT_ID( :table ) ORDER BY column_id
+                """ ), { 'table': table } ) ]
+                if conn.execute( SA.text( "SELECT OBJECT_ID( :archive, 'U' )" ), { 'archive': archive } ).scalar() is None:
+                    self._createArchiveTable( conn, table, archiveTable, columns, compression )
+                latest = conn.execute( SA.text( f"SELECT MAX( {self.STAGING_DATE_COLUMN} ) FROM {table}" ) ).scalar()
+                promoted, params = self._promotedFilter( conn )
+            if latest is None or promoted is None:
+                log_message = f"No promoted rows to archive in {table}."
+                self.Log.info( log_message ) if self.Log else print( log_message )
+                return 0
+
+            cutoff = latest - timedelta( days = retainDays )
+            archived = 0
+            while True:
+                with self.Engine.begin() as conn:
+                    moved = conn.execute( SA.text( f"""
+                        DELETE TOP ( :batch_size )
+                        FROM {table}
+                        OUTPUT {', '.join( f"deleted.{column}" for column in columns )}
+                        INTO {archive} ( {', '.join( columns )} )
+                        WHERE {self.STAGING_DATE_COLUMN} < :cutoff
+                            AND {promoted}
+                    """ ), { 'batch_size': batchSize, 'cutoff': cutoff, **params } ).rowcount
+                archived += moved
+                if moved < batchSize:
+                    break
+
+            log_message = f"Archived {archived} rows older than {cutoff.isoformat()} from {table} to {archive}"
+            self.Log.info( log_message ) if self.Log else print( log_message )
+            return archived
+        except Exception as e:
+            log_message = f"Error archiving rows from SQL table: {self.StagingTable}.  {e}"
+            self.Log.error( log_message ) if self.Log else print( log_message )
+            return 0
+
+    def _createArchiveTable( self, conn, table: str, archiveTable: str, columns: list[str], compression: str ) -> None:
+        # recID + 0 drops the identity property; the computed datetime column becomes a plain column
+        select_list = ', '.join( 'recID = recID + 0' if column == 'recID' else column for column in columns )
+        archive = f"{self.Database}.dbo.{archiveTable}"
+        conn.execute( SA.text( f"SELECT TOP 0 {select_list} INTO {archive} FROM {table}" ) )
+        if compression.upper() == 'COLUMNSTORE':
+            conn.execute( SA.text( f"CREATE CLUSTERED COLUMNSTORE INDEX CCI_{archiveTable} ON {archive}" ) )
+        else:
+            conn.execute( SA.text( f"CREATE CLUSTERED INDEX CX_{archiveTable}_Date ON {archive} ( {self.STAGING_DATE_COLUMN}, recID ) WITH ( DATA_COMPRESSION = PAGE )" ) )
+        log_message = f"{archive} has been successfully created ({compression.upper()})."
+        self.Log.info( log_message ) if self.Log else print( log_message )
+
+    def _promotedFilter( self, conn ) -> tuple[str, dict]:
+        """
+            Returns ( SQL predicate, parameters ) selecting the staging rows already promoted to
+            the fact tables, or ( None, {} ) when none are.
+        """
+        raise NotImplementedError("Subclasses must implement this method")
+
+    def createDailyFactTable( self, dw_database: str = DW_DATABASE ) -> None:
+        """
+            Creates the daily summary fact table shared by EPA dailyData and AirNow daily files.
+        """
+        with self.Engine.begin() as conn:
+            conn.execute( SA.text( f"""
+                IF OBJECT_ID( '{dw_database}.dbo.{DAILY_FACT_TABLE}', 'U' ) IS NULL
+                BEGIN
+                    CREATE TABLE {dw_database}.dbo.{DAILY_FACT_TABLE}
+                    (
+                        Full_Site_Number CHAR(11) NOT NULL
+                        , Date_Local DATE NOT NULL
+                        , Parameter_Code CHAR(5) NOT NULL
+                        , Parameter_Name VARCHAR(50)
+                        , Sample_Duration VARCHAR(25) NOT NULL
+                        , Pollutant_Standard VARCHAR(50) NOT NULL
+                        , Units_of_Measure VARCHAR(50)
+                        , Observation_Count SMALLINT
+                        , Observation_Percent DECIMAL(5, 1)
+                        , Validity_Indicator CHAR(1)
+                        , Arithmetic_Mean DECIMAL(12, 6)
+                        , First_Max_Value DECIMAL(12, 6)
+                        , First_Max_Hour TINYINT
+                        , AQI SMALLINT
+                        , src VARCHAR(25)
+                    )
+                    CREATE UNIQUE CLUSTERED INDEX UC_IDX_SiteParamDate ON {dw_database}.dbo.{DAILY_FACT_TABLE} ( Full_Site_Number, Parameter_Code, Date_Local, Sample_Duration, Pollutant_Standard )
+                END
+            """ ) )
+
+    # =========================================================================
+    # recID watermarks (shared with AirQualityReconciler's state table)
+    # =========================================================================
+    def _getWatermark( self, conn, sourceTable: str ) -> int:
+        """
+            Last recID of sourceTable already promoted, 0 when none (the state table is created when missing).
+        """
+        state_table = f"{self.Database}.dbo.{AirQualityReconciler.STATE_TABLE}"
+        conn.execute( SA.text( f"""
+            IF OBJECT_ID( '{state_table}', 'U' ) IS NULL
+                CREATE TABLE {state_table} ( Source_Table VARCHAR(128) PRIMARY KEY, Last_recID INT NOT NULL )
+        """ ) )
+        return conn.execute( SA.text( f"SELECT Last_recID FROM {state_table} WHERE Source_Table = :t" ), { 't': sourceTable } ).scalar() or 0
+
+    def _setWatermark( self, conn, sourceTable: str, recID: int ) -> None:
+        conn.execute( SA.text( f"""
+            MERGE INTO {self.Database}.dbo.{AirQualityReconciler.STATE_TABLE} AS target
+            USING ( VALUES ( :t, :recid ) ) AS source ( Source_Table, Last_recID )
+            ON target.Source_Table = source.Source_Table
+            WHEN MATCHED THEN UPDATE SET Last_recID = source.Last_recID
+            WHEN NOT MATCHED THEN INSERT ( Source_Table, Last_recID ) VALUES ( source.Source_Table, source.Last_recID );
+        """ ), { 't': sourceTable, 'recid': recID } )
+
+    # =========================================================================
+    # Bulk loading
+    # =========================================================================
+    def _stagingColumns( self, batch: RecordBatch ) -> tuple[list[str], dict[str, dict]]:
+        """
+            Maps the batch's columns to staging columns, encoding the ENCODED_COLUMNS strings.
+
+            Returns:
+                ( staging column names in batch order, { batch column: { value: dictionary id } } )
+        """
+        columns, mappings = [], {}
+        for name in batch.Schema.Names:
+            if name in self.ENCODED_COLUMNS:
+                id_column, dimension = self.ENCODED_COLUMNS[name]
+                # only the batch's distinct values are looked up
+                mappings[name] = self.Sources.ids( dimension, batch.categories( name ) )
+                columns.append( id_column )
+            else:
+                columns.append( name )
+        return columns, mappings
+
+    def _bulkInsert( self, conn, table: str, columns: list[str], batch: RecordBatch, mappings: dict[str, dict] = None
+                   , constants: tuple = (), chunk_size: int = 10000, row_order: bool = False ) -> int:
+        """
+            Inserts the batch with one executemany per chunk of rows (fast_executemany binds the
+            parameters as arrays).  Chunks are views of the batch, so only one chunk of parameter
+            tuples exists at a time.
+
+            Parameters:
+                columns (list) - target columns: the row order column if row_order, the batch columns, then one per constant
+                mappings (dict) - see RecordBatch.parameters
+                constants (tuple) - values inserted on every row (e.g. the source URL id)
+
+            Returns:
+                Number of rows inserted
+        """
+        SQLCode = f"INSERT INTO {table} ( {', '.join( columns )} ) VALUES ( {', '.join( ['?'] * len( columns ) )} )"
+        total_inserted = 0
+        for chunk in batch.chunks( chunk_size ):
+            conn.exec_driver_sql( SQLCode, chunk.parameters( mappings = mappings, constants = constants, row_order = row_order ) )
+            total_inserted += len( chunk )
+        return total_inserted
+
     def createStagingTable( self, tableName: str ) -> None:
         raise NotImplementedError("Subclasses must implement this method")
     
-    def insertIntoStagingTable( self, df: pd.DataFrame, file_url: str = None ) -> None:
+    def insertIntoStagingTable( self, batch: RecordBatch, file_url: str = None ) -> None:
         raise NotImplementedError("Subclasses must implement this method")
       
     def updateDWFactTables( self ) -> None:
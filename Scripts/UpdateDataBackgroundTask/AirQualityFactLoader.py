@@ -0,0 +1,240 @@
+import logging
+import numpy as np
+import pandas as pd
+import sqlalchemy as SA
+from concurrent.futures import ThreadPoolExecutor
+from AirQualityAQI import PARAMETER_POLLUTANTS, calculateParameterAQI
+from AirQualityReconciler import AirQualityReconciler
+from AirQualityFactTables import DW_DATABASE, FACT_TABLES, SRC_AIRNOW
+from AirQualityFactMerge import compassPoints, mergeCombinedAQI, mergeFactRows, updateOzoneRolling, windSpeedMPH
+
+class AirQualityFactLoader:
+    """
+        Loads the AirNow staging rows into the per-pollutant fact tables and Fact_CombinedAQI.
+
+        Each run reads the staging rows loaded since the previous run (by recID, plus rows
+        requeued by a revision) in one query, prepares them and partitions them by parameter
+        in one pass.  The fact tables are then MERGEd concurrently, each on its own pooled
+        connection and transaction, so a refresh takes about as long as the largest table.
+        The ozone 8 hour rolling average is recomputed with the ozone table.  Once every table
+        is written, the combined AQI is rebuilt for the keys the batch touched.
+
+        Rows are marked src = 'AirNow' and never overwrite rows reconciled from EPA.  The
+        watermark only advances after all tables are written; a failed run is simply repeated
+        by the next one.
+
+        Attributes:
+            self.Engine
+            self.StagingDatabase
+            self.StagingTable
+            self.DWDatabase
+            self.Workers
+            self.Log
+    """
+
+    STATE_TABLE = AirQualityReconciler.STATE_TABLE
+    REQUEUE_TABLE = 'Fact_Load_Requeue'
+    SAMPLE_DURATION = '1 HOUR'
+
+    def __init__( self, engine: SA.Engine, staging_database: str, staging_table: str, dw_database: str = DW_DATABASE, workers: int = None, log: logging = None ):
+        """
+            Parameters:
+                workers (int) - fact tables written at the same time, one per fact table by default.
+                                Each holds a pooled connection, so keep it within the engine's pool size plus overflow.
+        """
+        self.Engine = engine
+        self.StagingDatabase = staging_database
+        self.StagingTable = staging_table
+        self.DWDatabase = dw_database
+        self.Workers = workers or len( FACT_TABLES )
+        self.Log = log
+
+    def createStateTables( self ) -> None:
+        with self.Engine.begin() as conn:
+            conn.execute( SA.text( f"""
+                IF OBJECT_ID( '{self.StagingDatabase}.dbo.{self.STATE_TABLE}', 'U' ) IS NULL
+                    CREATE TABLE {self.StagingDatabase}.dbo.{self.STATE_TABLE} ( Source_Table VARCHAR(128) PRIMARY KEY, Last_recID INT NOT NULL )
+                IF OBJECT_ID( '{self.StagingDatabase}.dbo.{self.REQUEUE_TABLE}', 'U' ) IS NULL
+                    CREATE TABLE {self.StagingDatabase}.dbo.{self.REQUEUE_TABLE}
+                    (
+                        Requeue_ID INT IDENTITY(1, 1) PRIMARY KEY
+                        , Source_Table VARCHAR(128) NOT NULL
+                        , recID INT NOT NULL
+                    )
+            """ ) )
+
+    def requeue( self, conn, recIDTable: str ) -> None:
+        """
+            Queues staging rows changed in place (their recID is already behind the watermark) for the next run.
+
+            Parameters:
+                recIDTable (str) - table with a recID column, e.g. the temp table a revision MERGE output into
+        """
+        conn.execute( SA.text( f"""
+            INSERT INTO {self.StagingDatabase}.dbo.{self.REQUEUE_TABLE} ( Source_Table, recID )
+            SELECT DISTINCT :t, recID FROM {recIDTable}
+        """ ), { 't': self.StagingTable } )
+
+    def lastRecID( self, conn ) -> int:
+        return conn.execute( SA.text( f"SELECT Last_recID FROM {self.StagingDatabase}.dbo.{self.STATE_TABLE} WHERE Source_Table = :t" ), { 't': self.StagingTable } ).scalar() or 0
+
+    # =========================================================================
+    # Batch preparation
+    # =========================================================================
+    def _readRows( self, conn, batch_size: int, last_recid: int, last_requeue_id: int ) -> pd.DataFrame:
+        """
+            Staging rows after last_recid (at most batch_size) and, when last_requeue_id is given,
+            the requeued rows up to it.
+        """
+        select = f"""
+            SELECT
+                s.recID
+                , Full_Site_Number = SUBSTRING( s.AQSID, 1, 2 ) + '-' + SUBSTRING( s.AQSID, 3, 3 ) + '-' + SUBSTRING( s.AQSID, 6, 4 )
+                , Parameter_Name = UPPER( s.Parameter_Name )
+                , Date_Time_Local = DATEADD( HOUR, CONVERT( INT, s.GMT_Offset ), s.Valid_DateTime )
+                , Sample_Measurement = s.Reported_Value
+                , Units_of_Measure = s.Reporting_Units
+            FROM {self.StagingDatabase}.dbo.{self.StagingTable} s
+        """
+        names = list( FACT_TABLES )
+        SQLCode = SA.text( f"""
+            SELECT TOP ( :batch_size ) *
+            FROM ( {select} WHERE s.recID > :last_recid ) AS new_rows
+            WHERE Parameter_Name IN :names
+            ORDER BY recID
+        """ ).bindparams( SA.bindparam( 'names', expanding = True ) )
+        rows = pd.read_sql( SQLCode, conn, params = { 'batch_size': batch_size, 'last_recid': last_recid, 'names': names } )
+        if last_requeue_id:
+            SQLCode = SA.text( f"""
+                SELECT *
+                FROM ( {select} JOIN {self.StagingDatabase}.dbo.{self.REQUEUE_TABLE} q ON q.recID = s.recID
+                    WHERE q.Source_Table = :t AND q.Requeue_ID <= :last_requeue_id ) AS requeued
+                WHERE Parameter_Name IN :names
+            """ ).bindparams( SA.bindparam( 'names', expanding = True ) )
+            requeued = pd.read_sql( SQLCode, conn, params = { 't': self.StagingTable, 'last_requeue_id': last_requeue_id, 'names': names } )
+            rows = pd.concat( [ rows, requeued ], ignore_index = True ) if not requeued.empty else rows
+        return rows
+
+    def prepareBatch( self, rows: pd.DataFrame ) -> dict[str, pd.DataFrame]:
+        """
+            Turns staging rows into one fact row per ( parameter, site, local hour ) with AQI values,
+            partitioned by parameter.  When a key repeats the latest loaded row wins.
+
+            Returns:
+                parameter name: fact rows of that parameter
+        """
+        batch = rows.sort_values( 'recID' ) \
+            .drop_duplicates( ['Parameter_Name', 'Full_Site_Number', 'Date_Time_Local'], keep = 'last' ) \
+            .drop( columns = 'recID' )
+        batch['Date_Time_Local'] = pd.to_datetime( batch['Date_Time_Local'] )
+        batch['Sample_Measurement'] = pd.to_numeric( batch['Sample_Measurement'], errors = 'coerce' )
+        batch['Sample_Duration'] = self.SAMPLE_DURATION
+        batch['Date_Local'] = batch['Date_Time_Local'].dt.date
+        batch['Time_Local'] = batch['Date_Time_Local'].dt.time
+
+        groups = {}
+        for parameter_name, group in batch.groupby( 'Parameter_Name', sort = False ):
+            group = group.reset_index( drop = True )
+            if parameter_name in PARAMETER_POLLUTANTS:
+                group['AQI'] = np.nan
+                for unit, unit_rows in group.groupby( 'Units_of_Measure', dropna = False ).indices.items():
+                    group.loc[unit_rows, 'AQI'] = calculateParameterAQI( parameter_name, group['Sample_Measurement'].to_numpy()[unit_rows], unit if isinstance( unit, str ) else None )
+            if parameter_name == 'WS':
+                group['Wind_Speed_MPH'] = windSpeedMPH( group['Sample_Measurement'], group['Units_of_Measure'] )
+            if parameter_name == 'WD':
+                group['Wind_Direction_Grouped'] = compassPoints( group['Sample_Measurement'] )
+            groups[parameter_name] = group
+        return groups
+
+    # =========================================================================
+    # Writing
+    # =========================================================================
+    def run( self, batch_size: int = 500000 ) -> int:
+        """
+            Loads every staging row added (or requeued) since the last run, batch_size rows at a time.
+
+            Returns:
+                Number of fact rows written
+        """
+        total = 0
+        with self.Engine.connect() as conn:
+            last_requeue_id = conn.execute( SA.text( f"SELECT MAX( Requeue_ID ) FROM {self.StagingDatabase}.dbo.{self.REQUEUE_TABLE} WHERE Source_Table = :t" ), { 't': self.StagingTable } ).scalar()
+        while True:
+            with self.Engine.connect() as conn:
+                last_recid = self.lastRecID( conn )
+                rows = self._readRows( conn, batch_size, last_recid, last_requeue_id )
+            if rows.empty and not last_requeue_id:
+                break
+            new_rows = rows[rows['recID'] > last_recid]
+            max_recid = int( new_rows['recID'].max() ) if not new_rows.empty else last_recid
+
+            written = 0
+            if not rows.empty:
+                groups = self.prepareBatch( rows )
+                written, keys = self._loadFactTables( groups )
+                self._loadCombinedAQI( keys )
+            self._saveState( max_recid, last_requeue_id )
+            total += written
+            log_message = f"Loaded {len( rows )} staging rows of {self.StagingTable} into {written} fact rows."
+            self.Log.info( log_message ) if self.Log else print( log_message )
+
+            # requeued rows are only read with the first batch
+            last_requeue_id = None
+            if len( new_rows ) < batch_size:
+                break
+        return total
+
+    def _saveState( self, max_recid: int, last_requeue_id: int ) -> None:
+        with self.Engine.begin() as conn:
+            conn.execute( SA.text( f"""
+                MERGE INTO {self.StagingDatabase}.dbo.{self.STATE_TABLE} AS target
+                USING ( VALUES ( :t, :recid ) ) AS source ( Source_Table, Last_recID )
+                ON target.Source_Table = source.Source_Table
+                WHEN MATCHED THEN UPDATE SET Last_recID = source.Last_recID
+                WHEN NOT MATCHED THEN INSERT ( Source_Table, Last_recID ) VALUES ( source.Source_Table, source.Last_recID );
+            """ ), { 't': self.StagingTable, 'recid': max_recid } )
+            if last_requeue_id:
+                conn.execute( SA.text( f"DELETE FROM {self.StagingDatabase}.dbo.{self.REQUEUE_TABLE} WHERE Source_Table = :t AND Requeue_ID <= :id" )
+                              , { 't': self.StagingTable, 'id': last_requeue_id } )
+
+    def _loadFactTables( self, groups: dict[str, pd.DataFrame] ) -> tuple[int, pd.DataFrame]:
+        """
+            Writes every parameter's rows to its fact table, the tables concurrently.  The first
+            failure is raised once all tables have finished.
+
+            Returns:
+                ( fact rows written, ( Full_Site_Number, Date_Time_Local ) keys whose AQIs may have changed )
+        """
+        with ThreadPoolExecutor( max_workers = min( self.Workers, len( groups ) ), thread_name_prefix = 'FactLoader' ) as executor:
+            futures = { parameter_name: executor.submit( self._loadFactTable, parameter_name, group ) for parameter_name, group in groups.items() }
+        written, keys = 0, []
+        for parameter_name, future in futures.items():
+            table_written, table_keys = future.result()
+            written += table_written
+            keys.append( table_keys )
+        return written, pd.concat( keys, ignore_index = True ).drop_duplicates()
+
+    def _loadFactTable( self, parameter_name: str, group: pd.DataFrame ) -> tuple[int, pd.DataFrame]:
+        """
+            MERGEs one parameter's rows into its fact table on a connection of its own.
+
+            Returns:
+                ( fact rows written, keys written plus the ozone hours whose rolling average was recomputed )
+        """
+        fact_table = FACT_TABLES[parameter_name][0]
+        with self.Engine.begin() as conn:
+            written = mergeFactRows( conn, self.DWDatabase, parameter_name, group, SRC_AIRNOW, overwrite = False )
+            keys = group[['Full_Site_Number', 'Date_Time_Local']]
+            if parameter_name == 'OZONE':
+                keys = pd.concat( [ keys, updateOzoneRolling( conn, self.DWDatabase, keys, src = SRC_AIRNOW ) ], ignore_index = True )
+
+        log_message = f"Merged {written} rows into {self.DWDatabase}.dbo.{fact_table}"
+        self.Log.debug( log_message ) if self.Log else print( log_message )
+        return written, keys
+
+    def _loadCombinedAQI( self, keys: pd.DataFrame ) -> None:
+        """
+            Rebuilds the combined AQI (highest AQI of any pollutant and which one) of the given keys.
+        """
+        with self.Engine.begin() as conn:
+            mergeCombinedAQI( conn, self.DWDatabase, keys, SRC_AIRNOW, overwrite = False )
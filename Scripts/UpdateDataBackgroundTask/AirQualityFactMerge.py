@@ -0,0 +1,228 @@
+"""
+    Writes prepared fact rows into the AirQuality_DW fact tables.
+
+    Shared by AirQualityFactLoader (AirNow rows, src = 'AirNow') and AirQualityReconciler
+    (validated EPA rows, src = 'EPA'): the derived wind columns, the fact table MERGE, the
+    ozone 8 hour rolling average and the combined AQI.  Every function takes an open
+    connection, so the caller decides the transaction.
+
+    Where an AirNow row must not replace a validated one, overwrite = False only updates
+    matched rows that already carry the caller's src.
+"""
+
+import numpy as np
+import pandas as pd
+import sqlalchemy as SA
+from AirQualityAQI import PARAMETER_POLLUTANTS, UNIT_SCALES, calculateAQI
+from AirQualityFactTables import FACT_TABLES, COMBINED_AQI_TABLE, OZONE_ROLLING_HOURS
+
+# Wind speed units (upper case) to miles per hour, other units are taken as miles per hour
+MPH_SCALES = { 'KNOTS': 1.150779, 'KNOT': 1.150779, 'M/S': 2.236936, 'METERS/SECOND': 2.236936 }
+
+# Wind_Direction_Grouped values, 45 degree sectors starting centered on north
+COMPASS_POINTS = [ 'N', 'NE', 'E', 'SE', 'S', 'SW', 'W', 'NW' ]
+
+KEY_COLUMNS = [ 'Full_Site_Number', 'Date_Local', 'Time_Local', 'Date_Time_Local' ]
+
+# =========================================================================
+# Derived columns
+# =========================================================================
+def windSpeedMPH( values, units ) -> np.ndarray:
+    """
+        Converts wind speeds to whole miles per hour.
+
+        Parameters:
+            values (array-like) - wind speeds
+            units (array-like) - units of each speed
+    """
+    scale = pd.Series( units, dtype = object ).str.upper().map( MPH_SCALES ).fillna( 1.0 ).to_numpy( dtype = np.float64 )
+    return np.round( np.asarray( values, dtype = np.float64 ) * scale )
+
+def compassPoints( directions ) -> list:
+    """
+        Groups wind directions (degrees the wind blows from) into compass points, None where the direction is missing.
+    """
+    sector = np.floor( ( np.asarray( directions, dtype = np.float64 ) % 360 + 22.5 ) / 45 ) % 8
+    return [ None if np.isnan( s ) else COMPASS_POINTS[int( s )] for s in sector ]
+
+def factColumns( parameter_name: str ) -> dict[str, str]:
+    """
+        Returns the fact table columns written for a parameter and the batch column each is read from.
+    """
+    _, prefix, _ = FACT_TABLES[parameter_name]
+    columns = {
+        f"{prefix}_Sample_Measurement": 'Sample_Measurement'
+        , f"{prefix}_Units_of_Measure": 'Units_of_Measure'
+        , f"{prefix}_Sample_Duration": 'Sample_Duration'
+    }
+    if parameter_name in PARAMETER_POLLUTANTS:
+        columns[f"{prefix}_AQI"] = 'AQI'
+    if parameter_name == 'WS':
+        columns['Wind_Speed_MPH'] = 'Wind_Speed_MPH'
+    if parameter_name == 'WD':
+        columns['Wind_Direction_Grouped'] = 'Wind_Direction_Grouped'
+    return columns
+
+# =========================================================================
+# Writing
+# =========================================================================
+def mergeFactRows( conn, dw_database: str, parameter_name: str, group: pd.DataFrame, src: str, overwrite: bool = True ) -> int:
+    """
+        MERGEs one parameter's rows into its fact table on ( Full_Site_Number, Date_Time_Local ).
+
+        Parameters:
+            group (DataFrame) - the key columns plus the batch columns named by factColumns
+            src (str) - src of the rows written
+            overwrite (bool) - True updates every matched row and marks it src, False only matched rows already marked src
+
+        Returns:
+            Number of fact rows written
+    """
+    fact_table = FACT_TABLES[parameter_name][0]
+    columns = factColumns( parameter_name )
+    source = group[KEY_COLUMNS + list( columns.values() )].astype( object )
+    source['Date_Time_Local'] = pd.to_datetime( group['Date_Time_Local'] ).dt.to_pydatetime()
+    parameters = list( source.where( group[source.columns].notna(), None ).itertuples( index = False, name = None ) )
+
+    temp = f"#Merge_{fact_table}"
+    conn.execute( SA.text( f"""
+        DROP TABLE IF EXISTS {temp}
+        SELECT TOP 0 {', '.join( KEY_COLUMNS )}, {', '.join( columns )}
+        INTO {temp}
+        FROM {dw_database}.dbo.{fact_table}
+    """ ) )
+    conn.exec_driver_sql(
+        f"INSERT INTO {temp} ( {', '.join( KEY_COLUMNS )}, {', '.join( columns )} ) VALUES ( {', '.join( ['?'] * ( len( KEY_COLUMNS ) + len( columns ) ) )} )"
+        , parameters
+    )
+    matched = "WHEN MATCHED THEN" if overwrite else "WHEN MATCHED AND target.src = :src THEN"
+    written = conn.execute( SA.text( f"""
+        MERGE INTO {dw_database}.dbo.{fact_table} AS target
+        USING {temp} AS source
+        ON target.Full_Site_Number = source.Full_Site_Number
+            AND target.Date_Time_Local = source.Date_Time_Local
+        {matched}
+            UPDATE SET {', '.join( f"{c} = source.{c}" for c in columns )}, src = :src
+        WHEN NOT MATCHED THEN
+            INSERT ( {', '.join( KEY_COLUMNS )}, {', '.join( columns )}, src )
+            VALUES ( {', '.join( 'source.' + c for c in KEY_COLUMNS )}, {', '.join( 'source.' + c for c in columns )}, :src );
+    """ ), { 'src': src } ).rowcount
+    conn.execute( SA.text( f"DROP TABLE {temp}" ) )
+    return written
+
+def updateOzoneRolling( conn, dw_database: str, changed: pd.DataFrame, src: str = None ) -> pd.DataFrame:
+    """
+        Recomputes the 8 hour rolling average and its AQI for every ozone hour whose window includes
+        a changed hour.  A rolling value needs at least 6 of the 8 hours.  A window can mix EPA (PPM)
+        and AirNow (PPB) hours, so hours are averaged in PPM and the average is stored in the units
+        of the hour it belongs to.
+
+        Parameters:
+            changed (DataFrame) - Full_Site_Number, Date_Time_Local of the ozone hours written
+            src (str) - only hours with this src are updated, None for every hour
+
+        Returns:
+            Keys ( Full_Site_Number, Date_Time_Local ) of the hours updated
+    """
+    fact_table, prefix, _ = FACT_TABLES['OZONE']
+    changed = changed.assign( Date_Time_Local = pd.to_datetime( changed['Date_Time_Local'] ) )
+    lookback = pd.Timedelta( hours = OZONE_ROLLING_HOURS - 1 )
+    SQLCode = SA.text( f"""
+        SELECT Full_Site_Number, Date_Time_Local, Value = {prefix}_Sample_Measurement, Units = {prefix}_Units_of_Measure
+        FROM {dw_database}.dbo.{fact_table}
+        WHERE Full_Site_Number IN :sites AND Date_Time_Local BETWEEN :first AND :last
+    """ ).bindparams( SA.bindparam( 'sites', expanding = True ) )
+    hourly = pd.read_sql( SQLCode, conn, params = {
+        'sites': changed['Full_Site_Number'].unique().tolist()
+        , 'first': ( changed['Date_Time_Local'].min() - lookback ).to_pydatetime()
+        , 'last': ( changed['Date_Time_Local'].max() + lookback ).to_pydatetime()
+    } )
+    if hourly.empty:
+        return pd.DataFrame( columns = [ 'Full_Site_Number', 'Date_Time_Local' ] )
+    hourly['Full_Site_Number'] = hourly['Full_Site_Number'].str.strip()
+    hourly['Date_Time_Local'] = pd.to_datetime( hourly['Date_Time_Local'] )
+    hourly['Scale'] = [ UNIT_SCALES.get( ( 'OZONE', ( units or '' ).upper() ), 1.0 ) for units in hourly['Units'] ]
+    hourly['PPM'] = pd.to_numeric( hourly['Value'], errors = 'coerce' ) * hourly['Scale']
+
+    updates = []
+    changed_by_site = changed.groupby( 'Full_Site_Number' )['Date_Time_Local']
+    for site, site_hours in hourly.groupby( 'Full_Site_Number' ):
+        site_hours = site_hours.drop_duplicates( 'Date_Time_Local' ).set_index( 'Date_Time_Local' ).sort_index()
+        rolling = site_hours['PPM'].asfreq( 'h' ).rolling( OZONE_ROLLING_HOURS, min_periods = 6 ).mean()
+        affected = { t + pd.Timedelta( hours = h ) for t in changed_by_site.get_group( site ) for h in range( OZONE_ROLLING_HOURS ) }
+        rolling = rolling[rolling.index.isin( affected ) & rolling.index.isin( site_hours.index )]
+        aqi = calculateAQI( 'O3 - 8hr', rolling.to_numpy() )
+        average = rolling.to_numpy() / site_hours['Scale'].reindex( rolling.index ).to_numpy()
+        updates += [
+            ( None if np.isnan( v ) else round( float( v ), 5 ), None if np.isnan( a ) else int( a ), site, t.to_pydatetime() )
+            for t, v, a in zip( rolling.index, average, aqi )
+        ]
+    if updates:
+        conn.exec_driver_sql( f"""
+            UPDATE {dw_database}.dbo.{fact_table}
+            SET {prefix}_8Hr_Rolling_Avg = ?, {prefix}_8Hr_AQI = ?
+            WHERE Full_Site_Number = ? AND Date_Time_Local = ?{" AND src = ?" if src is not None else ""}
+        """, [ update + ( src, ) if src is not None else update for update in updates ] )
+    return pd.DataFrame( [ ( site, pd.Timestamp( t ) ) for _, _, site, t in updates ], columns = [ 'Full_Site_Number', 'Date_Time_Local' ] )
+
+def mergeCombinedAQI( conn, dw_database: str, keys: pd.DataFrame, src: str, overwrite: bool = True ) -> None:
+    """
+        Rebuilds the combined AQI (highest AQI of any pollutant, the ozone 8 hour AQI included, and
+        which pollutant it is) of the given keys.
+
+        Parameters:
+            keys (DataFrame) - Full_Site_Number, Date_Time_Local
+            src (str) - src of the rows written
+            overwrite (bool) - True updates every matched row and marks it src, False only matched rows already marked src
+    """
+    if keys.empty:
+        return
+    joins = []
+    candidates = []
+    for parameter_name, ( fact_table, prefix, _ ) in FACT_TABLES.items():
+        if parameter_name not in PARAMETER_POLLUTANTS:
+            continue
+        alias = f"f_{prefix}"
+        joins.append( f"LEFT JOIN {dw_database}.dbo.{fact_table} {alias} ON {alias}.Full_Site_Number = k.Full_Site_Number AND {alias}.Date_Time_Local = k.Date_Time_Local" )
+        candidates.append( f"( {alias}.{prefix}_AQI, '{parameter_name}' )" )
+        if parameter_name == 'OZONE':
+            candidates.append( f"( {alias}.{prefix}_8Hr_AQI, '{parameter_name}' )" )
+    keys = keys[['Full_Site_Number', 'Date_Time_Local']].assign( Date_Time_Local = pd.to_datetime( keys['Date_Time_Local'] ) ).drop_duplicates()
+    conn.execute( SA.text( """
+        DROP TABLE IF EXISTS #CombinedAQIKeys
+        CREATE TABLE #CombinedAQIKeys ( Full_Site_Number CHAR(11), Date_Time_Local DATETIME, PRIMARY KEY ( Full_Site_Number, Date_Time_Local ) )
+    """ ) )
+    conn.exec_driver_sql(
+        "INSERT INTO #CombinedAQIKeys ( Full_Site_Number, Date_Time_Local ) VALUES ( ?, ? )"
+        , list( zip( keys['Full_Site_Number'], keys['Date_Time_Local'].dt.to_pydatetime() ) )
+    )
+    matched = "WHEN MATCHED THEN" if overwrite else "WHEN MATCHED AND target.src = :src THEN"
+    nl = '\n            '
+    conn.execute( SA.text( f"""
+        MERGE INTO {dw_database}.dbo.{COMBINED_AQI_TABLE} AS target
+        USING (
+            SELECT
+                k.Full_Site_Number
+                , CONVERT( DATE, k.Date_Time_Local ) AS Date_Local
+                , CONVERT( TIME, k.Date_Time_Local ) AS Time_Local
+                , k.Date_Time_Local
+                , best.AQI
+                , best.Contributor
+            FROM #CombinedAQIKeys k
+            {nl.join( joins )}
+            CROSS APPLY (
+                SELECT TOP 1 v.AQI, v.Contributor
+                FROM ( VALUES {', '.join( candidates )} ) v ( AQI, Contributor )
+                WHERE v.AQI IS NOT NULL
+                ORDER BY v.AQI DESC
+            ) best
+        ) AS source
+        ON target.Full_Site_Number = source.Full_Site_Number
+            AND target.Date_Time_Local = source.Date_Time_Local
+        {matched}
+            UPDATE SET Combined_AQI = source.AQI, Combined_AQI_Contributor = source.Contributor, src = :src
+        WHEN NOT MATCHED THEN
+            INSERT ( Full_Site_Number, Date_Local, Time_Local, Date_Time_Local, Combined_AQI, Combined_AQI_Contributor, src )
+            VALUES ( source.Full_Site_Number, source.Date_Local, source.Time_Local, source.Date_Time_Local, source.AQI, source.Contributor, :src );
+        DROP TABLE #CombinedAQIKeys
+    """ ), { 'src': src } )
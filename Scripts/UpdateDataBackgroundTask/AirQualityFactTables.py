@@ -0,0 +1,55 @@
+"""
+    Shared description of the AirQuality_DW fact tables.
+
+    Maps each AirNow parameter name to the fact table that holds it, the column
+    prefix used inside that table, and the matching EPA AQS parameter code.
+"""
+
+DW_DATABASE = 'AirQuality_DW'
+
+# Values written to the src column of every fact table
+SRC_AIRNOW = 'AirNow'
+SRC_EPA = 'EPA'
+
+FACT_TABLES = {
+    # AirNow parameter name: ( fact table, column prefix, AQS parameter code )
+    'OZONE': ( 'Fact_Ozone', 'Ozone', '44201' )
+    , 'PM2.5': ( 'Fact_ParticulateMatterFine_PM2_5', 'PM_2_5', '88101' )
+    , 'PM10': ( 'Fact_ParticulateMatterCoarse_PM10', 'PM_10', '86101' )
+    , 'CO': ( 'Fact_CarbonMonoxide', 'CO', '42101' )
+    , 'NO2': ( 'Fact_NitrogenDioxide', 'NO2', '42602' )
+    , 'SO2': ( 'Fact_SulfurDioxide', 'SO2', '42401' )
+    , 'TEMP': ( 'Fact_OutdoorTemperature', 'Temperature', '62101' )
+    , 'WD': ( 'Fact_WindDirection', 'Wind_Direction', '61104' )
+    , 'WS': ( 'Fact_WindSpeed', 'Wind_Speed', '61103' )
+}
+
+COMBINED_AQI_TABLE = 'Fact_CombinedAQI'
+
+# Daily summaries (EPA dailyData) for long-horizon history, one row per site, parameter, day, duration and standard
+DAILY_FACT_TABLE = 'Fact_Daily_Summary'
+
+# Ozone facts carry an 8 hour rolling average, so a changed hour also changes the 7 hours after it
+OZONE_ROLLING_HOURS = 8
+
+def factTableForParameter( parameter_name: str ) -> str:
+    """
+        Returns the fact table for an AirNow parameter name, or None if the parameter is not warehoused.
+    """
+    entry = FACT_TABLES.get( parameter_name.upper() ) if parameter_name else None
+    return entry[0] if entry else None
+
+def parameterForAQSCode( parameter_code: str ) -> str:
+    """
+        Returns the AirNow parameter name for an EPA AQS parameter code, or None if it is not warehoused.
+    """
+    for parameter_name, ( _, _, aqs_code ) in FACT_TABLES.items():
+        if aqs_code == parameter_code:
+            return parameter_name
+    return None
+
+def fullSiteNumber( aqsid: str ) -> str:
+    """
+        Converts a 9 character AQSID (SSCCCNNNN) into the DW Full_Site_Number format (SS-CCC-NNNN).
+    """
+    return f"{aqsid[:2]}-{aqsid[2:5]}-{aqsid[5:9]}"
@@ -0,0 +1,326 @@
+import json
+import logging
+import threading
+import numpy as np
+import pandas as pd
+import sqlalchemy as SA
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+from AirQualityAQI import PARAMETER_POLLUTANTS, UNIT_SCALES, calculateAQI, calculateParameterAQI
+from AirQualityFactTables import DW_DATABASE, FACT_TABLES, OZONE_ROLLING_HOURS, fullSiteNumber
+
+class AirQualityHotWindow:
+    """
+        In-memory store of the most recent hours of readings for every site and parameter.
+
+        Each ( Full_Site_Number, parameter ) pair owns one row of a set of fixed-size
+        NumPy ring buffers indexed by hour % Hours, so an hourly ingest is a handful of
+        array writes and a lookup is a dict access plus a slice.  It is fed directly by
+        the AirNow updater, warmed from the DW fact tables on startup, and served as JSON
+        over a small local HTTP server so dashboards and alerting scripts can stop
+        polling SQL Server for data that only changes once an hour.
+
+        Times are local standard time hours, matching Date_Time_Local in the fact tables.
+        The ozone AQI is the higher of the 1 hour and 8 hour rolling average AQIs (computed
+        from the buffered hours in PPM), the same candidates as Fact_CombinedAQI.
+
+        Attributes:
+            self.Hours
+            self.Log
+    """
+    def __init__( self, hours: int = 72, initial_slots: int = 256, log: logging = None ):
+        self.Hours = hours
+        self.Log = log
+        self._lock = threading.RLock()
+        self._slots = {}           # ( site, parameter ): row in the buffers
+        self._sites = {}           # site: { parameter: row }
+        self._capacity = max( initial_slots, 1 )
+        self._stamp = np.full( ( self._capacity, hours ), -1, dtype = np.int64 )     # hours since epoch, -1 when empty
+        self._value = np.full( ( self._capacity, hours ), np.nan, dtype = np.float64 )
+        self._aqi = np.full( ( self._capacity, hours ), np.nan, dtype = np.float32 )
+        self._ppm = np.full( ( self._capacity, hours ), np.nan, dtype = np.float64 )      # ozone concentration in PPM
+        self._latest = np.full( self._capacity, -1, dtype = np.int64 )
+        self._server = None
+
+    # =========================================================================
+    # Ingestion
+    # =========================================================================
+    def _slot( self, site: str, parameter: str ) -> int:
+        row = self._slots.get( ( site, parameter ) )
+        if row is None:
+            row = len( self._slots )
+            if row == self._capacity:
+                self._grow()
+            self._slots[( site, parameter )] = row
+            self._sites.setdefault( site, {} )[parameter] = row
+        return row
+
+    def _grow( self ) -> None:
+        new_capacity = self._capacity * 2
+        def grown( old, fill ):
+            new = np.full( ( new_capacity, ) + old.shape[1:], fill, dtype = old.dtype )
+            new[:self._capacity] = old
+            return new
+        self._stamp = grown( self._stamp, -1 )
+        self._value = grown( self._value, np.nan )
+        self._aqi = grown( self._aqi, np.nan )
+        self._ppm = grown( self._ppm, np.nan )
+        self._latest = grown( self._latest, -1 )
+        self._capacity = new_capacity
+
+    def ingest( self, sites, parameters, times, values, aqis = None, units = None ) -> int:
+        """
+            Writes a batch of readings into the ring buffers.  Readings older than the
+            window (relative to the newest reading for that site and parameter) are ignored.
+
+            Parameters:
+                sites (array-like) - Full_Site_Number of each reading
+                parameters (array-like) - AirNow parameter name of each reading
+                times (array-like) - local reading hour, anything numpy can convert to datetime64[h]
+                values (array-like) - reading values
+                aqis (array-like) - AQI of each reading, NaN when not applicable
+                units (array-like) - units of each reading, used to convert ozone to PPM
+
+            Returns:
+                Number of readings written
+        """
+        hours = np.asarray( times, dtype = 'datetime64[h]' ).astype( np.int64 )
+        values = np.asarray( values, dtype = np.float64 )
+        aqis = np.full( values.shape, np.nan ) if aqis is None else np.asarray( aqis, dtype = np.float32 )
+        ozone = np.asarray( parameters, dtype = object ) == 'OZONE'
+        ppm = np.full( values.shape, np.nan )
+        if ozone.any():
+            scales = np.ones( values.shape ) if units is None else np.array( [ UNIT_SCALES.get( ( 'OZONE', str( u or '' ).upper() ), 1.0 ) for u in units ] )
+            ppm[ozone] = values[ozone] * scales[ozone]
+        written = 0
+        with self._lock:
+            rows = np.fromiter( ( self._slot( s, p ) for s, p in zip( sites, parameters ) ), dtype = np.int64, count = len( values ) )
+            # newest hour per slot first so stale readings in the same batch can be dropped
+            np.maximum.at( self._latest, rows, hours )
+            keep = hours > self._latest[rows] - self.Hours
+            ozone_rows = np.unique( rows[keep & ozone] )
+            rows, hours, cols = rows[keep], hours[keep], hours[keep] % self.Hours
+            self._stamp[rows, cols] = hours
+            self._value[rows, cols] = values[keep]
+            self._aqi[rows, cols] = aqis[keep]
+            self._ppm[rows, cols] = ppm[keep]
+            for row in ozone_rows:
+                self._updateOzoneAQI( row )
+            written = int( keep.sum() )
+        return written
+
+    def _updateOzoneAQI( self, row: int ) -> None:
+        # hours with enough of their 8 hour window buffered get max( 1 hour AQI, 8 hour AQI ),
+        # the others keep the AQI they were ingested with
+        wanted = np.arange( self._latest[row] - self.Hours + 1, self._latest[row] + 1 )
+        cols = wanted % self.Hours
+        present = self._stamp[row, cols] == wanted
+        ppm = np.where( present, self._ppm[row, cols], np.nan )
+        rolling = pd.Series( ppm ).rolling( OZONE_ROLLING_HOURS, min_periods = 6 ).mean().to_numpy()
+        update = present & ~np.isnan( rolling )
+        aqi = np.fmax( calculateAQI( 'O3 - 1hr', ppm ), calculateAQI( 'O3 - 8hr', rolling ) )
+        self._aqi[row, cols[update]] = aqi[update]
+
+    def ingestAirNow( self, df: pd.DataFrame ) -> int:
+        """
+            Ingests rows of an AirNow hourly file (as read by AirNow_AirQualityDataUpdater).
+            AirNow times are GMT, so the GMT offset is applied to get local standard time.
+        """
+        if df.empty:
+            return 0
+        gmt = pd.to_datetime( df['Valid date'].astype( str ) + ' ' + df['valid time'].astype( str ), format = '%m/%d/%y %H:%M' )
+        local = gmt + pd.to_timedelta( pd.to_numeric( df['GMT offset'] ), unit = 'h' )
+        parameters = df['parameter name'].astype( str ).str.upper().to_numpy()
+        values = pd.to_numeric( df['value'], errors = 'coerce' ).to_numpy( dtype = np.float64 )
+        units = df['reporting units'].astype( str ).to_numpy()
+
+        aqis = np.full( len( df ), np.nan )
+        for parameter in np.unique( parameters ):
+            for unit in np.unique( units[parameters == parameter] ):
+                mask = ( parameters == parameter ) & ( units == unit )
+                aqis[mask] = calculateParameterAQI( parameter, values[mask], unit )
+
+        sites = [ fullSiteNumber( str( aqsid ).zfill( 9 ) ) for aqsid in df['AQSID'] ]
+        return self.ingest( sites, parameters, local.to_numpy(), values, aqis, units )
+
+    def warmFromFactTables( self, engine: SA.Engine, database: str = DW_DATABASE ) -> int:
+        """
+            Loads the last self.Hours hours of every fact table so the window is useful immediately after startup.
+
+            Returns:
+                Number of readings loaded
+        """
+        total = 0
+        for parameter_name, ( fact_table, prefix, _ ) in FACT_TABLES.items():
+            aqi_column = f"{prefix}_AQI" if parameter_name in PARAMETER_POLLUTANTS else "NULL"
+            if parameter_name == 'OZONE':
+                aqi_column = f"( SELECT MAX( a ) FROM ( VALUES ( {prefix}_AQI ), ( {prefix}_8Hr_AQI ) ) AS v ( a ) )"
+            SQLCode = f"""
+                SELECT Full_Site_Number, Date_Time_Local, {prefix}_Sample_Measurement AS Value, {aqi_column} AS AQI, {prefix}_Units_of_Measure AS Units
+                FROM {database}.dbo.{fact_table}
+                WHERE Date_Time_Local > DATEADD( HOUR, -{self.Hours}, ( SELECT MAX( Date_Time_Local ) FROM {database}.dbo.{fact_table} ) )
+            """
+            try:
+                with engine.connect() as conn:
+                    df = pd.read_sql( SA.text( SQLCode ), conn )
+            except Exception as e:
+                log_message = f"Error warming hot window from {database}.dbo.{fact_table}. {e}"
+                self.Log.error( log_message ) if self.Log else print( log_message )
+                continue
+            if not df.empty:
+                total += self.ingest(
+                    df['Full_Site_Number'].to_numpy()
+                    , np.full( len( df ), parameter_name )
+                    , df['Date_Time_Local'].to_numpy()
+                    , pd.to_numeric( df['Value'], errors = 'coerce' ).to_numpy( dtype = np.float64 )
+                    , pd.to_numeric( df['AQI'], errors = 'coerce' ).to_numpy( dtype = np.float64 )
+                    , df['Units'].to_numpy()
+                )
+        log_message = f"Hot window warmed with {total} readings from the fact tables."
+        self.Log.info( log_message ) if self.Log else print( log_message )
+        return total
+
+    # =========================================================================
+    # Lookups
+    # =========================================================================
+    def _reading( self, row: int, col: int ) -> dict:
+        aqi = self._aqi[row, col]
+        return {
+            'time': str( np.datetime64( int( self._stamp[row, col] ), 'h' ) )
+            , 'value': float( self._value[row, col] ) if not np.isnan( self._value[row, col] ) else None
+            , 'aqi': int( aqi ) if not np.isnan( aqi ) else None
+        }
+
+    def latest( self, site: str = None, parameter: str = None ) -> list[dict]:
+        """
+            Latest reading of every site and parameter, optionally filtered to one site and/or parameter.
+        """
+        parameter = parameter.upper() if parameter else None
+        results = []
+        with self._lock:
+            for ( slot_site, slot_parameter ), row in self._slots.items():
+                if ( site and slot_site != site ) or ( parameter and slot_parameter != parameter ):
+                    continue
+                latest = self._latest[row]
+                if latest < 0 or self._stamp[row, latest % self.Hours] != latest:
+                    continue
+                results.append( { 'site': slot_site, 'parameter': slot_parameter, **self._reading( row, latest % self.Hours ) } )
+        return results
+
+    def trend( self, site: str, parameter: str, hours: int = 36 ) -> dict:
+        """
+            Hourly series for one site and parameter covering the last `hours` hours up to its latest reading.
+            Hours without a reading are returned with null values.
+        """
+        hours = min( hours, self.Hours )
+        with self._lock:
+            row = self._slots.get( ( site, parameter.upper() ) )
+            if row is None or self._latest[row] < 0:
+                return { 'site': site, 'parameter': parameter.upper(), 'readings': [] }
+            wanted = np.arange( self._latest[row] - hours + 1, self._latest[row] + 1 )
+            cols = wanted % self.Hours
+            present = self._stamp[row, cols] == wanted
+            values = np.where( present, self._value[row, cols], np.nan )
+            aqis = np.where( present, self._aqi[row, cols], np.nan )
+        readings = [
+            {
+                'time': str( np.datetime64( int( h ), 'h' ) )
+                , 'value': None if np.isnan( v ) else float( v )
+                , 'aqi': None if np.isnan( a ) else int( a )
+            }
+            for h, v, a in zip( wanted, values, aqis )
+        ]
+        return { 'site': site, 'parameter': parameter.upper(), 'readings': readings }
+
+    def snapshot( self, site: str ) -> dict:
+        """
+            Latest reading of every parameter at one site plus the highest current AQI.
+        """
+        readings = { reading['parameter']: reading for reading in self.latest( site = site ) }
+        aqis = [ ( r['aqi'], p ) for p, r in readings.items() if r['aqi'] is not None ]
+        combined = max( aqis ) if aqis else ( None, None )
+        return { 'site': site, 'combined_aqi': combined[0], 'combined_aqi_contributor': combined[1], 'readings': readings }
+
+    def frame( self ) -> pd.DataFrame:
+        """
+            Every buffered reading as a DataFrame ( site, parameter, time, value, aqi ).
+        """
+        with self._lock:
+            keys = list( self._slots.items() )
+            rows = np.array( [ row for _, row in keys ], dtype = np.int64 )
+            stamps = self._stamp[rows]
+            values = self._value[rows]
+            aqis = self._aqi[rows]
+        present = stamps >= 0
+        slot_index, _ = np.nonzero( present )
+        return pd.DataFrame( {
+            'site': np.array( [ site for ( site, _ ), _ in keys ], dtype = object )[slot_index]
+            , 'parameter': np.array( [ parameter for ( _, parameter ), _ in keys ], dtype = object )[slot_index]
+            , 'time': stamps[present].astype( 'datetime64[h]' )
+            , 'value': values[present]
+            , 'aqi': aqis[present].astype( np.float64 )
+        } )
+
+    def sites( self ) -> list[str]:
+        with self._lock:
+            return sorted( self._sites )
+
+    # =========================================================================
+    # JSON service
+    # =========================================================================
+    def serve( self, host: str = '127.0.0.1', port: int = 8765 ) -> ThreadingHTTPServer:
+        """
+            Starts the JSON read API on a background thread.
+
+            Routes:
+                /sites
+                /latest?site=32-003-0043&parameter=PM2.5   (both filters optional)
+                /trend?site=32-003-0043&parameter=OZONE&hours=36
+                /snapshot?site=32-003-0043
+        """
+        window = self
+
+        class _Handler( BaseHTTPRequestHandler ):
+            def do_GET( self ):
+                url = urlparse( self.path )
+                query = { k: v[0] for k, v in parse_qs( url.query ).items() }
+                try:
+                    if url.path == '/sites':
+                        body = window.sites()
+                    elif url.path == '/latest':
+                        body = window.latest( query.get( 'site' ), query.get( 'parameter' ) )
+                    elif url.path == '/trend':
+                        hours = query.get( 'hours', '36' )
+                        if not hours.isdigit() or int( hours ) < 1:
+                            self.send_error( 400, f"hours must be a positive integer: {hours}" )
+                            return
+                        body = window.trend( query['site'], query['parameter'], int( hours ) )
+                    elif url.path == '/snapshot':
+                        body = window.snapshot( query['site'] )
+                    else:
+                        self.send_error( 404 )
+                        return
+                except KeyError as e:
+                    self.send_error( 400, f"Missing query parameter: {e}" )
+                    return
+                payload = json.dumps( body ).encode( 'utf-8' )
+                self.send_response( 200 )
+                self.send_header( 'Content-Type', 'application/json' )
+                self.send_header( 'Content-Length', str( len( payload ) ) )
+                self.end_headers()
+                self.wfile.write( payload )
+
+            def log_message( self, format, *args ):
+                if window.Log:
+                    window.Log.debug( f"Hot window API: {format % args}" )
+
+        self._server = ThreadingHTTPServer( ( host, port ), _Handler )
+        threading.Thread( target = self._server.serve_forever, daemon = True ).start()
+        log_message = f"Hot window API listening on http://{host}:{port}"
+        self.Log.info( log_message ) if self.Log else print( log_message )
+        return self._server
+
+    def shutdown( self ) -> None:
+        if self._server:
+            self._server.shutdown()
+            self._server = None
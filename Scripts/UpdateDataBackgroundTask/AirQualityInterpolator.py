@@ -0,0 +1,243 @@
+import os
+import json
+import hashlib
+import logging
+import numpy as np
+import pandas as pd
+import sqlalchemy as SA
+from AirQualityAQI import PARAMETER_POLLUTANTS
+from AirQualityFactTables import DW_DATABASE
+from AirQualitySiteIndex import EARTH_RADIUS_KM
+
+class AirQualityInterpolator:
+    """
+        Inverse-distance-weighted (IDW) surfaces for AQI and each AQI pollutant on a fixed
+        lat/long grid, written to disk as raster tiles.
+
+        The site layout rarely changes, so the cell-to-site weight matrix is computed once
+        per layout and every surface is two matrix products (weighted values and weights of
+        the sites that reported).  Hours are fingerprinted from their input readings and
+        only hours whose readings changed are regenerated.
+
+        Output layout (under self.OutputDir):
+            grid.json                       - bounds, resolution, shape and tile size
+            <layer>/<YYYYMMDD>.dat          - float32 memmap of shape (24, tiles_y, tiles_x, tile, tile),
+                                              one contiguous block per tile so a map tile is a single read
+            <layer>/manifest.json           - input fingerprint of every generated hour
+
+        Attributes:
+            self.OutputDir
+            self.Bounds
+            self.Resolution
+            self.Power
+            self.MaxDistanceKm
+            self.TileSize
+            self.Log
+    """
+
+    AQI_LAYER = 'AQI'
+
+    def __init__( self, output_dir: str, bounds: tuple[float, float, float, float] = ( 35.90, 36.40, -115.45, -114.90 ), resolution: float = 0.005
+                 , power: float = 2.0, max_distance_km: float = None, tile_size: int = 64, log: logging = None ):
+        """
+            Parameters:
+                output_dir (str) - where the raster tiles are written
+                bounds (tuple) - ( lat_min, lat_max, lon_min, lon_max ), defaults to the Las Vegas metro area
+                resolution (float) - cell size in degrees
+                power (float) - IDW distance exponent
+                max_distance_km (float) - sites further than this from a cell are ignored, None for no limit
+                tile_size (int) - cells per tile edge
+        """
+        self.OutputDir = output_dir
+        self.Bounds = bounds
+        self.Resolution = resolution
+        self.Power = power
+        self.MaxDistanceKm = max_distance_km
+        self.TileSize = tile_size
+        self.Log = log
+
+        lat_min, lat_max, lon_min, lon_max = bounds
+        self.Latitudes = lat_max - ( np.arange( int( round( ( lat_max - lat_min ) / resolution ) ) ) + 0.5 ) * resolution     # north to south
+        self.Longitudes = lon_min + ( np.arange( int( round( ( lon_max - lon_min ) / resolution ) ) ) + 0.5 ) * resolution
+        self.Shape = ( len( self.Latitudes ), len( self.Longitudes ) )
+        self._tiles = ( -( -self.Shape[0] // tile_size ), -( -self.Shape[1] // tile_size ) )
+
+        self._siteNumbers = np.array( [], dtype = object )
+        self._siteLookup = {}
+        self._weights = None
+
+        os.makedirs( self.OutputDir, exist_ok = True )
+        with open( os.path.join( self.OutputDir, 'grid.json' ), 'w' ) as f:
+            json.dump( {
+                'bounds': list( bounds ), 'resolution': resolution, 'shape': list( self.Shape )
+                , 'tile_size': tile_size, 'tiles': list( self._tiles ), 'dtype': 'float32', 'hours_per_file': 24
+            }, f )
+
+    # =========================================================================
+    # Site layout
+    # =========================================================================
+    def setSites( self, site_numbers, latitudes, longitudes ) -> None:
+        """
+            Sets the site layout and precomputes the ( cells x sites ) IDW weight matrix.
+            Does nothing when the layout is unchanged.
+        """
+        site_numbers = np.asarray( site_numbers, dtype = object )
+        latitudes = np.asarray( latitudes, dtype = np.float64 )
+        longitudes = np.asarray( longitudes, dtype = np.float64 )
+        if self._weights is not None and np.array_equal( site_numbers, self._siteNumbers ) and np.array_equal( latitudes, self._siteLatitudes ) and np.array_equal( longitudes, self._siteLongitudes ):
+            return
+
+        cell_lat = np.radians( np.repeat( self.Latitudes, self.Shape[1] ) )[:, None]
+        cell_lon = np.radians( np.tile( self.Longitudes, self.Shape[0] ) )[:, None]
+        site_lat = np.radians( latitudes )[None, :]
+        site_lon = np.radians( longitudes )[None, :]
+        h = np.sin( ( site_lat - cell_lat ) / 2 ) ** 2 + np.cos( cell_lat ) * np.cos( site_lat ) * np.sin( ( site_lon - cell_lon ) / 2 ) ** 2
+        distance = 2 * EARTH_RADIUS_KM * np.arcsin( np.sqrt( h ) )
+
+        # a cell sitting on a monitor takes that monitor's value
+        weights = 1.0 / np.maximum( distance, 1e-6 ) ** self.Power
+        if self.MaxDistanceKm is not None:
+            weights[distance > self.MaxDistanceKm] = 0.0
+
+        self._siteNumbers = site_numbers
+        self._siteLatitudes = latitudes
+        self._siteLongitudes = longitudes
+        self._siteLookup = { site: i for i, site in enumerate( site_numbers ) }
+        self._weights = weights.astype( np.float32 )
+
+    def loadSiteLocations( self, engine: SA.Engine, site_numbers: list[str], database: str = DW_DATABASE ) -> None:
+        """
+            Reads the coordinates of the given sites from the Sites table and sets the layout.
+        """
+        SQLCode = SA.text( f"""
+            SELECT Full_Site_Number, Latitude, Longitude
+            FROM {database}.dbo.Sites
+            WHERE Full_Site_Number IN :sites AND Latitude IS NOT NULL AND Longitude IS NOT NULL
+            ORDER BY Full_Site_Number
+        """ ).bindparams( SA.bindparam( 'sites', expanding = True ) )
+        with engine.connect() as conn:
+            sites = pd.read_sql( SQLCode, conn, params = { 'sites': list( site_numbers ) } )
+        self.setSites( sites['Full_Site_Number'].str.strip().to_numpy(), sites['Latitude'].astype( float ), sites['Longitude'].astype( float ) )
+
+    # =========================================================================
+    # Surfaces
+    # =========================================================================
+    def interpolate( self, values: np.ndarray ) -> np.ndarray:
+        """
+            IDW surfaces for a ( sites x hours ) matrix of readings, NaN where a site did not report.
+
+            Returns:
+                float32 array of shape ( hours, rows, cols ), NaN where no site is in range
+        """
+        values = np.asarray( values, dtype = np.float32 )
+        reported = ~np.isnan( values )
+        numerator = self._weights @ np.where( reported, values, 0.0 ).astype( np.float32 )
+        denominator = self._weights @ reported.astype( np.float32 )
+        with np.errstate( invalid = 'ignore', divide = 'ignore' ):
+            surface = np.where( denominator > 0, numerator / denominator, np.nan )
+        return surface.T.reshape( -1, *self.Shape ).astype( np.float32 )
+
+    def update( self, readings: pd.DataFrame ) -> int:
+        """
+            Regenerates the surfaces of every ( layer, hour ) whose readings changed.
+
+            Parameters:
+                readings (DataFrame) - site, parameter, time, value, aqi (as returned by AirQualityHotWindow.frame)
+
+            Returns:
+                Number of hourly surfaces written
+        """
+        if self._weights is None:
+            raise RuntimeError( "Site layout not set. Call setSites or loadSiteLocations first." )
+        readings = readings[readings['site'].isin( self._siteLookup )]
+        if readings.empty:
+            return 0
+        readings = readings.assign(
+            site_index = readings['site'].map( self._siteLookup ).to_numpy( dtype = np.int64 )
+            , hour = readings['time'].to_numpy().astype( 'datetime64[h]' )
+        )
+
+        # one layer per pollutant plus the combined AQI (highest AQI of any pollutant at the site);
+        # met parameters are not interpolated (a linear blend of wind directions is meaningless)
+        pollutants = readings[readings['parameter'].isin( PARAMETER_POLLUTANTS )]
+        layers = { parameter: group[['site_index', 'hour', 'value']] for parameter, group in pollutants.groupby( 'parameter' ) }
+        aqi = readings.dropna( subset = ['aqi'] ).groupby( ['site_index', 'hour'], as_index = False )['aqi'].max()
+        if not aqi.empty:
+            layers[self.AQI_LAYER] = aqi.rename( columns = { 'aqi': 'value' } )
+
+        written = 0
+        for layer, group in layers.items():
+            written += self._updateLayer( layer, group )
+        if written:
+            log_message = f"Interpolated {written} hourly surfaces into {self.OutputDir}"
+            self.Log.info( log_message ) if self.Log else print( log_message )
+        return written
+
+    def updateFromHotWindow( self, hot_window ) -> int:
+        return self.update( hot_window.frame() )
+
+    def _updateLayer( self, layer: str, group: pd.DataFrame ) -> int:
+        layer_dir = os.path.join( self.OutputDir, self._layerDirectory( layer ) )
+        os.makedirs( layer_dir, exist_ok = True )
+        manifest_path = os.path.join( layer_dir, 'manifest.json' )
+        manifest = {}
+        if os.path.exists( manifest_path ):
+            with open( manifest_path ) as f:
+                manifest = json.load( f )
+
+        group_hours = group['hour'].to_numpy().astype( 'datetime64[h]' )
+        hours = np.unique( group_hours )
+        matrix = np.full( ( len( self._siteNumbers ), len( hours ) ), np.nan, dtype = np.float32 )
+        matrix[group['site_index'].to_numpy(), np.searchsorted( hours, group_hours )] = group['value'].to_numpy( dtype = np.float32 )
+
+        # fingerprint each hour's inputs together with the site layout so only changed hours are regenerated
+        layout = hashlib.sha256( self._weights.tobytes() ).hexdigest()[:16]
+        fingerprints = [ layout + hashlib.sha256( matrix[:, i].tobytes() ).hexdigest()[:32] for i in range( len( hours ) ) ]
+        changed = [ i for i, hour in enumerate( hours ) if manifest.get( str( hour ) ) != fingerprints[i] ]
+        if not changed:
+            return 0
+
+        surfaces = self.interpolate( matrix[:, changed] )
+        for surface, i in zip( surfaces, changed ):
+            self._writeHour( layer_dir, hours[i], surface )
+            manifest[str( hours[i] )] = fingerprints[i]
+        with open( manifest_path, 'w' ) as f:
+            json.dump( manifest, f )
+        return len( changed )
+
+    def _writeHour( self, layer_dir: str, hour: np.datetime64, surface: np.ndarray ) -> None:
+        day = hour.astype( 'datetime64[D]' )
+        path = os.path.join( layer_dir, f"{str( day ).replace( '-', '' )}.dat" )
+        shape = ( 24, ) + self._tiles + ( self.TileSize, self.TileSize )
+        if not os.path.exists( path ):
+            raster = np.memmap( path, dtype = np.float32, mode = 'w+', shape = shape )
+            raster[:] = np.nan
+        else:
+            raster = np.memmap( path, dtype = np.float32, mode = 'r+', shape = shape )
+        raster[int( ( hour - day ).astype( int ) )] = self._toTiles( surface )
+        raster.flush()
+        del raster
+
+    def _toTiles( self, surface: np.ndarray ) -> np.ndarray:
+        tiles_y, tiles_x = self._tiles
+        padded = np.full( ( tiles_y * self.TileSize, tiles_x * self.TileSize ), np.nan, dtype = np.float32 )
+        padded[:self.Shape[0], :self.Shape[1]] = surface
+        return padded.reshape( tiles_y, self.TileSize, tiles_x, self.TileSize ).swapaxes( 1, 2 )
+
+    def readHour( self, layer: str, hour ) -> np.ndarray:
+        """
+            Reads one hourly surface back as a ( rows, cols ) array, or None if it has not been generated.
+        """
+        hour = np.datetime64( hour, 'h' )
+        day = hour.astype( 'datetime64[D]' )
+        path = os.path.join( self.OutputDir, self._layerDirectory( layer ), f"{str( day ).replace( '-', '' )}.dat" )
+        if not os.path.exists( path ):
+            return None
+        tiles_y, tiles_x = self._tiles
+        raster = np.memmap( path, dtype = np.float32, mode = 'r', shape = ( 24, tiles_y, tiles_x, self.TileSize, self.TileSize ) )
+        tiles = np.array( raster[int( ( hour - day ).astype( int ) )] )
+        return tiles.swapaxes( 1, 2 ).reshape( tiles_y * self.TileSize, tiles_x * self.TileSize )[:self.Shape[0], :self.Shape[1]]
+
+    @staticmethod
+    def _layerDirectory( layer: str ) -> str:
+        return layer.replace( '.', '_' )
@@ -0,0 +1,187 @@
+import time
+import queue
+import logging
+import threading
+from typing import Callable, Iterable
+
+class AirQualityPipeline:
+    """
+        Staged producer / consumer pipeline (e.g. fetch -> parse -> load) run on threads.
+
+        Stages are connected by bounded queues, so a slow stage applies backpressure to the
+        ones before it instead of letting downloaded files pile up in memory, and each stage
+        has its own number of workers.  Throughput is limited by the slowest stage rather
+        than by the sum of all of them.
+
+        A stage function receives the previous stage's result and returns its own; returning
+        None drops the item (e.g. a download that failed and was logged).  An exception in any
+        stage cancels the pipeline: the feeder stops, every worker exits at its next queue
+        operation and run() re-raises the first exception.
+
+        A stage added with ordered = True (single worker) processes items in the order they
+        were fed, whatever order the parallel stages before it finish in.
+
+        Attributes:
+            self.Name
+            self.QueueSize
+            self.Log
+            self.Stats
+    """
+
+    _END = object()     # end of input
+    _SKIP = object()    # item dropped by an earlier stage, keeps the sequence for ordered stages
+    _POLL_SECONDS = 0.1
+
+    def __init__( self, name: str, queue_size: int = 4, log: logging = None ):
+        """
+            Parameters:
+                name (str) - used for thread names and log messages
+                queue_size (int) - capacity of each queue between stages
+        """
+        self.Name = name
+        self.QueueSize = queue_size
+        self.Log = log
+        self.Stats = {}
+        self._stages = []
+        self._cancel = threading.Event()
+        self._errors = []
+        self._lock = threading.Lock()
+
+    def addStage( self, name: str, func: Callable, workers: int = 1, ordered: bool = False ) -> 'AirQualityPipeline':
+        """
+            Appends a stage.  Returns self so stages can be chained.
+        """
+        if workers < 1:
+            raise ValueError( f"Stage {name} needs at least one worker." )
+        if ordered and workers != 1:
+            raise ValueError( f"Ordered stage {name} must have a single worker." )
+        self._stages.append( ( name, func, workers, ordered ) )
+        return self
+
+    def cancel( self ) -> None:
+        self._cancel.set()
+
+    @property
+    def Cancelled( self ) -> bool:
+        return self._cancel.is_set()
+
+    # =========================================================================
+    # Running
+    # =========================================================================
+    def run( self, items: Iterable ) -> dict:
+        """
+            Feeds items through every stage and waits for the pipeline to drain.
+
+            Returns:
+                Per stage statistics: { stage: { 'items': n, 'dropped': n, 'busy_seconds': s } }
+        """
+        if not self._stages:
+            raise RuntimeError( "Pipeline has no stages." )
+        self._cancel.clear()
+        self._errors = []
+        self.Stats = { name: { 'items': 0, 'dropped': 0, 'busy_seconds': 0.0 } for name, _, _, _ in self._stages }
+
+        inboxes = [ queue.Queue( maxsize = self.QueueSize ) for _ in self._stages ]
+        threads = []
+        for index, ( name, _, workers, _ ) in enumerate( self._stages ):
+            outbox = inboxes[index + 1] if index + 1 < len( self._stages ) else None
+            running = [ workers ]   # workers of this stage still running, the last one forwards the end marker
+            for worker in range( workers ):
+                thread = threading.Thread( target = self._work, args = ( index, inboxes[index], outbox, running )
+                                          , name = f"{self.Name}-{name}-{worker}", daemon = True )
+                thread.start()
+                threads.append( thread )
+
+        started = time.perf_counter()
+        try:
+            for sequence, item in enumerate( items ):
+                if not self._put( inboxes[0], ( sequence, item ) ):
+                    break
+            self._put( inboxes[0], self._END )
+        except BaseException as e:
+            # a failing item generator (or Ctrl+C) cancels the workers too
+            self._fail( 'feed', e )
+        for thread in threads:
+            thread.join()
+
+        elapsed = time.perf_counter() - started
+        summary = ', '.join( f"{name} {stats['items']} items / {stats['busy_seconds']:.1f}s busy" for name, stats in self.Stats.items() )
+        log_message = f"Pipeline {self.Name} {'cancelled' if self._errors else 'finished'} in {elapsed:.1f}s: {summary}"
+        self.Log.info( log_message ) if self.Log else print( log_message )
+        if self._errors:
+            raise self._errors[0]
+        return self.Stats
+
+    def _work( self, index: int, inbox: queue.Queue, outbox: queue.Queue, running: list[int] ) -> None:
+        name, func, _, ordered = self._stages[index]
+        pending = {}        # ordered stages: sequence: value waiting for its predecessors
+        next_sequence = 0
+        try:
+            while True:
+                entry = self._get( inbox )
+                if entry is None:
+                    return  # cancelled
+                if entry is self._END:
+                    with self._lock:
+                        running[0] -= 1
+                        last = running[0] == 0
+                    if not last:
+                        # hand the end marker on to the sibling workers
+                        self._put( inbox, self._END )
+                    elif outbox is not None:
+                        self._put( outbox, self._END )
+                    return
+
+                if ordered:
+                    pending[entry[0]] = entry[1]
+                    ready = []
+                    while next_sequence in pending:
+                        ready.append( ( next_sequence, pending.pop( next_sequence ) ) )
+                        next_sequence += 1
+                else:
+                    ready = [ entry ]
+
+                for sequence, value in ready:
+                    if value is not self._SKIP:
+                        started = time.perf_counter()
+                        value = func( value )
+                        busy = time.perf_counter() - started
+                        with self._lock:
+                            stats = self.Stats[name]
+                            stats['busy_seconds'] += busy
+                            stats['items'] += 1
+                            if value is None:
+                                stats['dropped'] += 1
+                        if value is None:
+                            value = self._SKIP
+                    if outbox is not None and not self._put( outbox, ( sequence, value ) ):
+                        return
+        except BaseException as e:
+            self._fail( name, e )
+
+    def _fail( self, stage: str, error: BaseException ) -> None:
+        with self._lock:
+            self._errors.append( error )
+        self._cancel.set()
+        log_message = f"Pipeline {self.Name} stage {stage} failed, cancelling: {error}"
+        self.Log.error( log_message ) if self.Log else print( log_message )
+
+    # =========================================================================
+    # Queue operations that give up once the pipeline is cancelled
+    # =========================================================================
+    def _put( self, target: queue.Queue, entry ) -> bool:
+        while not self._cancel.is_set():
+            try:
+                target.put( entry, timeout = self._POLL_SECONDS )
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _get( self, source: queue.Queue ):
+        while not self._cancel.is_set():
+            try:
+                return source.get( timeout = self._POLL_SECONDS )
+            except queue.Empty:
+                continue
+        return None
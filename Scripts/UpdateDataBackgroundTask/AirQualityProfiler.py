@@ -0,0 +1,220 @@
+import os
+import sys
+import json
+import time
+import signal
+import logging
+import pstats
+import cProfile
+import tracemalloc
+import threading
+from io import StringIO
+from contextlib import contextmanager, nullcontext
+from datetime import datetime
+
+class AirQualityProfiler:
+    """
+        On-demand profiling of the update cycles of a long-running updater.
+
+        Profiling is off until it is armed for the next N cycles, either by a signal
+        (SIGUSR1 by default, e.g. `kill -USR1 <pid>`) or by a control file that holds the
+        number of cycles (e.g. `echo 3 > logs/profile.request`).  The control file is
+        consumed when read.  While armed, every cycle captures:
+            - cProfile statistics
+            - tracemalloc snapshot with the top allocation sites
+            - wall and CPU time per stage
+        and writes them next to the logs as timestamped artifacts:
+            <name>_<YYYYmmdd_HHMMSS>.prof          - pstats dump (snakeviz, pstats, ...)
+            <name>_<YYYYmmdd_HHMMSS>_report.txt    - stages, top functions and top allocation sites
+            <name>_<YYYYmmdd_HHMMSS>_stages.json   - stage timings
+
+        Threads started during a cycle (e.g. AirQualityPipeline workers) are profiled as well:
+        before Python 3.12 cProfile only sees the thread that enables it, so each new thread
+        gets its own profiler (installed with threading.setprofile) and their statistics are
+        merged into the cycle's.
+
+        When off, a cycle costs one os.stat of the control file and stages are a shared
+        null context.
+
+        Attributes:
+            self.OutputDir
+            self.ControlFile
+            self.Cycles
+            self.TopN
+            self.Log
+    """
+
+    _NULL = nullcontext()
+
+    def __init__( self, output_dir: str, control_file: str = 'profile.request', signal_number: int = getattr( signal, 'SIGUSR1', None )
+                 , cycles: int = 3, top_n: int = 30, log: logging = None ):
+        """
+            Parameters:
+                output_dir (str) - where artifacts are written, normally the log folder
+                control_file (str) - file name (relative to output_dir) that arms profiling, None to disable
+                signal_number (int) - signal that arms profiling for `cycles` cycles, None to disable
+                cycles (int) - cycles profiled per signal
+                top_n (int) - functions and allocation sites listed in the report
+        """
+        self.OutputDir = output_dir
+        self.ControlFile = os.path.join( output_dir, control_file ) if control_file else None
+        self.Cycles = cycles
+        self.TopN = top_n
+        self.Log = log
+        self._remaining = 0
+        self._stageLock = threading.Lock()
+        self._stages = None     # stage name: [ calls, wall seconds, cpu seconds ] while a cycle is profiled
+        self._threadProfiles = []   # profilers of the threads started during the profiled cycle
+
+        # signal handlers can only be installed from the main thread
+        if signal_number is not None and threading.current_thread() is threading.main_thread():
+            signal.signal( signal_number, self._onSignal )
+
+    # =========================================================================
+    # Arming
+    # =========================================================================
+    def arm( self, cycles: int = None ) -> None:
+        """
+            Profiles the next `cycles` cycles.
+        """
+        self._remaining = max( self._remaining, cycles or self.Cycles )
+        log_message = f"Profiling armed for the next {self._remaining} cycles, artifacts in {self.OutputDir}"
+        self.Log.info( log_message ) if self.Log else print( log_message )
+
+    def _onSignal( self, signum, frame ) -> None:
+        # only set the counter here, taking locks or logging from a signal handler can deadlock
+        self._remaining = max( self._remaining, self.Cycles )
+
+    def _checkControlFile( self ) -> None:
+        if self.ControlFile is None or not os.path.exists( self.ControlFile ):
+            return
+        try:
+            with open( self.ControlFile ) as f:
+                content = f.read().strip()
+            os.remove( self.ControlFile )
+            self.arm( int( content ) if content else None )
+        except ( OSError, ValueError ) as e:
+            log_message = f"Ignoring profiling control file {self.ControlFile}: {e}"
+            self.Log.error( log_message ) if self.Log else print( log_message )
+
+    @property
+    def Active( self ) -> bool:
+        return self._stages is not None
+
+    # =========================================================================
+    # Cycles and stages
+    # =========================================================================
+    @contextmanager
+    def cycle( self, name: str ):
+        """
+            Wraps one update cycle.  Profiles it if profiling is armed, otherwise does nothing.
+        """
+        if self.Active:
+            # nested cycle, already covered by the outer one
+            yield
+            return
+        self._checkControlFile()
+        if self._remaining <= 0:
+            yield
+            return
+        self._remaining -= 1
+
+        self._stages = {}
+        started_tracing = not tracemalloc.is_tracing()
+        if started_tracing:
+            tracemalloc.start( 10 )
+        profiler = cProfile.Profile()
+        self._threadProfiles = []
+        threads_profiled = sys.version_info < ( 3, 12 )     # from 3.12 cProfile sees every thread
+        if threads_profiled:
+            threading.setprofile( self._profileThread )
+        wall, cpu = time.perf_counter(), time.process_time()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            if threads_profiled:
+                threading.setprofile( None )
+            wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+            snapshot = tracemalloc.take_snapshot()
+            if started_tracing:
+                tracemalloc.stop()
+            stages, self._stages = self._stages, None
+            self._write( name, self._mergedStats( profiler ), snapshot, stages, wall, cpu )
+
+    def _profileThread( self, frame, event, arg ) -> None:
+        # first profile event of a thread started during the cycle: swap in a profiler of its own
+        sys.setprofile( None )
+        profiler = cProfile.Profile()
+        with self._stageLock:
+            self._threadProfiles.append( profiler )
+        profiler.enable()
+
+    def _mergedStats( self, profiler: cProfile.Profile ) -> pstats.Stats:
+        stats = pstats.Stats( profiler )
+        with self._stageLock:
+            thread_profiles, self._threadProfiles = self._threadProfiles, []
+        for thread_profile in thread_profiles:
+            try:
+                stats.add( thread_profile )
+            except TypeError:
+                # the thread made no calls
+                pass
+        return stats
+
+    def stage( self, name: str ):
+        """
+            Times a stage of the current cycle.  Stages repeated within a cycle are accumulated.
+        """
+        if self._stages is None:
+            return self._NULL
+        return self._timeStage( name )
+
+    @contextmanager
+    def _timeStage( self, name: str ):
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield
+        finally:
+            # stages may run on pipeline workers; process_time is process wide so their cpu time overlaps
+            wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+            with self._stageLock:
+                totals = self._stages.setdefault( name, [ 0, 0.0, 0.0 ] )
+                totals[0] += 1
+                totals[1] += wall
+                totals[2] += cpu
+
+    # =========================================================================
+    # Artifacts
+    # =========================================================================
+    def _write( self, name: str, stats: pstats.Stats, snapshot: tracemalloc.Snapshot, stages: dict, wall: float, cpu: float ) -> None:
+        os.makedirs( self.OutputDir, exist_ok = True )
+        base = os.path.join( self.OutputDir, f"{name}_{datetime.now().strftime( '%Y%m%d_%H%M%S' )}" )
+
+        stats.dump_stats( f"{base}.prof" )
+
+        stage_rows = [ { 'stage': stage, 'calls': calls, 'wall_seconds': round( stage_wall, 6 ), 'cpu_seconds': round( stage_cpu, 6 ) }
+                      for stage, ( calls, stage_wall, stage_cpu ) in sorted( stages.items(), key = lambda item: -item[1][1] ) ]
+        with open( f"{base}_stages.json", 'w' ) as f:
+            json.dump( { 'cycle': name, 'wall_seconds': round( wall, 6 ), 'cpu_seconds': round( cpu, 6 ), 'stages': stage_rows }, f, indent = 2 )
+
+        report = StringIO()
+        report.write( f"Cycle {name}: wall {wall:.3f}s, cpu {cpu:.3f}s\n\n" )
+        report.write( f"{'stage':<40}{'calls':>8}{'wall s':>12}{'cpu s':>12}\n" )
+        for row in stage_rows:
+            report.write( f"{row['stage']:<40}{row['calls']:>8}{row['wall_seconds']:>12.3f}{row['cpu_seconds']:>12.3f}\n" )
+
+        report.write( f"\nTop {self.TopN} functions by cumulative time\n" )
+        stats.stream = report
+        stats.sort_stats( 'cumulative' ).print_stats( self.TopN )
+
+        report.write( f"Top {self.TopN} allocation sites\n" )
+        ignore = [ tracemalloc.Filter( False, tracemalloc.__file__ ), tracemalloc.Filter( False, '<frozen importlib._bootstrap*>' ) ]
+        for statistic in snapshot.filter_traces( ignore ).statistics( 'lineno' )[:self.TopN]:
+            report.write( f"{statistic}\n" )
+        with open( f"{base}_report.txt", 'w' ) as f:
+            f.write( report.getvalue() )
+
+        log_message = f"Profiled cycle {name} ({wall:.1f}s wall, {cpu:.1f}s cpu) written to {base}_report.txt"
+        self.Log.info( log_message ) if self.Log else print( log_message )
@@ -0,0 +1,145 @@
+import logging
+import numpy as np
+import pandas as pd
+import sqlalchemy as SA
+from AirQualityAQI import PARAMETER_POLLUTANTS, calculateAQI
+from AirQualitySourceDictionary import AirQualitySourceDictionary
+from AirQualityFactTables import DW_DATABASE, FACT_TABLES, SRC_EPA, parameterForAQSCode
+from AirQualityFactMerge import compassPoints, mergeCombinedAQI, mergeFactRows, updateOzoneRolling, windSpeedMPH
+
+class AirQualityReconciler:
+    """
+        Replaces preliminary AirNow fact rows with validated EPA AQS rows as they arrive.
+
+        Each run reads only the EPA_API_Raw rows loaded since the previous run (by recID),
+        maps AQS parameter codes to the AirNow parameter names used by the fact tables,
+        computes the AQI values in one vectorized pass and MERGEs the batch into each
+        fact table keyed on ( Full_Site_Number, Date_Time_Local ), marking the rows with
+        src = 'EPA'.  The ozone 8 hour rolling average and the combined AQI are then
+        recomputed only for the keys the batch touched.
+
+        Attributes:
+            self.Engine
+            self.StagingDatabase
+            self.EPATable
+            self.DWDatabase
+            self.Log
+    """
+
+    STATE_TABLE = 'EPA_Reconcile_State'
+
+    def __init__( self, engine: SA.Engine, staging_database: str, epa_table: str, dw_database: str = DW_DATABASE, log: logging = None ):
+        self.Engine = engine
+        self.StagingDatabase = staging_database
+        self.EPATable = epa_table
+        self.DWDatabase = dw_database
+        self.Log = log
+
+    def _createStateTable( self, conn ) -> None:
+        conn.execute( SA.text( f"""
+            IF OBJECT_ID( '{self.StagingDatabase}.dbo.{self.STATE_TABLE}', 'U' ) IS NULL
+                CREATE TABLE {self.StagingDatabase}.dbo.{self.STATE_TABLE} ( Source_Table VARCHAR(128) PRIMARY KEY, Last_recID INT NOT NULL )
+        """ ) )
+
+    # =========================================================================
+    # Batch preparation
+    # =========================================================================
+    def _readNewRows( self, conn, batch_size: int ) -> tuple[pd.DataFrame, int]:
+        self._createStateTable( conn )
+        last_recid = conn.execute( SA.text( f"SELECT Last_recID FROM {self.StagingDatabase}.dbo.{self.STATE_TABLE} WHERE Source_Table = :t" ), { 't': self.EPATable } ).scalar() or 0
+        codes = [ aqs_code for _, _, aqs_code in FACT_TABLES.values() ]
+        SQLCode = SA.text( f"""
+            SELECT TOP ( :batch_size )
+                recID, state_code, county_code, site_number, parameter_code, poc, date_local, time_local
+                , sample_measurement, units_of_measure = u.Value, sample_duration
+            FROM {self.StagingDatabase}.dbo.{self.EPATable} s
+            LEFT JOIN {self.StagingDatabase}.dbo.{AirQualitySourceDictionary.DIMENSIONS['units'][0]} u ON u.ID = s.units_of_measure_id
+            WHERE recID > :last_recid
+                AND parameter_code IN :codes
+            ORDER BY recID
+        """ ).bindparams( SA.bindparam( 'codes', expanding = True ) )
+        rows = pd.read_sql( SQLCode, conn, params = { 'batch_size': batch_size, 'last_recid': last_recid, 'codes': codes } )
+        return rows, last_recid
+
+    def prepareBatch( self, rows: pd.DataFrame ) -> pd.DataFrame:
+        """
+            Turns raw EPA rows into one fact row per ( parameter, site, local hour ) with AQI values.
+            When several POCs (monitors) report the same key the lowest POC wins.
+        """
+        batch = pd.DataFrame( {
+            'Parameter_Name': [ parameterForAQSCode( str( code ).strip() ) for code in rows['parameter_code'] ]
+            , 'Full_Site_Number': rows['state_code'].str.strip() + '-' + rows['county_code'].str.strip() + '-' + rows['site_number'].str.strip()
+            , 'Date_Time_Local': pd.to_datetime( rows['date_local'] ) + pd.to_timedelta( rows['time_local'].astype( str ).str[:5] + ':00' )
+            , 'Sample_Measurement': pd.to_numeric( rows['sample_measurement'], errors = 'coerce' )
+            , 'Units_of_Measure': rows['units_of_measure']
+            , 'Sample_Duration': rows['sample_duration']
+            , 'poc': pd.to_numeric( rows['poc'], errors = 'coerce' )
+        } )
+        batch = batch.dropna( subset = ['Parameter_Name'] ) \
+            .sort_values( ['Parameter_Name', 'Full_Site_Number', 'Date_Time_Local', 'poc'] ) \
+            .drop_duplicates( ['Parameter_Name', 'Full_Site_Number', 'Date_Time_Local'], keep = 'first' ) \
+            .drop( columns = 'poc' )
+        batch['Date_Local'] = batch['Date_Time_Local'].dt.date
+        batch['Time_Local'] = batch['Date_Time_Local'].dt.time
+
+        batch['AQI'] = np.nan
+        for parameter_name, pollutant in PARAMETER_POLLUTANTS.items():
+            mask = ( batch['Parameter_Name'] == parameter_name ).to_numpy()
+            if mask.any():
+                batch.loc[mask, 'AQI'] = calculateAQI( pollutant, batch.loc[mask, 'Sample_Measurement'].to_numpy() )
+
+        # table specific derived columns
+        wind_speed = ( batch['Parameter_Name'] == 'WS' ).to_numpy()
+        wind_direction = ( batch['Parameter_Name'] == 'WD' ).to_numpy()
+        batch['Wind_Speed_MPH'] = np.where( wind_speed, windSpeedMPH( batch['Sample_Measurement'], batch['Units_of_Measure'] ), np.nan )
+        batch['Wind_Direction_Grouped'] = [ point if is_wd else None for point, is_wd in zip( compassPoints( batch['Sample_Measurement'] ), wind_direction ) ]
+        return batch.reset_index( drop = True )
+
+    # =========================================================================
+    # Writing
+    # =========================================================================
+    def run( self, batch_size: int = 500000 ) -> int:
+        """
+            Reconciles every EPA row loaded since the last run, batch_size rows at a time.
+
+            Returns:
+                Number of fact rows written
+        """
+        total = 0
+        while True:
+            try:
+                with self.Engine.begin() as conn:
+                    rows, last_recid = self._readNewRows( conn, batch_size )
+                    if rows.empty:
+                        break
+                    batch = self.prepareBatch( rows )
+                    written = self._applyBatch( conn, batch ) if not batch.empty else 0
+                    conn.execute( SA.text( f"""
+                        MERGE INTO {self.StagingDatabase}.dbo.{self.STATE_TABLE} AS target
+                        USING ( VALUES ( :t, :recid ) ) AS source ( Source_Table, Last_recID )
+                        ON target.Source_Table = source.Source_Table
+                        WHEN MATCHED THEN UPDATE SET Last_recID = source.Last_recID
+                        WHEN NOT MATCHED THEN INSERT ( Source_Table, Last_recID ) VALUES ( source.Source_Table, source.Last_recID );
+                    """ ), { 't': self.EPATable, 'recid': int( rows['recID'].max() ) } )
+                total += written
+                log_message = f"Reconciled EPA rows {last_recid + 1} to {int( rows['recID'].max() )} into {written} fact rows."
+                self.Log.info( log_message ) if self.Log else print( log_message )
+                if len( rows ) < batch_size:
+                    break
+            except Exception as e:
+                log_message = f"Error reconciling EPA rows into the fact tables. {e}"
+                self.Log.error( log_message ) if self.Log else print( log_message )
+                break
+        return total
+
+    def _applyBatch( self, conn, batch: pd.DataFrame ) -> int:
+        keys = [ batch[['Full_Site_Number', 'Date_Time_Local']] ]
+        written = 0
+        for parameter_name, group in batch.groupby( 'Parameter_Name' ):
+            written += mergeFactRows( conn, self.DWDatabase, parameter_name, group, SRC_EPA )
+            if parameter_name == 'OZONE':
+                # the combined AQI of the later hours changes with their rolling average
+                keys.append( updateOzoneRolling( conn, self.DWDatabase, group[['Full_Site_Number', 'Date_Time_Local']] ) )
+
+        mergeCombinedAQI( conn, self.DWDatabase, pd.concat( keys, ignore_index = True ), SRC_EPA )
+        return written
@@ -0,0 +1,300 @@
+import numpy as np
+import pandas as pd
+
+class RecordSchema:
+    """
+        Ordered ( column name, kind ) declaration of the rows a source hands to its DB handler.
+        Column names are the staging table's (encoded string columns keep their string name,
+        the handler swaps in the id column).
+
+        Column kinds:
+            category - repeated strings stored as int32 codes into a list of values, -1 where null
+            float    - float64 values, NaN where null
+            int      - integer values with a separate null mask
+            date     - datetime64[D], NaT where null
+
+        Attributes:
+            self.Name
+            self.Fields
+    """
+
+    KINDS = ( 'category', 'float', 'int', 'date' )
+
+    def __init__( self, name: str, fields: list[tuple[str, str]] ):
+        for field, kind in fields:
+            if kind not in self.KINDS:
+                raise ValueError( f"Unknown kind '{kind}' for column {field} of schema {name}." )
+        self.Name = name
+        self.Fields = list( fields )
+        self._kinds = dict( self.Fields )
+
+    @property
+    def Names( self ) -> list[str]:
+        return [ name for name, kind in self.Fields ]
+
+    def kind( self, name: str ) -> str:
+        return self._kinds[name]
+
+class RecordBatch:
+    """
+        Typed columnar rows of one schema, held as NumPy arrays.
+
+        Producers build a batch once (the EPA decoder hands over its column buffers, AirNow
+        files are converted with fromFrame) and every consumer reads the same arrays:
+            - slice / chunks return views sharing the arrays and value lists (no copy), so
+              chunked loads cost nothing until a chunk is turned into parameters
+            - parameters builds the executemany parameter tuples of a chunk directly from the
+              arrays; a category column is converted once per distinct value, not per row
+            - batch[column] returns a pandas Series over the arrays for DataFrame-style readers
+
+        Attributes:
+            self.Schema
+            self.Offset
+    """
+
+    def __init__( self, schema: RecordSchema, length: int, values: dict[str, np.ndarray], masks: dict[str, np.ndarray] = None
+                 , categories: dict[str, list] = None, offset: int = 0 ):
+        """
+            Parameters:
+                length (int) - number of rows, every array holds at least this many values
+                values (dict) - column: values (codes for category columns)
+                masks (dict) - int column: True where null
+                categories (dict) - category column: values the codes index
+                offset (int) - position of the first row in the batch this one was sliced from
+        """
+        self.Schema = schema
+        self.Offset = offset
+        self._length = length
+        self._values = values
+        self._masks = masks or {}
+        self._categories = categories or {}
+
+    @classmethod
+    def fromFrame( cls, schema: RecordSchema, df: pd.DataFrame, columns: dict[str, str] = None, date_format: str = None ) -> 'RecordBatch':
+        """
+            Converts a DataFrame, reading each schema column once.
+
+            Parameters:
+                columns (dict) - schema column: DataFrame column, for columns named differently
+                date_format (str) - strptime format of date columns held as strings
+
+            Returns:
+                RecordBatch of the DataFrame's rows
+        """
+        columns = columns or {}
+        values, masks, categories = {}, {}, {}
+        for name, kind in schema.Fields:
+            series = df[columns.get( name, name )]
+            if kind == 'category':
+                if isinstance( series.dtype, pd.CategoricalDtype ):
+                    values[name] = series.cat.codes.to_numpy().astype( np.int32 )
+                    categories[name] = series.cat.categories.tolist()
+                else:
+                    codes, uniques = pd.factorize( series )
+                    values[name] = codes.astype( np.int32 )
+                    categories[name] = uniques.tolist()
+            elif kind == 'float':
+                values[name] = pd.to_numeric( series, errors = 'coerce' ).to_numpy( dtype = np.float64 )
+            elif kind == 'int':
+                numbers = pd.to_numeric( series, errors = 'coerce' )
+                masks[name] = numbers.isna().to_numpy()
+                values[name] = numbers.fillna( 0 ).to_numpy( dtype = np.int64 )
+            else:
+                # each distinct date is parsed once; the trailing NaT is picked by the null code -1
+                codes, uniques = pd.factorize( series )
+                parsed = pd.to_datetime( pd.Index( uniques ), format = date_format, errors = 'coerce' ).values.astype( 'datetime64[D]' )
+                values[name] = np.append( parsed, np.datetime64( 'NaT', 'D' ) )[codes]
+        return cls( schema, len( df ), values, masks, categories )
+
+    # =========================================================================
+    # Shape and slicing
+    # =========================================================================
+    def __len__( self ) -> int:
+        return self._length
+
+    @property
+    def empty( self ) -> bool:
+        return self._length == 0
+
+    def slice( self, start: int, stop: int ) -> 'RecordBatch':
+        """
+            Rows start through stop - 1 as a batch of views over the same arrays.
+        """
+        start, stop = max( 0, start ), min( stop, self._length )
+        stop = max( start, stop )
+        return RecordBatch(
+            self.Schema
+            , stop - start
+            , { name: values[start:stop] for name, values in self._values.items() }
+            , { name: mask[start:stop] for name, mask in self._masks.items() }
+            , self._categories
+            , self.Offset + start
+        )
+
+    def chunks( self, size: int ):
+        """
+            Yields consecutive slices of at most size rows.
+        """
+        for start in range( 0, self._length, size ):
+            yield self.slice( start, start + size )
+
+    # =========================================================================
+    # Columns
+    # =========================================================================
+    def column( self, name: str ) -> np.ndarray:
+        """
+            Values of a column as stored (codes for category columns).
+        """
+        return self._values[name][:self._length]
+
+    def categories( self, name: str ) -> list:
+        return self._categories[name]
+
+    def __getitem__( self, name: str ) -> pd.Series:
+        kind = self.Schema.kind( name )
+        values = self.column( name )
+        if kind == 'category':
+            values = pd.Categorical.from_codes( values, categories = self._categories[name] )
+        elif kind == 'int':
+            values = pd.arrays.IntegerArray( values, self._masks[name][:self._length] )
+        return pd.Series( values, name = name, copy = False )
+
+    def toFrame( self ) -> pd.DataFrame:
+        return pd.DataFrame( { name: self[name] for name in self.Schema.Names }, copy = False )
+
+    # =========================================================================
+    # Bulk insert parameters
+    # =========================================================================
+    def parameters( self, names: list[str] = None, mappings: dict[str, dict] = None, constants: tuple = (), row_order: bool = False ) -> list[tuple]:
+        """
+            Rows as tuples of Python values for cursor.executemany, None where null.
+
+            Parameters:
+                names (list) - columns in parameter order, all schema columns by default
+                mappings (dict) - category column: { value: replacement } applied to its distinct values (e.g. dictionary ids)
+                constants (tuple) - values appended to every row
+                row_order (bool) - prepend the row's position in the unsliced batch
+
+            Returns:
+                One tuple per row
+        """
+        mappings = mappings or {}
+        columns = [ self._objects( name, mappings.get( name ) ) for name in ( names or self.Schema.Names ) ]
+        columns += [ np.full( self._length, constant, dtype = object ) for constant in constants ]
+        if row_order:
+            columns.insert( 0, np.arange( self.Offset, self.Offset + self._length ).astype( object ) )
+        return list( zip( *columns ) )
+
+    def _objects( self, name: str, mapping: dict = None ) -> np.ndarray:
+        kind = self.Schema.kind( name )
+        values = self.column( name )
+        if kind == 'category':
+            categories = self._categories[name]
+            lookup = np.empty( len( categories ) + 1, dtype = object )
+            lookup[:-1] = [ mapping.get( value ) for value in categories ] if mapping is not None else categories
+            # the null code -1 picks the trailing None
+            return lookup[values]
+        objects = values.astype( object )
+        if kind == 'float':
+            objects[np.isnan( values )] = None
+        elif kind == 'int':
+            objects[self._masks[name][:self._length]] = None
+        # datetime64 converts to datetime.date, NaT to None
+        return objects
+
+# =========================================================================
+# Source schemas
+# =========================================================================
+# AirNow hourly files (AirNowData staging table, minus recID and URL_Source_ID)
+AIRNOW_HOURLY_SCHEMA = RecordSchema( 'AirNowData', [
+    ( 'Valid_Date', 'date' )
+    , ( 'Valid_Time', 'category' )
+    , ( 'AQSID', 'category' )
+    , ( 'SiteName', 'category' )
+    , ( 'GMT_Offset', 'int' )
+    , ( 'Parameter_Name', 'category' )
+    , ( 'Reporting_Units', 'category' )
+    , ( 'Reported_Value', 'float' )
+    , ( 'Reported_Data_Source', 'category' )
+] )
+
+# AirNow daily files (AirNowDailyData staging table, minus recID and URL_Source_ID)
+AIRNOW_DAILY_SCHEMA = RecordSchema( 'AirNowDailyData', [
+    ( 'Valid_Date', 'date' )
+    , ( 'AQSID', 'category' )
+    , ( 'SiteName', 'category' )
+    , ( 'Parameter_Name', 'category' )
+    , ( 'Reporting_Units', 'category' )
+    , ( 'Reported_Value', 'float' )
+    , ( 'Averaging_Period', 'int' )
+    , ( 'Reported_Data_Source', 'category' )
+] )
+
+# EPA sampleData (EPA_API_Raw staging table, minus recID and URL_Source_ID)
+EPA_SAMPLE_SCHEMA = RecordSchema( 'EPA_API_Raw', [
+    ( 'state_code', 'category' )
+    , ( 'county_code', 'category' )
+    , ( 'site_number', 'category' )
+    , ( 'parameter_code', 'category' )
+    , ( 'poc', 'int' )
+    , ( 'latitude', 'float' )
+    , ( 'longitude', 'float' )
+    , ( 'datum', 'category' )
+    , ( 'parameter', 'category' )
+    , ( 'date_local', 'date' )
+    , ( 'time_local', 'category' )
+    , ( 'date_gmt', 'date' )
+    , ( 'time_gmt', 'category' )
+    , ( 'sample_measurement', 'float' )
+    , ( 'units_of_measure', 'category' )
+    , ( 'units_of_measure_code', 'category' )
+    , ( 'sample_duration', 'category' )
+    , ( 'sample_duration_code', 'category' )
+    , ( 'sample_frequency', 'category' )
+    , ( 'detection_limit', 'float' )
+    , ( 'uncertainty', 'category' )
+    , ( 'qualifier', 'category' )
+    , ( 'method_type', 'category' )
+    , ( 'method', 'category' )
+    , ( 'method_code', 'category' )
+    , ( 'state', 'category' )
+    , ( 'county', 'category' )
+    , ( 'date_of_last_change', 'date' )
+    , ( 'cbsa_code', 'category' )
+] )
+
+# EPA dailyData (EPA_API_Daily staging table, minus recID and URL_Source_ID)
+EPA_DAILY_SCHEMA = RecordSchema( 'EPA_API_Daily', [
+    ( 'state_code', 'category' )
+    , ( 'county_code', 'category' )
+    , ( 'site_number', 'category' )
+    , ( 'parameter_code', 'category' )
+    , ( 'poc', 'int' )
+    , ( 'latitude', 'float' )
+    , ( 'longitude', 'float' )
+    , ( 'datum', 'category' )
+    , ( 'parameter', 'category' )
+    , ( 'sample_duration_code', 'category' )
+    , ( 'sample_duration', 'category' )
+    , ( 'pollutant_standard', 'category' )
+    , ( 'date_local', 'date' )
+    , ( 'units_of_measure', 'category' )
+    , ( 'event_type', 'category' )
+    , ( 'observation_count', 'int' )
+    , ( 'observation_percent', 'float' )
+    , ( 'validity_indicator', 'category' )
+    , ( 'arithmetic_mean', 'float' )
+    , ( 'first_max_value', 'float' )
+    , ( 'first_max_hour', 'int' )
+    , ( 'aqi', 'int' )
+    , ( 'method_code', 'category' )
+    , ( 'method', 'category' )
+    , ( 'local_site_name', 'category' )
+    , ( 'site_address', 'category' )
+    , ( 'state', 'category' )
+    , ( 'county', 'category' )
+    , ( 'city', 'category' )
+    , ( 'cbsa_code', 'category' )
+    , ( 'cbsa', 'category' )
+    , ( 'date_of_last_change', 'date' )
+] )
@@ -0,0 +1,187 @@
+import logging
+import numpy as np
+import pandas as pd
+import sqlalchemy as SA
+from datetime import date
+from scipy.spatial import cKDTree
+from AirQualityFactTables import DW_DATABASE, FACT_TABLES
+
+EARTH_RADIUS_KM = 6371.0088
+
+class AirQualitySiteIndex:
+    """
+        In-process spatial index over AirQuality_DW.dbo.Sites for nearest-monitor queries.
+
+        Site coordinates are projected onto the unit sphere and stored in KD-trees, so
+        Euclidean (chord) distance is monotonic with great-circle distance and a batch of
+        thousands of query points resolves in milliseconds.  One tree covers all active
+        sites and one tree per parameter covers the active sites that report it.
+
+        On refresh only the trees whose set of sites (or coordinates) changed are rebuilt.
+
+        Attributes:
+            self.Log
+            self.SiteNumbers
+            self.Active
+    """
+    def __init__( self, log: logging = None ):
+        self.Log = log
+        self.SiteNumbers = np.array( [], dtype = object )
+        self.Active = np.array( [], dtype = bool )
+        self._xyz = np.empty( ( 0, 3 ) )
+        self._fingerprint = None
+        self._coverage = {}        # parameter: frozenset of Full_Site_Number
+        self._trees = {}           # parameter (None for all active sites): ( cKDTree, site positions, member key )
+        self._sitesVersion = None
+
+    # =========================================================================
+    # Building
+    # =========================================================================
+    @staticmethod
+    def toUnitSphere( latitudes, longitudes ) -> np.ndarray:
+        lat = np.radians( np.asarray( latitudes, dtype = np.float64 ) )
+        lon = np.radians( np.asarray( longitudes, dtype = np.float64 ) )
+        cos_lat = np.cos( lat )
+        return np.column_stack( ( cos_lat * np.cos( lon ), cos_lat * np.sin( lon ), np.sin( lat ) ) )
+
+    def refresh( self, sites: pd.DataFrame, coverage: dict[str, set[str]] = None, as_of: date = None ) -> int:
+        """
+            Updates the index from a Sites extract.
+
+            Parameters:
+                sites (DataFrame) - Full_Site_Number, Latitude, Longitude, Site_Closed_Date
+                coverage (dict) - AirNow parameter name: set of Full_Site_Number that report it
+                as_of (date) - sites closed on or before this date are inactive (defaults to today)
+
+            Returns:
+                Number of trees rebuilt
+        """
+        as_of = np.datetime64( as_of or date.today(), 'D' )
+        sites = sites.dropna( subset = ['Latitude', 'Longitude'] ).sort_values( 'Full_Site_Number' )
+        site_numbers = sites['Full_Site_Number'].astype( str ).str.strip().to_numpy( dtype = object )
+        latitudes = pd.to_numeric( sites['Latitude'] ).to_numpy( dtype = np.float64 )
+        longitudes = pd.to_numeric( sites['Longitude'] ).to_numpy( dtype = np.float64 )
+        closed = pd.to_datetime( sites['Site_Closed_Date'], errors = 'coerce' ).to_numpy( dtype = 'datetime64[D]' )
+        active = np.isnat( closed ) | ( closed > as_of )
+
+        fingerprint = ( tuple( site_numbers ), latitudes.tobytes(), longitudes.tobytes() )
+        if fingerprint != self._fingerprint:
+            # coordinates moved or sites were added / removed: every tree must be rebuilt
+            self._fingerprint = fingerprint
+            self._xyz = self.toUnitSphere( latitudes, longitudes )
+            self._trees = {}
+        self.SiteNumbers = site_numbers
+        self.Active = active
+        if coverage is not None:
+            self._coverage = { parameter.upper(): frozenset( members ) for parameter, members in coverage.items() }
+
+        rebuilt = 0
+        for parameter in [ None ] + list( self._coverage ):
+            if parameter is None:
+                members = active
+            else:
+                members = active & np.isin( site_numbers, list( self._coverage[parameter] ) )
+            positions = np.flatnonzero( members )
+            key = positions.tobytes()
+            existing = self._trees.get( parameter )
+            if existing is not None and existing[2] == key:
+                continue
+            self._trees[parameter] = ( cKDTree( self._xyz[positions] ) if len( positions ) else None, positions, key )
+            rebuilt += 1
+        # drop parameters that are no longer covered
+        for parameter in [ p for p in self._trees if p is not None and p not in self._coverage ]:
+            del self._trees[parameter]
+
+        log_message = f"Site index refreshed: {int( active.sum() )} active of {len( site_numbers )} sites, {rebuilt} trees rebuilt."
+        self.Log.info( log_message ) if self.Log else print( log_message )
+        return rebuilt
+
+    def loadFromDatabase( self, engine: SA.Engine, database: str = DW_DATABASE, coverage_days: int = 365 ) -> int:
+        """
+            Builds the index from the Sites table, with parameter coverage taken from the
+            sites that have fact rows for each parameter within the last coverage_days.
+        """
+        with engine.connect() as conn:
+            sites = pd.read_sql( SA.text( f"""
+                SELECT Full_Site_Number, Latitude, Longitude, Site_Closed_Date
+                FROM {database}.dbo.Sites
+            """ ), conn )
+            coverage = {}
+            for parameter_name, ( fact_table, _, _ ) in FACT_TABLES.items():
+                rows = conn.execute( SA.text( f"""
+                    SELECT DISTINCT Full_Site_Number
+                    FROM {database}.dbo.{fact_table}
+                    WHERE Date_Time_Local >= DATEADD( DAY, -{int( coverage_days )}, GETDATE() )
+                """ ) ).fetchall()
+                coverage[parameter_name] = { row[0].strip() for row in rows }
+            self._sitesVersion = self._getSitesVersion( conn, database )
+        return self.refresh( sites, coverage )
+
+    def refreshIfChanged( self, engine: SA.Engine, database: str = DW_DATABASE, coverage_days: int = 365 ) -> bool:
+        """
+            Cheap check of the Sites table (row count and latest INSERT_DT); reloads the index only when Sites was refreshed.
+        """
+        with engine.connect() as conn:
+            version = self._getSitesVersion( conn, database )
+        if version == self._sitesVersion:
+            return False
+        self.loadFromDatabase( engine, database, coverage_days )
+        return True
+
+    def _getSitesVersion( self, conn, database: str ) -> tuple:
+        return tuple( conn.execute( SA.text( f"SELECT COUNT(*), MAX( INSERT_DT ) FROM {database}.dbo.Sites" ) ).fetchone() )
+
+    # =========================================================================
+    # Queries
+    # =========================================================================
+    def _tree( self, parameter: str ):
+        key = parameter.upper() if parameter else None
+        if key not in self._trees:
+            raise KeyError( f"No coverage loaded for parameter: {parameter}" )
+        return self._trees[key]
+
+    def nearest( self, latitudes, longitudes, k: int = 1, parameter: str = None ) -> tuple[np.ndarray, np.ndarray]:
+        """
+            Batch k-nearest active monitors.
+
+            Parameters:
+                latitudes, longitudes (array-like) - query points in degrees
+                k (int) - number of monitors per point
+                parameter (str) - only monitors reporting this AirNow parameter (e.g. 'OZONE'), None for any
+
+            Returns:
+                ( Full_Site_Number array of shape (n, k), great-circle distance in km of shape (n, k) ).
+                Missing neighbours (fewer than k monitors) are None / inf.
+        """
+        tree, positions, _ = self._tree( parameter )
+        points = self.toUnitSphere( np.atleast_1d( latitudes ), np.atleast_1d( longitudes ) )
+        if tree is None:
+            return np.full( ( len( points ), k ), None, dtype = object ), np.full( ( len( points ), k ), np.inf )
+        chord, idx = tree.query( points, k = k )
+        chord, idx = chord.reshape( len( points ), k ), idx.reshape( len( points ), k )
+        found = idx < len( positions )
+        sites = np.full( idx.shape, None, dtype = object )
+        sites[found] = self.SiteNumbers[positions[idx[found]]]
+        return sites, self._chordToKm( chord )
+
+    def withinRadius( self, latitudes, longitudes, radius_km: float, parameter: str = None ) -> list[np.ndarray]:
+        """
+            Batch radius query.  Returns, for each query point, the Full_Site_Numbers of the
+            active monitors within radius_km, nearest first.
+        """
+        tree, positions, _ = self._tree( parameter )
+        points = self.toUnitSphere( np.atleast_1d( latitudes ), np.atleast_1d( longitudes ) )
+        if tree is None:
+            return [ np.array( [], dtype = object ) for _ in points ]
+        chord_radius = 2.0 * np.sin( min( radius_km / EARTH_RADIUS_KM, np.pi ) / 2.0 )
+        results = []
+        for point, members in zip( points, tree.query_ball_point( points, chord_radius ) ):
+            members = np.asarray( members, dtype = np.int64 )
+            order = np.argsort( np.linalg.norm( tree.data[members] - point, axis = 1 ) )
+            results.append( self.SiteNumbers[positions[members[order]]] )
+        return results
+
+    @staticmethod
+    def _chordToKm( chord: np.ndarray ) -> np.ndarray:
+        distance = 2.0 * EARTH_RADIUS_KM * np.arcsin( np.clip( chord / 2.0, 0.0, 1.0 ) )
+        return np.where( np.isinf( chord ), np.inf, distance )
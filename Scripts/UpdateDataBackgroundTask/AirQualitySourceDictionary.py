@@ -0,0 +1,128 @@
+import logging
+import threading
+import pandas as pd
+import sqlalchemy as SA
+from typing import Iterable
+
+class AirQualitySourceDictionary:
+    """
+        Interns the long strings repeated on every staging row (source URL, data source,
+        method, units) into small dimension tables, so staging rows carry INT ids.
+
+        Each dimension is ( ID INT IDENTITY, Value VARCHAR ) with a unique index on a
+        persisted SHA-256 of the value (values can exceed the index key size).  Ids are
+        cached on the client: a batch of rows is encoded by looking up its distinct values,
+        and only the values never seen before cost a round trip, made once for the whole batch.
+
+        Attributes:
+            self.Engine
+            self.Database
+            self.Log
+    """
+
+    # dimension: ( table, value size )
+    DIMENSIONS = {
+        'url_source': ( 'dim_URL_Source', 1000 )
+        , 'data_source': ( 'dim_Data_Source', 1000 )
+        , 'method': ( 'dim_Method', 100 )
+        , 'units': ( 'dim_Units', 50 )
+    }
+    _VALUES_PER_STATEMENT = 500
+
+    def __init__( self, engine: SA.Engine, database: str, log: logging = None ):
+        self.Engine = engine
+        self.Database = database
+        self.Log = log
+        self._cache = { dimension: {} for dimension in self.DIMENSIONS }   # dimension: { value: id }
+        self._lock = threading.Lock()
+        self._created = False
+
+    def table( self, dimension: str ) -> str:
+        return f"{self.Database}.dbo.{self.DIMENSIONS[dimension][0]}"
+
+    def createTables( self ) -> None:
+        with self.Engine.begin() as conn:
+            for dimension, ( tableName, size ) in self.DIMENSIONS.items():
+                conn.execute( SA.text( f"""
+                    IF OBJECT_ID( '{self.table( dimension )}', 'U' ) IS NULL
+                    BEGIN
+                        CREATE TABLE {self.table( dimension )}
+                        (
+                            ID INT IDENTITY(1, 1) PRIMARY KEY
+                            , Value VARCHAR({size}) NOT NULL
+                            , Value_Hash AS CONVERT( BINARY(32), HASHBYTES( 'SHA2_256', Value ) ) PERSISTED
+                        )
+                        CREATE UNIQUE INDEX UX_{tableName}_Value_Hash ON {self.table( dimension )} ( Value_Hash )
+                    END
+                """ ) )
+        self._created = True
+
+    def loadCache( self ) -> int:
+        """
+            Reads every dimension into the cache (they are small).
+
+            Returns:
+                Number of values cached
+        """
+        if not self._created:
+            self.createTables()
+        total = 0
+        with self.Engine.connect() as conn:
+            for dimension in self.DIMENSIONS:
+                rows = conn.execute( SA.text( f"SELECT Value, ID FROM {self.table( dimension )}" ) ).fetchall()
+                with self._lock:
+                    self._cache[dimension].update( { value: value_id for value, value_id in rows } )
+                total += len( rows )
+        return total
+
+    # =========================================================================
+    # Encoding
+    # =========================================================================
+    def ids( self, dimension: str, values: Iterable[str] ) -> dict[str, int]:
+        """
+            Returns { value: id } for the given values, adding the new ones to the dimension in one batch.
+        """
+        values = { value for value in values if value is not None and not ( isinstance( value, float ) and pd.isna( value ) ) }
+        with self._lock:
+            cache = self._cache[dimension]
+            missing = [ value for value in values if value not in cache ]
+            if missing:
+                self._fetch( dimension, missing )
+            return { value: cache.get( value ) for value in values }
+
+    def id( self, dimension: str, value: str ) -> int:
+        return self.ids( dimension, [ value ] ).get( value )
+
+    def encode( self, dimension: str, series: pd.Series ) -> pd.Series:
+        """
+            Maps a column of strings to their ids (nullable Int32).  Only its distinct values are looked up.
+        """
+        uniques = series.cat.categories if isinstance( series.dtype, pd.CategoricalDtype ) else series.dropna().unique()
+        mapping = self.ids( dimension, uniques )
+        return series.map( mapping ).astype( 'Int32' )
+
+    def _fetch( self, dimension: str, values: list[str] ) -> None:
+        # called with the lock held: insert the unknown values, then read back the ids of all of them
+        if not self._created:
+            self.createTables()
+        table = self.table( dimension )
+        size = self.DIMENSIONS[dimension][1]
+        with self.Engine.begin() as conn:
+            for i in range( 0, len( values ), self._VALUES_PER_STATEMENT ):
+                chunk = values[i:i + self._VALUES_PER_STATEMENT]
+                params = { f"v{n}": value for n, value in enumerate( chunk ) }
+                # parameters arrive as NVARCHAR, the values are hashed as the VARCHAR that is stored
+                source = f"SELECT Value = CONVERT( VARCHAR({size}), v.Value ) FROM ( VALUES {', '.join( f'( :v{n} )' for n in range( len( chunk ) ) )} ) AS v ( Value )"
+                conn.execute( SA.text( f"""
+                    MERGE INTO {table} WITH ( HOLDLOCK ) AS target
+                    USING ( {source} ) AS source
+                    ON target.Value_Hash = CONVERT( BINARY(32), HASHBYTES( 'SHA2_256', source.Value ) )
+                    WHEN NOT MATCHED THEN INSERT ( Value ) VALUES ( source.Value );
+                """ ), params )
+                found = conn.execute( SA.text( f"""
+                    SELECT Value, ID FROM {table}
+                    WHERE Value_Hash IN ( SELECT CONVERT( BINARY(32), HASHBYTES( 'SHA2_256', s.Value ) ) FROM ( {source} ) AS s )
+                """ ), params ).fetchall()
+                self._cache[dimension].update( { value: value_id for value, value_id in found } )
+        log_message = f"Added {len( values )} values to {table}"
+        self.Log.debug( log_message ) if self.Log else print( log_message )
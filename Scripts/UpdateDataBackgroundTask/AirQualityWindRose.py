@@ -0,0 +1,262 @@
+import logging
+import numpy as np
+import pandas as pd
+import sqlalchemy as SA
+from AirQualityFactTables import DW_DATABASE
+
+class AirQualityWindRose:
+    """
+        Maintains precomputed wind-rose histograms and circular statistics from
+        Fact_WindDirection and Fact_WindSpeed so reports read a few hundred cells
+        instead of binning all history at report time.
+
+        Two aggregate tables are kept per ( Full_Site_Number, Month, Hour_Of_Day ):
+            Agg_WindRose   - observation count per direction sector and speed class
+            Agg_WindVector - additive sums (speed-weighted u/v components, unit sin/cos,
+                             speed, count); the vector-mean direction and speed are
+                             computed columns so averaging never crosses the 0/360 wrap
+
+        Fact_WindDirection and Fact_WindSpeed get a ROWVERSION column (Row_Version).  An
+        incremental update finds the cells touched by rows inserted or revised since the last
+        processed row version and re-aggregates those cells from their full history, so late,
+        out-of-order and revised hours are counted exactly once.
+
+        Attributes:
+            self.Engine
+            self.Database
+            self.Log
+    """
+
+    SECTORS = 16                                        # 22.5 degree sectors, sector 0 centered on north
+    SPEED_CLASSES_MPH = [ 1, 5, 10, 15, 20 ]            # class 0 is calm (< 1 mph), class 5 is 20+ mph
+    ROSE_TABLE = 'Agg_WindRose'
+    VECTOR_TABLE = 'Agg_WindVector'
+    STATE_TABLE = 'Agg_Wind_State'
+    FACT_TABLES = [ 'Fact_WindDirection', 'Fact_WindSpeed' ]
+
+    def __init__( self, engine: SA.Engine, database: str = DW_DATABASE, log: logging = None ):
+        self.Engine = engine
+        self.Database = database
+        self.Log = log
+
+    def createTables( self ) -> None:
+        SQLCode = f"""
+            IF OBJECT_ID( '{self.Database}.dbo.{self.ROSE_TABLE}', 'U' ) IS NULL
+                CREATE TABLE {self.Database}.dbo.{self.ROSE_TABLE}
+                (
+                    Full_Site_Number CHAR(11) NOT NULL
+                    , Month_Of_Year TINYINT NOT NULL
+                    , Hour_Of_Day TINYINT NOT NULL
+                    , Direction_Sector TINYINT NOT NULL
+                    , Speed_Class TINYINT NOT NULL
+                    , Observation_Count INT NOT NULL
+                    , CONSTRAINT PK_{self.ROSE_TABLE} PRIMARY KEY ( Full_Site_Number, Month_Of_Year, Hour_Of_Day, Direction_Sector, Speed_Class )
+                )
+
+            IF OBJECT_ID( '{self.Database}.dbo.{self.VECTOR_TABLE}', 'U' ) IS NULL
+                CREATE TABLE {self.Database}.dbo.{self.VECTOR_TABLE}
+                (
+                    Full_Site_Number CHAR(11) NOT NULL
+                    , Month_Of_Year TINYINT NOT NULL
+                    , Hour_Of_Day TINYINT NOT NULL
+                    , Sum_U FLOAT NOT NULL
+                    , Sum_V FLOAT NOT NULL
+                    , Sum_Sin FLOAT NOT NULL
+                    , Sum_Cos FLOAT NOT NULL
+                    , Sum_Speed FLOAT NOT NULL
+                    , Observation_Count INT NOT NULL
+                    , Vector_Mean_Direction AS CONVERT( DECIMAL(6, 2), CASE WHEN Sum_U = 0 AND Sum_V = 0 THEN NULL ELSE ( DEGREES( ATN2( Sum_U, Sum_V ) ) + 360 ) % 360 END ) PERSISTED
+                    , Vector_Mean_Speed AS CONVERT( DECIMAL(9, 3), SQRT( Sum_U * Sum_U + Sum_V * Sum_V ) / NULLIF( Observation_Count, 0 ) ) PERSISTED
+                    , Scalar_Mean_Speed AS CONVERT( DECIMAL(9, 3), Sum_Speed / NULLIF( Observation_Count, 0 ) ) PERSISTED
+                    , Direction_Constancy AS CONVERT( DECIMAL(5, 4), SQRT( Sum_Sin * Sum_Sin + Sum_Cos * Sum_Cos ) / NULLIF( Observation_Count, 0 ) ) PERSISTED
+                    , CONSTRAINT PK_{self.VECTOR_TABLE} PRIMARY KEY ( Full_Site_Number, Month_Of_Year, Hour_Of_Day )
+                )
+
+            IF OBJECT_ID( '{self.Database}.dbo.{self.STATE_TABLE}', 'U' ) IS NULL
+                CREATE TABLE {self.Database}.dbo.{self.STATE_TABLE}
+                (
+                    Last_Row_Version BINARY(8) NULL
+                )
+        """
+        column_length = SA.text( "SELECT COL_LENGTH( :table, :column )" )
+        try:
+            with self.Engine.connect() as conn:
+                conn.execute( SA.text( SQLCode ) )
+                # state tables from before row version tracking only held Last_Date_Time_Local
+                state_table = f"{self.Database}.dbo.{self.STATE_TABLE}"
+                if conn.execute( column_length, { 'table': state_table, 'column': 'Last_Row_Version' } ).scalar() is None:
+                    conn.execute( SA.text( f"DELETE FROM {state_table}" ) )
+                    conn.execute( SA.text( f"ALTER TABLE {state_table} ADD Last_Row_Version BINARY(8) NULL" ) )
+                for table in self.FACT_TABLES:
+                    fact_table = f"{self.Database}.dbo.{table}"
+                    if conn.execute( column_length, { 'table': fact_table, 'column': 'Row_Version' } ).scalar() is None:
+                        conn.execute( SA.text( f"ALTER TABLE {fact_table} ADD Row_Version ROWVERSION" ) )
+                conn.commit()
+        except Exception as e:
+            log_message = f"Error creating wind aggregate tables. {e}"
+            self.Log.error( log_message ) if self.Log else print( log_message )
+
+    # =========================================================================
+    # Aggregation
+    # =========================================================================
+    @classmethod
+    def aggregate( cls, sites, times, directions, speeds ) -> tuple[pd.DataFrame, pd.DataFrame]:
+        """
+            Vectorized wind-rose and circular statistics for a batch of hourly observations.
+
+            Parameters:
+                sites (array-like) - Full_Site_Number of each observation
+                times (array-like) - local observation times
+                directions (array-like) - direction the wind blows from, in degrees
+                speeds (array-like) - wind speed in mph
+
+            Returns:
+                ( rose cells, vector cells ) DataFrames keyed like the aggregate tables
+        """
+        directions = np.asarray( directions, dtype = np.float64 ) % 360.0
+        speeds = np.asarray( speeds, dtype = np.float64 )
+        times = pd.DatetimeIndex( times )
+        valid = ~np.isnan( directions ) & ~np.isnan( speeds )
+
+        keys = pd.DataFrame( {
+            'Full_Site_Number': np.asarray( sites, dtype = object )[valid]
+            , 'Month_Of_Year': times.month.to_numpy()[valid].astype( np.int16 )
+            , 'Hour_Of_Day': times.hour.to_numpy()[valid].astype( np.int16 )
+        } )
+        directions, speeds = directions[valid], speeds[valid]
+        radians = np.radians( directions )
+
+        rose = keys.assign(
+            Direction_Sector = ( np.floor( ( directions + 180.0 / cls.SECTORS ) / ( 360.0 / cls.SECTORS ) ) % cls.SECTORS ).astype( np.int16 )
+            , Speed_Class = np.searchsorted( cls.SPEED_CLASSES_MPH, speeds, side = 'right' ).astype( np.int16 )
+            , Observation_Count = 1
+        ).groupby( ['Full_Site_Number', 'Month_Of_Year', 'Hour_Of_Day', 'Direction_Sector', 'Speed_Class'], as_index = False )['Observation_Count'].sum()
+
+        vector = keys.assign(
+            Sum_U = speeds * np.sin( radians )
+            , Sum_V = speeds * np.cos( radians )
+            , Sum_Sin = np.sin( radians )
+            , Sum_Cos = np.cos( radians )
+            , Sum_Speed = speeds
+            , Observation_Count = 1
+        ).groupby( ['Full_Site_Number', 'Month_Of_Year', 'Hour_Of_Day'], as_index = False ).sum()
+
+        return rose, vector
+
+    def _markChangedCells( self, conn, since: bytes, until: bytes ) -> int:
+        # ( site, month, hour ) cells with a wind row inserted or revised in [ since, until )
+        changed = " UNION ".join(
+            f"SELECT Full_Site_Number, Date_Time_Local FROM {self.Database}.dbo.{table} WHERE Row_Version >= :since AND Row_Version < :until"
+            for table in self.FACT_TABLES
+        )
+        conn.execute( SA.text( f"""
+            IF OBJECT_ID( 'tempdb..#WindCells' ) IS NOT NULL DROP TABLE #WindCells
+            SELECT DISTINCT Full_Site_Number, MONTH( Date_Time_Local ) AS Month_Of_Year, DATEPART( HOUR, Date_Time_Local ) AS Hour_Of_Day
+            INTO #WindCells
+            FROM ( {changed} ) AS changed
+        """ ), { 'since': since, 'until': until } )
+        return conn.execute( SA.text( "SELECT COUNT(*) FROM #WindCells" ) ).scalar()
+
+    def _readObservations( self, conn ) -> pd.DataFrame:
+        SQLCode = f"""
+            SELECT d.Full_Site_Number, d.Date_Time_Local, d.Wind_Direction_Sample_Measurement AS Direction, s.Wind_Speed_MPH AS Speed
+            FROM {self.Database}.dbo.Fact_WindDirection d
+            JOIN {self.Database}.dbo.Fact_WindSpeed s
+                ON s.Full_Site_Number = d.Full_Site_Number
+                AND s.Date_Time_Local = d.Date_Time_Local
+            JOIN #WindCells c
+                ON c.Full_Site_Number = d.Full_Site_Number
+                AND c.Month_Of_Year = MONTH( d.Date_Time_Local )
+                AND c.Hour_Of_Day = DATEPART( HOUR, d.Date_Time_Local )
+        """
+        return pd.read_sql( SA.text( SQLCode ), conn )
+
+    def update( self ) -> int:
+        """
+            Re-aggregates every cell with wind observations inserted or revised since the last update.
+
+            Returns:
+                Number of observations aggregated
+        """
+        try:
+            with self.Engine.begin() as conn:
+                since = conn.execute( SA.text( f"SELECT MAX( Last_Row_Version ) FROM {self.Database}.dbo.{self.STATE_TABLE}" ) ).scalar()
+                # rows below the lowest active row version are committed, so nothing is skipped by open transactions
+                until = conn.execute( SA.text( "SELECT MIN_ACTIVE_ROWVERSION()" ) ).scalar()
+                cells = self._markChangedCells( conn, since or bytes( 8 ), until )
+                if not cells:
+                    return 0
+                observations = self._readObservations( conn )
+                for table in [ self.ROSE_TABLE, self.VECTOR_TABLE ]:
+                    conn.execute( SA.text( f"""
+                        DELETE a FROM {self.Database}.dbo.{table} a
+                        JOIN #WindCells c
+                            ON c.Full_Site_Number = a.Full_Site_Number
+                            AND c.Month_Of_Year = a.Month_Of_Year
+                            AND c.Hour_Of_Day = a.Hour_Of_Day
+                    """ ) )
+                if not observations.empty:
+                    rose, vector = self.aggregate(
+                        observations['Full_Site_Number'].str.strip().to_numpy()
+                        , observations['Date_Time_Local']
+                        , pd.to_numeric( observations['Direction'] ).to_numpy( dtype = np.float64 )
+                        , pd.to_numeric( observations['Speed'] ).to_numpy( dtype = np.float64 )
+                    )
+                    self._mergeCells( conn, rose, vector )
+                conn.execute( SA.text( f"DELETE FROM {self.Database}.dbo.{self.STATE_TABLE}" ) )
+                conn.execute( SA.text( f"INSERT INTO {self.Database}.dbo.{self.STATE_TABLE} ( Last_Row_Version ) VALUES ( :last )" ), { 'last': until } )
+            log_message = f"Wind aggregates recomputed for {cells} cells from {len( observations )} observations."
+            self.Log.info( log_message ) if self.Log else print( log_message )
+            return len( observations )
+        except Exception as e:
+            log_message = f"Error updating wind aggregates. {e}"
+            self.Log.error( log_message ) if self.Log else print( log_message )
+            return 0
+
+    def rebuild( self ) -> int:
+        """
+            Clears the aggregates and recomputes them from all history (e.g. after facts were revised).
+        """
+        with self.Engine.begin() as conn:
+            for table in [ self.ROSE_TABLE, self.VECTOR_TABLE, self.STATE_TABLE ]:
+                conn.execute( SA.text( f"TRUNCATE TABLE {self.Database}.dbo.{table}" ) )
+        return self.update()
+
+    def _mergeCells( self, conn, rose: pd.DataFrame, vector: pd.DataFrame ) -> None:
+        rose_params = rose.astype( { 'Month_Of_Year': int, 'Hour_Of_Day': int, 'Direction_Sector': int, 'Speed_Class': int, 'Observation_Count': int } ).to_dict( 'records' )
+        conn.execute( SA.text( f"""
+            MERGE INTO {self.Database}.dbo.{self.ROSE_TABLE} AS target
+            USING ( VALUES ( :Full_Site_Number, :Month_Of_Year, :Hour_Of_Day, :Direction_Sector, :Speed_Class, :Observation_Count ) )
+                AS source ( Full_Site_Number, Month_Of_Year, Hour_Of_Day, Direction_Sector, Speed_Class, Observation_Count )
+            ON target.Full_Site_Number = source.Full_Site_Number
+                AND target.Month_Of_Year = source.Month_Of_Year
+                AND target.Hour_Of_Day = source.Hour_Of_Day
+                AND target.Direction_Sector = source.Direction_Sector
+                AND target.Speed_Class = source.Speed_Class
+            WHEN MATCHED THEN
+                UPDATE SET Observation_Count = target.Observation_Count + source.Observation_Count
+            WHEN NOT MATCHED THEN
+                INSERT ( Full_Site_Number, Month_Of_Year, Hour_Of_Day, Direction_Sector, Speed_Class, Observation_Count )
+                VALUES ( source.Full_Site_Number, source.Month_Of_Year, source.Hour_Of_Day, source.Direction_Sector, source.Speed_Class, source.Observation_Count );
+        """ ), rose_params )
+
+        vector_params = vector.astype( { 'Month_Of_Year': int, 'Hour_Of_Day': int, 'Observation_Count': int } ).to_dict( 'records' )
+        conn.execute( SA.text( f"""
+            MERGE INTO {self.Database}.dbo.{self.VECTOR_TABLE} AS target
+            USING ( VALUES ( :Full_Site_Number, :Month_Of_Year, :Hour_Of_Day, :Sum_U, :Sum_V, :Sum_Sin, :Sum_Cos, :Sum_Speed, :Observation_Count ) )
+                AS source ( Full_Site_Number, Month_Of_Year, Hour_Of_Day, Sum_U, Sum_V, Sum_Sin, Sum_Cos, Sum_Speed, Observation_Count )
+            ON target.Full_Site_Number = source.Full_Site_Number
+                AND target.Month_Of_Year = source.Month_Of_Year
+                AND target.Hour_Of_Day = source.Hour_Of_Day
+            WHEN MATCHED THEN
+                UPDATE SET
+                    Sum_U = target.Sum_U + source.Sum_U
+                    , Sum_V = target.Sum_V + source.Sum_V
+                    , Sum_Sin = target.Sum_Sin + source.Sum_Sin
+                    , Sum_Cos = target.Sum_Cos + source.Sum_Cos
+                    , Sum_Speed = target.Sum_Speed + source.Sum_Speed
+                    , Observation_Count = target.Observation_Count + source.Observation_Count
+            WHEN NOT MATCHED THEN
+                INSERT ( Full_Site_Number, Month_Of_Year, Hour_Of_Day, Sum_U, Sum_V, Sum_Sin, Sum_Cos, Sum_Speed, Observation_Count )
+                VALUES ( source.Full_Site_Number, source.Month_Of_Year, source.Hour_Of_Day, source.Sum_U, source.Sum_V, source.Sum_Sin, source.Sum_Cos, source.Sum_Speed, source.Observation_Count );
+        """ ), vector_params )
@@ -1,12 +1,30 @@
 import sqlalchemy as SA
 import pandas as pd
 import logging
+from datetime import datetime
 from AirQualityDBHandler import AirQualityDBHandler
+from AirQualityFactTables import DW_DATABASE, DAILY_FACT_TABLE, SRC_EPA, SRC_AIRNOW
+from AirQualityReconciler import AirQualityReconciler
+from AirQualityRecordBatch import RecordBatch
 
 class EPA_AirQualityDBHandler(AirQualityDBHandler):
     """
         Child class to handle database transactions from the EPA API
     """
+
+    # Staging layout (see AirQualityDBHandler.ensureStagingLayout).  The recID index serves the
+    # reconciler, which reads the rows loaded since its last run.
+    STAGING_DATE_COLUMN = 'date_local'
+    STAGING_DATETIME_COLUMN = ( 'datetime_local', 'CONVERT( DATETIME, date_local ) + CONVERT( DATETIME, time_local )' )
+    STAGING_INDEXES = {
+        'NaturalKey': ( [ 'state_code', 'county_code', 'site_number', 'parameter_code', 'date_local', 'time_local', 'poc' ], [ 'date_gmt', 'time_gmt', 'sample_measurement' ] )
+        , 'recID': ( [ 'recID' ], [] )
+    }
+    ENCODED_COLUMNS = {
+        'units_of_measure': ( 'units_of_measure_id', 'units' )
+        , 'method': ( 'method_id', 'method' )
+        , 'URL_Source': ( 'URL_Source_ID', 'url_source' )
+    }
     def __init__( self, server: str, database: str, username: str, password: str, port: int = None, log: logging = None ):
         super().__init__( server, database, username, password, port, log )
         
@@ -34,7 +52,7 @@ class EPA_AirQualityDBHandler(AirQualityDBHandler):
                     , date_gmt DATE
                     , time_gmt TIME
                     , sample_measurement DECIMAL(9, 5)
-                    , units_of_measure VARCHAR(50)
+                    , units_of_measure_id INT
                     , units_of_measure_code CHAR(3)
                     , sample_duration VARCHAR(25)
                     , sample_duration_code VARCHAR(25)
@@ -43,13 +61,13 @@ class EPA_AirQualityDBHandler(AirQualityDBHandler):
                     , uncertainty VARCHAR(25)
                     , qualifier VARCHAR(100)
                     , method_type VARCHAR(25)
-                    , method VARCHAR(100)
+                    , method_id INT
                     , method_code CHAR(3)
                     , state VARCHAR(50)
                     , county VARCHAR(50)
                     , date_of_last_change DATE
                     , cbsa_code CHAR(5)
-                    , URL_Source VARCHAR(1000)
+                    , URL_Source_ID INT
                 )
             """
             try:
@@ -64,27 +82,277 @@ class EPA_AirQualityDBHandler(AirQualityDBHandler):
                 self.Log.error( log_message ) if self.Log else print( log_message )
                 return False
             
-    def insertIntoStagingTable(self, df: pd.DataFrame, file_url: str, chunk_size: int = 50 ) -> None:
-        try:           
-            # Add the file_url to the DataFrame
-            df['URL_Source'] = file_url
-
-            # Insert data into the staging table
-            total_inserted = df.to_sql( 
-                name = self.StagingTable
-                , con = self.Engine
-                , schema = 'dbo'
-                , if_exists = 'append'
-                , index = False
-                , chunksize = chunk_size
-                , method = 'multi'
-            )
+    def insertIntoStagingTable( self, batch: RecordBatch, file_url: str, chunk_size: int = 10000 ) -> None:
+        self._insertBatch( batch, file_url, self.StagingTable, chunk_size )
+
+    def _insertBatch( self, batch: RecordBatch, file_url: str, tableName: str, chunk_size: int = 10000 ) -> None:
+        """
+            Bulk inserts the batch in one transaction.  Errors are logged and raised, so nothing is
+            recorded as loaded (coverage, planner density) for a batch that did not reach staging.
+        """
+        try:
+            # The units and method strings are stored as dictionary ids, mapped once per distinct value
+            columns, mappings = self._stagingColumns( batch )
+            with self.Engine.begin() as conn:
+                total_inserted = self._bulkInsert(
+                    conn
+                    , f"{self.Database}.dbo.{tableName}"
+                    , columns + [ 'URL_Source_ID' ]
+                    , batch
+                    , mappings
+                    , constants = ( self.Sources.id( 'url_source', file_url ), )
+                    , chunk_size = chunk_size
+                )
 
             log_message = f"Data successfully inserted into SQL Server. Total records inserted: {total_inserted}"
             self.Log.info( log_message ) if self.Log else print( log_message )
         except Exception as e:
             log_message = f"Error inserting data into SQL Server: {e}"
             self.Log.error( log_message ) if self.Log else print( log_message )
-      
+            raise
+
+    def _promotedFilter( self, conn ) -> tuple[str, dict]:
+        # rows up to the reconciler's watermark have been merged into the fact tables
+        state_table = f"{self.Database}.dbo.{AirQualityReconciler.STATE_TABLE}"
+        if conn.execute( SA.text( "SELECT OBJECT_ID( :t, 'U' )" ), { 't': state_table } ).scalar() is None:
+            return None, {}
+        last_recid = conn.execute( SA.text( f"SELECT Last_recID FROM {state_table} WHERE Source_Table = :t" ), { 't': self.StagingTable } ).scalar()
+        if last_recid is None:
+            return None, {}
+        return 'recID <= :last_recid', { 'last_recid': last_recid }
+
+    # =========================================================================
+    # Daily summaries (EPA dailyData)
+    # =========================================================================
+    def setDailyStagingTable( self, dailyTable: str = 'EPA_API_Daily', createIfNotExists: bool = True ) -> bool:
+        self.DailyStagingTable = dailyTable
+        self.DailyRequestedTable = f"{dailyTable}_Requested"
+        if createIfNotExists and not self.checkIfTableExists( self.DailyRequestedTable ):
+            self.createDailyRequestedTable( self.DailyRequestedTable )
+        if not self.checkIfTableExists( self.DailyStagingTable ):
+            if createIfNotExists:
+                return self.createDailyStagingTable( self.DailyStagingTable )
+            return False
+        return True
+
+    def createDailyStagingTable( self, tableName: str ) -> bool:
+        """
+            Staging table for EPA dailyData rows, one row per site, parameter, POC, day,
+            sample duration, pollutant standard and event type.
+        """
+        SQLCode = f"""
+            CREATE TABLE {self.Database}.dbo.{tableName}
+            (
+                recID INT IDENTITY(1, 1)
+                , state_code CHAR(2)
+                , county_code CHAR(3)
+                , site_number CHAR(4)
+                , parameter_code CHAR(5)
+                , poc TINYINT
+                , latitude DECIMAL(9, 6)
+                , longitude DECIMAL(9, 6)
+                , datum CHAR(5)
+                , parameter VARCHAR(50)
+                , sample_duration_code VARCHAR(25)
+                , sample_duration VARCHAR(25)
+                , pollutant_standard VARCHAR(50)
+                , date_local DATE
+                , units_of_measure_id INT
+                , event_type VARCHAR(25)
+                , observation_count SMALLINT
+                , observation_percent DECIMAL(5, 1)
+                , validity_indicator CHAR(1)
+                , arithmetic_mean DECIMAL(12, 6)
+                , first_max_value DECIMAL(12, 6)
+                , first_max_hour TINYINT
+                , aqi SMALLINT
+                , method_code CHAR(3)
+                , method_id INT
+                , local_site_name VARCHAR(100)
+                , site_address VARCHAR(100)
+                , state VARCHAR(50)
+                , county VARCHAR(50)
+                , city VARCHAR(50)
+                , cbsa_code CHAR(5)
+                , cbsa VARCHAR(100)
+                , date_of_last_change DATE
+                , URL_Source_ID INT
+            )
+        """
+        try:
+            with self.Engine.connect() as conn:
+                conn.execute( SA.text( SQLCode ) )
+                conn.commit()
+                log_message = f"{self.Database}.dbo.{tableName} has been successfully created."
+                self.Log.info(log_message) if self.Log else print(log_message)
+            return self.checkIfTableExists( tableName )
+        except Exception as e:
+            log_message = f"Error creating table: {tableName}.  {e}"
+            self.Log.error( log_message ) if self.Log else print( log_message )
+            return False
+
+    def createDailyRequestedTable( self, tableName: str ) -> bool:
+        """
+            Windows of the dailyData service already requested per site and parameter, so days a
+            site has no data for (e.g. parameters it never measured) are not requested again.
+        """
+        SQLCode = f"""
+            CREATE TABLE {self.Database}.dbo.{tableName}
+            (
+                aqsid CHAR(9) NOT NULL
+                , parameter_code CHAR(5) NOT NULL
+                , bdate DATE NOT NULL
+                , edate DATE NOT NULL
+                , Requested DATETIME2(0) NOT NULL DEFAULT SYSUTCDATETIME()
+                , INDEX IX_{tableName}_Site ( aqsid, parameter_code, bdate )
+            )
+        """
+        try:
+            with self.Engine.connect() as conn:
+                conn.execute( SA.text( SQLCode ) )
+                conn.commit()
+            return self.checkIfTableExists( tableName )
+        except Exception as e:
+            log_message = f"Error creating table: {tableName}.  {e}"
+            self.Log.error( log_message ) if self.Log else print( log_message )
+            return False
+
+    def insertIntoDailyStagingTable( self, batch: RecordBatch, file_url: str, chunk_size: int = 10000 ) -> None:
+        self._insertBatch( batch, file_url, self.DailyStagingTable, chunk_size )
+
+    def recordDailyRequest( self, aqsid: str, params: list[str], bdate: datetime, edate: datetime ) -> None:
+        """
+            Records a dailyData window as requested for each of its parameters, once its response is staged.
+        """
+        with self.Engine.begin() as conn:
+            conn.execute( SA.text( f"""
+                INSERT INTO {self.Database}.dbo.{self.DailyRequestedTable} ( aqsid, parameter_code, bdate, edate )
+                VALUES ( :aqsid, :parameter_code, :bdate, :edate )
+            """ ), [ { 'aqsid': aqsid, 'parameter_code': code, 'bdate': bdate.date(), 'edate': edate.date() } for code in params ] )
+
+    def getDailyLoadedDays( self, AQSIDs: list[str], beginDate: datetime, endDate: datetime ) -> pd.DataFrame:
+        """
+            Returns the distinct ( aqsid, parameter_code, date_local ) already in the daily staging
+            table or covered by a window requested before (including windows that returned no rows).
+        """
+        params = { 'aqsids': list( AQSIDs ), 'bdate': beginDate.date(), 'edate': endDate.date() }
+        SQLCode = SA.text( f"""
+            SELECT DISTINCT aqsid = state_code + county_code + site_number, parameter_code, date_local
+            FROM {self.Database}.dbo.{self.DailyStagingTable}
+            WHERE state_code + county_code + site_number IN :aqsids
+                AND date_local BETWEEN :bdate AND :edate
+        """ ).bindparams( SA.bindparam( 'aqsids', expanding = True ) )
+        RequestedCode = SA.text( f"""
+            SELECT aqsid, parameter_code, bdate = CASE WHEN bdate < :bdate THEN :bdate ELSE bdate END, edate = CASE WHEN edate > :edate THEN :edate ELSE edate END
+            FROM {self.Database}.dbo.{self.DailyRequestedTable}
+            WHERE aqsid IN :aqsids
+                AND bdate <= :edate
+                AND edate >= :bdate
+        """ ).bindparams( SA.bindparam( 'aqsids', expanding = True ) )
+        with self.Engine.connect() as conn:
+            loaded = pd.read_sql( SQLCode, conn, params = params )
+            requested = pd.read_sql( RequestedCode, conn, params = params )
+        if requested.empty:
+            return loaded
+        requested = requested.assign( date_local = [ pd.date_range( bdate, edate, freq = 'D' ).date for bdate, edate in zip( requested['bdate'], requested['edate'] ) ] )
+        requested = requested.explode( 'date_local' )[['aqsid', 'parameter_code', 'date_local']]
+        requested['parameter_code'] = requested['parameter_code'].str.strip()
+        loaded['parameter_code'] = loaded['parameter_code'].astype( str ).str.strip()
+        return pd.concat( [ loaded, requested ], ignore_index = True ).drop_duplicates()
+
+    def updateDailyFactTable( self, dw_database: str = DW_DATABASE ) -> int:
+        """
+            MERGEs the daily staging rows loaded since the last run into the daily fact table.
+            Rows with exceptional events excluded are skipped (the all-data row is kept) and the
+            lowest POC wins when a site has several monitors for a parameter.  Preliminary AirNow
+            daily rows of the same site, parameter and day are removed.
+
+            Returns:
+                Number of fact rows inserted or updated
+        """
+        with self.Engine.begin() as conn:
+            last_recid = self._getWatermark( conn, self.DailyStagingTable )
+            max_recid = conn.execute( SA.text( f"SELECT MAX( recID ) FROM {self.Database}.dbo.{self.DailyStagingTable}" ) ).scalar() or 0
+            if max_recid <= last_recid:
+                return 0
+
+            conn.execute( SA.text( """
+                DROP TABLE IF EXISTS #DailyEPAKeys
+                CREATE TABLE #DailyEPAKeys ( Full_Site_Number CHAR(11), Parameter_Code CHAR(5), Date_Local DATE )
+            """ ) )
+            rows = conn.execute( SA.text( f"""
+                MERGE INTO {dw_database}.dbo.{DAILY_FACT_TABLE} AS target
+                USING (
+                    SELECT *
+                    FROM (
+                        SELECT
+                            Full_Site_Number = CONVERT( CHAR(11), state_code + '-' + county_code + '-' + site_number )
+                            , Date_Local = date_local
+                            , Parameter_Code = parameter_code
+                            , Parameter_Name = parameter
+                            , Sample_Duration = sample_duration
+                            , Pollutant_Standard = ISNULL( pollutant_standard, '' )
+                            , Units_of_Measure = u.Value
+                            , Observation_Count = observation_count
+                            , Observation_Percent = observation_percent
+                            , Validity_Indicator = validity_indicator
+                            , Arithmetic_Mean = arithmetic_mean
+                            , First_Max_Value = first_max_value
+                            , First_Max_Hour = first_max_hour
+                            , AQI = aqi
+                            , rn = ROW_NUMBER() OVER (
+                                PARTITION BY state_code, county_code, site_number, parameter_code, date_local, sample_duration, ISNULL( pollutant_standard, '' )
+                                ORDER BY poc, recID DESC
+                            )
+                        FROM {self.Database}.dbo.{self.DailyStagingTable} s
+                        LEFT JOIN {self.Sources.table( 'units' )} u ON u.ID = s.units_of_measure_id
+                        WHERE recID > :last_recid AND recID <= :max_recid
+                            AND ISNULL( event_type, 'None' ) <> 'Excluded'
+                    ) AS ranked
+                    WHERE rn = 1
+                ) AS source
+                ON target.Full_Site_Number = source.Full_Site_Number
+                    AND target.Parameter_Code = source.Parameter_Code
+                    AND target.Date_Local = source.Date_Local
+                    AND target.Sample_Duration = source.Sample_Duration
+                    AND target.Pollutant_Standard = source.Pollutant_Standard
+                WHEN MATCHED THEN UPDATE SET
+                    Parameter_Name = source.Parameter_Name
+                    , Units_of_Measure = source.Units_of_Measure
+                    , Observation_Count = source.Observation_Count
+                    , Observation_Percent = source.Observation_Percent
+                    , Validity_Indicator = source.Validity_Indicator
+                    , Arithmetic_Mean = source.Arithmetic_Mean
+                    , First_Max_Value = source.First_Max_Value
+                    , First_Max_Hour = source.First_Max_Hour
+                    , AQI = source.AQI
+                    , src = :src
+                WHEN NOT MATCHED THEN INSERT
+                    ( Full_Site_Number, Date_Local, Parameter_Code, Parameter_Name, Sample_Duration, Pollutant_Standard, Units_of_Measure
+                    , Observation_Count, Observation_Percent, Validity_Indicator, Arithmetic_Mean, First_Max_Value, First_Max_Hour, AQI, src )
+                VALUES
+                    ( source.Full_Site_Number, source.Date_Local, source.Parameter_Code, source.Parameter_Name, source.Sample_Duration, source.Pollutant_Standard, source.Units_of_Measure
+                    , source.Observation_Count, source.Observation_Percent, source.Validity_Indicator, source.Arithmetic_Mean, source.First_Max_Value, source.First_Max_Hour, source.AQI, :src )
+                OUTPUT inserted.Full_Site_Number, inserted.Parameter_Code, inserted.Date_Local INTO #DailyEPAKeys ( Full_Site_Number, Parameter_Code, Date_Local );
+            """ ), { 'last_recid': last_recid, 'max_recid': max_recid, 'src': SRC_EPA } ).rowcount
+
+            # AirNow durations and standards differ from EPA's, so its rows are matched on site, parameter and day
+            conn.execute( SA.text( f"""
+                DELETE f
+                FROM {dw_database}.dbo.{DAILY_FACT_TABLE} f
+                JOIN #DailyEPAKeys k
+                    ON f.Full_Site_Number = k.Full_Site_Number
+                    AND f.Parameter_Code = k.Parameter_Code
+                    AND f.Date_Local = k.Date_Local
+                WHERE f.src = :airnow_src
+                DROP TABLE #DailyEPAKeys
+            """ ), { 'airnow_src': SRC_AIRNOW } )
+
+            self._setWatermark( conn, self.DailyStagingTable, max_recid )
+
+        log_message = f"Merged {rows} daily summary rows into {dw_database}.dbo.{DAILY_FACT_TABLE}"
+        self.Log.info( log_message ) if self.Log else print( log_message )
+        return rows
+
     def updateDWFactTables( self ) -> None:
-        print("update")
\ No newline at end of file
+        print("update")
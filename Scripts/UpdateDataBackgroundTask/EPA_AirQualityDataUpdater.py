@@ -1,17 +1,37 @@
 import time
 import requests
-import logging
 import pandas as pd
-import numpy as np
+import logging
+from functools import partial
+from contextlib import nullcontext
 from datetime import datetime, timedelta, timezone
-from io import StringIO
 from EPA_AirQualityDBHandler import EPA_AirQualityDBHandler
+from EPA_SampleDataDecoder import EPA_SampleDataDecoder
+from EPA_RequestPlanner import EPA_RequestPlanner
+from AirQualityCoverageIndex import AirQualityCoverageIndex
+from AirQualityProfiler import AirQualityProfiler
+from AirQualityPipeline import AirQualityPipeline
+from AirQualityRecordBatch import RecordBatch
 class EPA_AirQualityDataUpdater:
     """
-    
+        Requests are fetched, decoded and loaded by an AirQualityPipeline, so the next request
+        is made while the previous response is still being decoded and inserted.
+
+        History older than a horizon can be loaded from the dailyData service instead of
+        sampleData (runTieredUpdate): about one row per site, parameter and day instead of 24,
+        into its own staging table feeding the daily summary fact table.
     """
 
-    def __init__( self, database: str, staging_tablename: str, EPA_Email: str, EPA_Key: str, AQSIDs: list[str], params: list[str], DBHandler: EPA_AirQualityDBHandler, log: logging = None ):
+    # The EPA API requires us not to make more than 10 requests per minute and a pause of at least 5 seconds between requests.
+    # I'll wait at least 7 seconds between requests
+    REQUEST_INTERVAL_SECONDS = 7
+
+    # Rows per parameter and day expected from dailyData before any are observed (one per pollutant standard and duration)
+    DAILY_ROWS_PER_DAY = 2.0
+
+    def __init__( self, database: str, staging_tablename: str, EPA_Email: str, EPA_Key: str, AQSIDs: list[str], params: list[str], DBHandler: EPA_AirQualityDBHandler, log: logging = None, coverage: AirQualityCoverageIndex = None, profiler: AirQualityProfiler = None
+                 , decode_workers: int = 1, pipeline_queue_size: int = 2, planner: EPA_RequestPlanner = None
+                 , daily_tablename: str = None, daily_planner: EPA_RequestPlanner = None ):
         self.Database = database
         self.EPA_Staging_Table = staging_tablename
         self.EPA_API_EMAIL = EPA_Email
@@ -20,76 +40,251 @@ class EPA_AirQualityDataUpdater:
         self.Params = params
         self.DBHandler = DBHandler
         self.Log = log        
+        self.Decoder = EPA_SampleDataDecoder( log = log )
+        self.Coverage = coverage
+        self.Planner = planner if planner is not None else EPA_RequestPlanner( log = log )
+        self.Profiler = profiler
+        self.DecodeWorkers = decode_workers
+        self.PipelineQueueSize = pipeline_queue_size
+        self._lastRequest = None
         
         # Ensure AirNow table exists in the database.  If not, create it.
         self.DBHandler.setStagingTable( self.EPA_Staging_Table, True )
 
+        # Daily summaries are optional, only set up when a daily staging table is given
+        self.EPA_Daily_Table = daily_tablename
+        if self.EPA_Daily_Table:
+            self.DailyDecoder = EPA_SampleDataDecoder( log = log, schema = EPA_SampleDataDecoder.DAILY_SCHEMA )
+            self.DailyPlanner = daily_planner if daily_planner is not None else EPA_RequestPlanner( default_rows_per_day = self.DAILY_ROWS_PER_DAY, log = log )
+            self.DBHandler.setDailyStagingTable( self.EPA_Daily_Table, True )
+
     def _split_list( self, lst: list[ str ], n: int ) -> list[ list[ str ] ]:
         """Split list into chunks of size n."""
         return [ lst[ i:i + n ] for i in range( 0, len( lst ), n ) ]
     
     def runUpdate( self, beginDate: datetime, endDate: datetime = None, specificAQSIDs: list[str] = None, specificParamsToUpdate: list[str] = None ) -> None:
+        with self._cycle( 'EPA_runUpdate' ):
+            self._loadRequests( self.Planner.plan( self._siteRequests( beginDate, endDate, specificAQSIDs, specificParamsToUpdate ) ) )
+
+    def _siteRequests( self, beginDate: datetime, endDate: datetime = None, specificAQSIDs: list[str] = None, specificParamsToUpdate: list[str] = None ):
+        """
+            Yields ( aqsid, params_chunk, beginDate, endDate ) for every site and chunk of up to 5 parameters.
+            The planner turns each into same-year windows sized to the site's observed density.
+        """
         AQSIDsToCheck = specificAQSIDs if specificAQSIDs else self.AQSIDs
         ParamsToUpdate = specificParamsToUpdate if specificParamsToUpdate else self.Params
+        endDate = endDate if endDate is not None else datetime.now()
 
         for aqsid in AQSIDsToCheck:
-            state = aqsid[:2]   # state code is the first 2 characters of an AQSID
-            county = aqsid[2:5] # county code is the next 3 characters of an AQSID
-            site = aqsid[5:]    # site code is the final 4 characters of an AQSID
+            log_message = f"Starting to process AQSID: {aqsid}, from begin date: { beginDate.strftime( '%Y%m%d' ) } to end date: { endDate.strftime( '%Y%m%d' ) }"
+            self.Log.info( log_message ) if self.Log else print( log_message )
+
+            # The EPA API only allows a maximum of 5 params to be retrieved in one call
+            for params_chunk in self._split_list( ParamsToUpdate, 5 ):
+                yield aqsid, params_chunk, beginDate, endDate
+
+    def repairGaps( self, beginDate: datetime, endDate: datetime, specificAQSIDs: list[str] = None, specificParamsToUpdate: list[str] = None ) -> int:
+        """
+            Requests only the date windows the coverage index reports as missing instead of whole years.
+
+            Returns:
+                Number of missing windows found
+        """
+        if self.Coverage is None:
+            raise RuntimeError( "repairGaps requires a coverage index." )
+        with self._cycle( 'EPA_repairGaps' ):
+            with self._stage( 'plan' ):
+                AQSIDsToCheck = specificAQSIDs if specificAQSIDs else self.AQSIDs
+                ParamsToUpdate = specificParamsToUpdate if specificParamsToUpdate else self.Params
+                # the job's params are what its sites are configured to report
+                plan = self.Coverage.planEPARequests( AQSIDsToCheck, ParamsToUpdate, beginDate, endDate
+                                                     , configured = { aqsid: ParamsToUpdate for aqsid in AQSIDsToCheck } )
+            log_message = f"Gap repair found {len( plan )} missing windows between {beginDate.strftime( '%Y%m%d' )} and {endDate.strftime( '%Y%m%d' )}."
+            self.Log.info( log_message ) if self.Log else print( log_message )
+            # the planner merges sparse gap windows and splits dense ones
+            self._loadRequests( self.Planner.plan( ( request['aqsid'], request['params'], request['bdate'], request['edate'] ) for request in plan ) )
+        return len( plan )
+
+    # =========================================================================
+    # Daily summaries for long-horizon history
+    # =========================================================================
+    def runTieredUpdate( self, beginDate: datetime, endDate: datetime = None, horizon_days: int = 365, specificAQSIDs: list[str] = None, specificParamsToUpdate: list[str] = None ) -> None:
+        """
+            Loads days older than horizon_days from the dailyData service and only the recent
+            window from sampleData.  Both tiers request only what is missing (repairDailyGaps,
+            and repairGaps when a coverage index is set).
+        """
+        if not self.EPA_Daily_Table:
+            raise RuntimeError( "runTieredUpdate requires a daily staging table." )
+        endDate = endDate if endDate is not None else datetime.now()
+        horizon = datetime( endDate.year, endDate.month, endDate.day ) - timedelta( days = horizon_days )
+
+        if beginDate < horizon:
+            self.repairDailyGaps( beginDate, min( endDate, horizon - timedelta( days = 1 ) ), specificAQSIDs, specificParamsToUpdate )
+        if endDate >= horizon:
+            hourlyBegin = max( beginDate, horizon )
+            if self.Coverage is not None:
+                self.repairGaps( hourlyBegin, endDate, specificAQSIDs, specificParamsToUpdate )
+            else:
+                self.runUpdate( hourlyBegin, endDate, specificAQSIDs, specificParamsToUpdate )
+
+    def repairDailyGaps( self, beginDate: datetime, endDate: datetime, specificAQSIDs: list[str] = None, specificParamsToUpdate: list[str] = None ) -> int:
+        """
+            Requests the daily summaries of the days not yet in the daily staging table.  Windows
+            already requested are skipped even when they returned nothing for a parameter, so
+            parameters a site never measured are requested once rather than on every run.
+
+            Returns:
+                Number of missing windows found
+        """
+        AQSIDsToCheck = specificAQSIDs if specificAQSIDs else self.AQSIDs
+        ParamsToUpdate = specificParamsToUpdate if specificParamsToUpdate else self.Params
+        with self._cycle( 'EPA_repairDailyGaps' ):
+            with self._stage( 'plan' ):
+                loaded = self.DBHandler.getDailyLoadedDays( AQSIDsToCheck, beginDate, endDate )
+                loaded_days = { key: set( pd.to_datetime( group['date_local'] ) ) for key, group in loaded.groupby( [ 'aqsid', 'parameter_code' ] ) }
+                all_days = pd.date_range( datetime( beginDate.year, beginDate.month, beginDate.day ), endDate, freq = 'D' )
+
+                plan = []
+                for aqsid in AQSIDsToCheck:
+                    for params_chunk in self._split_list( ParamsToUpdate, 5 ):
+                        # a day is missing when any parameter of the chunk lacks it
+                        missing = [ day for day in all_days if any( day not in loaded_days.get( ( aqsid, code ), () ) for code in params_chunk ) ]
+                        plan.extend( ( aqsid, params_chunk, first, last ) for first, last in self._runs( missing ) )
+
+            log_message = f"Daily gap repair found {len( plan )} missing windows between {beginDate.strftime( '%Y%m%d' )} and {endDate.strftime( '%Y%m%d' )}."
+            self.Log.info( log_message ) if self.Log else print( log_message )
+            self._loadRequests( self.DailyPlanner.plan( plan ), daily = True )
+        return len( plan )
+
+    @staticmethod
+    def _runs( days: list[datetime] ) -> list[tuple[datetime, datetime]]:
+        """Consecutive days as ( first, last ) windows."""
+        runs = []
+        for day in days:
+            if runs and ( day - runs[-1][1] ).days == 1:
+                runs[-1] = ( runs[-1][0], day )
+            else:
+                runs.append( ( day, day ) )
+        return runs
+
+    def _loadRequests( self, requests_to_make, daily: bool = False ) -> int:
+        """
+            Runs the requests through a fetch -> decode -> load pipeline.  Fetching stays on one
+            worker to honour the API rate limit; a failed request is logged and skipped, a
+            load failure cancels the remaining requests and is raised.
+
+            Parameters:
+                daily (bool) - request the dailyData service into the daily staging table instead of sampleData
+
+            Returns:
+                Number of responses loaded
+        """
+        pipeline = AirQualityPipeline( 'EPA_Daily' if daily else 'EPA', queue_size = self.PipelineQueueSize, log = self.Log )
+        pipeline.addStage( 'fetch', partial( self._fetch, daily = daily ) )
+        pipeline.addStage( 'decode', partial( self._decode, daily = daily ), workers = self.DecodeWorkers )
+        pipeline.addStage( 'load', partial( self._load, daily = daily ) )
+        stats = pipeline.run( requests_to_make )
+        return stats['load']['items'] - stats['load']['dropped']
+
+    def _cycle( self, name: str ):
+        return self.Profiler.cycle( name ) if self.Profiler is not None else nullcontext()
 
-            log_message = f"Starting to process AQSID: {aqsid}"
+    def _stage( self, name: str ):
+        return self.Profiler.stage( name ) if self.Profiler is not None else nullcontext()
+
+    def _throttle( self ) -> None:
+        # only the remainder of the pause is waited, decoding and loading the previous response count towards it
+        if self._lastRequest is not None:
+            wait = self.REQUEST_INTERVAL_SECONDS - ( time.monotonic() - self._lastRequest )
+            if wait > 0:
+                with self._stage( 'throttle' ):
+                    time.sleep( wait )
+
+    def _fetch( self, request: tuple[str, list[str], datetime, datetime], daily: bool = False ) -> tuple[tuple, str, requests.Response]:
+        """
+            Pipeline stage: makes one request and hands the open response to the decode stage,
+            which reads the body as it decodes.  Returns None (request skipped) on failure.
+        """
+        aqsid, params_chunk, bdate, edate = request
+        state = aqsid[:2]   # state code is the first 2 characters of an AQSID
+        county = aqsid[2:5] # county code is the next 3 characters of an AQSID
+        site = aqsid[5:]    # site code is the final 4 characters of an AQSID
+
+        api_url = (
+            'https://aqs.epa.gov/data/api/' + ( 'dailyData' if daily else 'sampleData' ) + '/bySite?email=' + self.EPA_API_EMAIL
+            + '&key=' + self.EPA_API_KEY
+            + '&param=' + ','.join( params_chunk )
+            + '&bdate=' + bdate.strftime( '%Y%m%d' )
+            + '&edate=' + edate.strftime( '%Y%m%d' )
+            + '&state=' + state
+            + '&county=' + county
+            + '&site=' + site
+        )
+
+        self._throttle()
+        
+        log_message = f"Requesting API URL: {api_url}"
+        self.Log.info( log_message ) if self.Log else print( log_message )
+
+        try:
+            with self._stage( 'request' ):
+                response = requests.get( api_url, stream = True )
+                if response.status_code != 200:
+                    log_message = f"Failed to retrieve data from {api_url}: {response.status_code}"
+                    self.Log.error( log_message ) if self.Log else print( log_message )
+                    response.close()
+                    return None
+        except requests.exceptions.RequestException as e:
+            log_message = f"Failed to retrieve data from {api_url}: {e}"
+            self.Log.error( log_message ) if self.Log else print( log_message )
+            return None
+        finally:
+            # the pause is measured from when the response starts, its body is read by the decode stage
+            self._lastRequest = time.monotonic()
+        return request, api_url, response
+
+    def _decode( self, fetched: tuple[tuple, str, requests.Response], daily: bool = False ) -> tuple[tuple, str, RecordBatch]:
+        """
+            Pipeline stage: streams the response body into the decoder, decoding the "Data" array
+            into typed columns, and records the response's rows per day for the planner.
+            Returns None (request skipped) if the body cannot be read.
+        """
+        request, api_url, response = fetched
+        try:
+            with self._stage( 'decode' ), response:
+                batch = ( self.DailyDecoder if daily else self.Decoder ).decodeResponse( response )
+        except requests.exceptions.RequestException as e:
+            log_message = f"Failed to read the response from {api_url}: {e}"
+            self.Log.error( log_message ) if self.Log else print( log_message )
+            return None
+        ( self.DailyPlanner if daily else self.Planner ).observe( *request, batch )
+        if batch.empty:
+            log_message = f"No data to insert from this site, parameters, and time frame.  Moving on."
             self.Log.info( log_message ) if self.Log else print( log_message )
+            if daily:
+                # the window is not requested again by repairDailyGaps
+                self.DBHandler.recordDailyRequest( *request )
+            return None
+        return request, api_url, batch
+
+    def _load( self, decoded: tuple[tuple, str, RecordBatch], daily: bool = False ) -> str:
+        """
+            Pipeline stage: inserts the decoded rows into the staging table.  Errors propagate and cancel the pipeline.
+        """
+        request, api_url, batch = decoded
+        log_message = f"Inserting data into staging table."
+        self.Log.info( log_message ) if self.Log else print( log_message )
+
+        if daily:
+            with self._stage( 'insert' ):
+                self.DBHandler.insertIntoDailyStagingTable( batch = batch, file_url = api_url )
+                self.DBHandler.recordDailyRequest( *request )
+            return api_url
 
-            current_bdate = beginDate
-            # The EPA API requires that all services must have the end date (edate field) be in the same year as the begin date (bdate field).
-            while current_bdate < endDate:
-                edate = endDate if current_bdate == endDate.year else datetime( current_bdate.year, 12, 31 )
-                
-                log_message = f"Gathering data from begin date: { current_bdate.strftime( '%Y%m%d' ) } to end date: { edate.strftime( '%Y%m%d' ) }"
-                self.Log.info( log_message ) if self.Log else print( log_message )
-
-                # The EPA API only allows a maximum of 5 params to be retrieved in one call
-                for params_chunk in self._split_list( ParamsToUpdate, 5 ):
-                    api_url = (
-                        'https://aqs.epa.gov/data/api/sampleData/bySite?email=' + self.EPA_API_EMAIL
-                        + '&key=' + self.EPA_API_KEY
-                        + '&param=' + ','.join( params_chunk )
-                        + '&bdate=' + current_bdate.strftime( '%Y%m%d' )
-                        + '&edate=' + edate.strftime( '%Y%m%d' )
-                        + '&state=' + state
-                        + '&county=' + county
-                        + '&site=' + site
-                    )
-
-                    # The EPA API requires us not to make more than 10 requests per minute and a pause of at least 5 seconds between requests.
-                    # I'll wait at least 7 seconds between requests
-                    time.sleep( 7 )
-                    
-                    log_message = f"Requesting API URL: {api_url}"
-                    self.Log.info( log_message ) if self.Log else print( log_message )
-
-                    response = requests.get( api_url )
-                    if response.status_code == 200:
-                        json_data = response.json()
-                        data_section = json_data.get( "Data", [] )
-                        df = pd.DataFrame( data_section )
-                        if df.empty:
-                            log_message = f"No data to insert from this site, parameters, and time frame.  Moving on."
-                            self.Log.info( log_message ) if self.Log else print( log_message )
-                        else:
-                            # Replace NaN and null values with None
-                            df.replace( { np.nan: None }, inplace = True )
-                            
-                            # Ensure some data types are properly applied
-                            df['sample_measurement'] = df['sample_measurement'].astype(float)
-                            df['detection_limit'] = df['detection_limit'].astype(float)
-                            
-                            log_message = f"Inserting data into staging table."
-                            self.Log.info( log_message ) if self.Log else print( log_message )
-
-                            self.DBHandler.insertIntoStagingTable( df = df, file_url = api_url, chunk_size = 50 )
-                            
-                    else:
-                        log_message = f"Failed to retrieve data from {api_url}: {response.status_code}"
-                        self.Log.error( log_message ) if self.Log else print( log_message )
-                current_bdate = datetime( current_bdate.year + 1, 1, 1 )
\ No newline at end of file
+        with self._stage( 'insert' ):
+            self.DBHandler.insertIntoStagingTable( batch = batch, file_url = api_url )
+        if self.Coverage is not None:
+            with self._stage( 'coverage' ):
+                self.Coverage.markEPA( batch )
+        return api_url
@@ -0,0 +1,169 @@
+import math
+import logging
+import threading
+import pandas as pd
+import sqlalchemy as SA
+from datetime import datetime, timedelta
+from typing import Iterable
+from AirQualityRecordBatch import RecordBatch
+
+class EPA_RequestPlanner:
+    """
+        Sizes the bdate / edate window of EPA sampleData requests from the rows per day
+        observed for each site and parameter, instead of always asking for whole years.
+
+        - Dense site / parameter chunks are split into several windows so no response is
+          expected to exceed target_rows (bounding response size and decoder memory).
+        - Sparse windows of the same site and parameters within a year are merged into one
+          request while the merged request stays under target_rows.
+        - Every window is clamped to the requested dates and kept within one calendar year
+          (the API requires bdate and edate in the same year).
+
+        Densities start at default_rows_per_day per parameter (DEFAULT_ROWS_PER_DAY for
+        hourly sampling, fewer for dailyData), can be seeded from the staging table and
+        are updated with every decoded response.
+
+        Attributes:
+            self.TargetRows
+            self.MinDays
+            self.MaxMergeGapDays
+            self.DefaultRowsPerDay
+            self.Log
+    """
+
+    DEFAULT_ROWS_PER_DAY = 24.0
+    SMOOTHING = 0.5     # weight of a new observation in the running density
+
+    def __init__( self, target_rows: int = 50000, min_days: int = 7, max_merge_gap_days: int = 31, default_rows_per_day: float = DEFAULT_ROWS_PER_DAY, log: logging = None ):
+        """
+            Parameters:
+                target_rows (int) - rows a single response should not be expected to exceed
+                min_days (int) - windows are never split below this many days
+                max_merge_gap_days (int) - windows further apart than this are never merged (the gap is re-requested when merged)
+                default_rows_per_day (float) - density assumed for a site / parameter with no observations yet
+        """
+        self.TargetRows = target_rows
+        self.MinDays = min_days
+        self.MaxMergeGapDays = max_merge_gap_days
+        self.DefaultRowsPerDay = default_rows_per_day
+        self.Log = log
+        self._density = {}     # ( aqsid, parameter_code ): rows per day
+        self._lock = threading.Lock()
+
+    # =========================================================================
+    # Densities
+    # =========================================================================
+    def loadDensity( self, engine: SA.Engine, database: str, table: str ) -> int:
+        """
+            Seeds the densities with the rows per loaded day of every site and parameter in the staging table.
+
+            Returns:
+                Number of site / parameter densities loaded
+        """
+        SQLCode = SA.text( f"""
+            SELECT
+                aqsid = state_code + county_code + site_number
+                , parameter_code
+                , rows_per_day = COUNT(*) * 1.0 / COUNT( DISTINCT date_local )
+            FROM {database}.dbo.{table}
+            GROUP BY state_code, county_code, site_number, parameter_code
+        """ )
+        with engine.connect() as conn:
+            densities = pd.read_sql( SQLCode, conn )
+        with self._lock:
+            for aqsid, code, rows_per_day in densities.itertuples( index = False ):
+                self._density[( aqsid, str( code ).strip() )] = float( rows_per_day )
+        log_message = f"Loaded {len( densities )} site / parameter densities from {database}.dbo.{table}"
+        self.Log.info( log_message ) if self.Log else print( log_message )
+        return len( densities )
+
+    def observe( self, aqsid: str, params: list[str], bdate: datetime, edate: datetime, batch: RecordBatch ) -> None:
+        """
+            Updates the densities from a decoded response.  Parameters that returned no rows count as 0 rows per day.
+        """
+        days = ( edate - bdate ).days + 1
+        counts = batch['parameter_code'].astype( str ).value_counts() if not batch.empty else pd.Series( dtype = 'int64' )
+        with self._lock:
+            for code in params:
+                observed = counts.get( code, 0 ) / days
+                previous = self._density.get( ( aqsid, code ) )
+                self._density[( aqsid, code )] = observed if previous is None else self.SMOOTHING * observed + ( 1 - self.SMOOTHING ) * previous
+
+    def rowsPerDay( self, aqsid: str, params: list[str] ) -> float:
+        with self._lock:
+            return sum( self._density.get( ( aqsid, code ), self.DefaultRowsPerDay ) for code in params )
+
+    # =========================================================================
+    # Windows
+    # =========================================================================
+    def split( self, aqsid: str, params: list[str], bdate: datetime, edate: datetime ) -> list[tuple[datetime, datetime]]:
+        """
+            Windows covering bdate through edate (inclusive): one per calendar year, each split
+            into equal parts when its expected rows exceed target_rows.
+        """
+        rows_per_day = self.rowsPerDay( aqsid, params )
+        max_days = max( self.MinDays, int( self.TargetRows / rows_per_day ) ) if rows_per_day > 0 else None
+        windows = []
+        for year in range( bdate.year, edate.year + 1 ):
+            first = max( bdate, datetime( year, 1, 1 ) )
+            last = min( edate, datetime( year, 12, 31 ) )
+            days = ( last - first ).days + 1
+            parts = math.ceil( days / max_days ) if max_days else 1
+            size = math.ceil( days / parts )
+            for part in range( parts ):
+                part_first = first + timedelta( days = part * size )
+                if part_first > last:
+                    break
+                windows.append( ( part_first, min( last, part_first + timedelta( days = size - 1 ) ) ) )
+        return windows
+
+    def merge( self, aqsid: str, params: list[str], windows: list[tuple[datetime, datetime]] ) -> list[tuple[datetime, datetime]]:
+        """
+            Merges windows of the same year whose combined span is still expected to stay under
+            target_rows and that are at most max_merge_gap_days apart.
+        """
+        rows_per_day = self.rowsPerDay( aqsid, params )
+        merged = []
+        for first, last in sorted( windows ):
+            if merged:
+                previous_first, previous_last = merged[-1]
+                span_days = ( max( last, previous_last ) - previous_first ).days + 1
+                if ( previous_first.year == last.year
+                    and ( first - previous_last ).days - 1 <= self.MaxMergeGapDays
+                    and span_days * rows_per_day <= self.TargetRows ):
+                    merged[-1] = ( previous_first, max( last, previous_last ) )
+                    continue
+            merged.append( ( first, last ) )
+        return merged
+
+    def plan( self, requests: Iterable[tuple[str, list[str], datetime, datetime]] ):
+        """
+            Yields ( aqsid, params, bdate, edate ) requests sized to the observed densities.
+
+            Requests of the same site and parameters are merged where sparse, then every window
+            is split by year and by size.  Requests are expected grouped by site (as every caller
+            produces them): a site is planned as soon as the next site's first request arrives, so
+            only one site's requests are held at a time and densities observed while a site loads
+            are used for its later windows and for the sites after it.
+        """
+        site, groups = None, {}
+        for aqsid, params, bdate, edate in requests:
+            if aqsid != site:
+                yield from self._planSite( site, groups )
+                site, groups = aqsid, {}
+            # dates may arrive as date or datetime, windows are whole days
+            bdate, edate = datetime( bdate.year, bdate.month, bdate.day ), datetime( edate.year, edate.month, edate.day )
+            if bdate <= edate:
+                groups.setdefault( tuple( params ), [] ).append( ( bdate, edate ) )
+        yield from self._planSite( site, groups )
+
+    def _planSite( self, aqsid: str, groups: dict[tuple, list[tuple[datetime, datetime]]] ):
+        for params, windows in groups.items():
+            params = list( params )
+            for bdate, edate in self.merge( aqsid, params, windows ):
+                for year in range( bdate.year, edate.year + 1 ):
+                    # split one year at a time so the densities are as fresh as possible
+                    first = max( bdate, datetime( year, 1, 1 ) )
+                    last = min( edate, datetime( year, 12, 31 ) )
+                    for window_first, window_last in self.split( aqsid, params, first, last ):
+                        yield aqsid, params, window_first, window_last
@@ -0,0 +1,222 @@
+import codecs
+import json
+import logging
+import numpy as np
+from typing import Iterable
+from AirQualityRecordBatch import RecordSchema, RecordBatch, EPA_SAMPLE_SCHEMA, EPA_DAILY_SCHEMA
+
+class EPA_SampleDataDecoder:
+    """
+        Streaming decoder for EPA AQS sampleData (and, with DAILY_SCHEMA, dailyData) responses.
+
+        Walks the "Data" array of the response one record at a time and appends
+        each field straight into a preallocated, typed column buffer instead of
+        materializing the whole JSON tree, a DataFrame of Python objects, and
+        the replace/astype copies on top of it.  The filled buffers are handed over
+        as a RecordBatch without copying.
+
+        Column kinds:
+            category - repeated strings (codes, units, names) stored as int32 codes
+            float    - float64 values, NaN where null
+            int      - int16 values with a separate null mask
+            date     - datetime64[D], each distinct date string parsed once
+
+        Attributes:
+            self.Schema
+            self.ChunkSize
+            self.InitialCapacity
+            self.Log
+    """
+
+    # Field order matches the staging tables (see AirQualityRecordBatch)
+    SCHEMA = EPA_SAMPLE_SCHEMA
+    DAILY_SCHEMA = EPA_DAILY_SCHEMA
+
+    def __init__( self, chunk_size: int = 65536, initial_capacity: int = 8192, log: logging = None, schema: RecordSchema = None ):
+        self.Schema = schema if schema is not None else self.SCHEMA
+        self.ChunkSize = chunk_size
+        self.InitialCapacity = initial_capacity
+        self.Log = log
+        self._decoder = json.JSONDecoder()
+
+    def decodeResponse( self, response ) -> RecordBatch:
+        """
+            Decodes a streamed requests.Response (requested with stream = True).
+
+            Returns:
+                RecordBatch of typed columns, empty if the response has no data.
+        """
+        return self.decode( response.iter_content( chunk_size = self.ChunkSize, decode_unicode = True ) )
+
+    def decode( self, chunks: Iterable[str] ) -> RecordBatch:
+        """
+            Decodes an EPA sampleData JSON document supplied as an iterable of text chunks.
+
+            Parameters:
+                chunks (Iterable[str]) - pieces of the JSON document in order
+
+            Returns:
+                RecordBatch of typed columns, empty if the document has no "Data" records.
+        """
+        buffers = _ColumnBuffers( self.Schema.Fields, self.InitialCapacity )
+        reader = _ChunkReader( chunks, self._decoder )
+
+        reader.expect( '{' )
+        while not reader.consumeIf( '}' ):
+            key = reader.readValue()
+            reader.expect( ':' )
+            if key == 'Data':
+                reader.expect( '[' )
+                while not reader.consumeIf( ']' ):
+                    buffers.append( reader.readValue() )
+                    reader.consumeIf( ',' )
+            else:
+                header = reader.readValue()
+                if key == 'Header' and self.Log:
+                    self.Log.debug( f"EPA response header: {header}" )
+            reader.consumeIf( ',' )
+
+        return buffers.toBatch( self.Schema )
+
+class _ChunkReader:
+    """
+        Minimal pull reader over a stream of JSON text chunks.  Keeps only the
+        unconsumed tail of the stream in memory.
+    """
+    def __init__( self, chunks: Iterable[str], decoder: json.JSONDecoder ):
+        self._chunks = iter( chunks )
+        self._decoder = decoder
+        self._buffer = ''
+        self._pos = 0
+        self._exhausted = False
+        self._bytesDecoder = codecs.getincrementaldecoder( 'utf-8' )()
+
+    def _fill( self ) -> bool:
+        if self._exhausted:
+            return False
+        for chunk in self._chunks:
+            if chunk:
+                if isinstance( chunk, bytes ):
+                    # a multi-byte character may be split across chunks
+                    chunk = self._bytesDecoder.decode( chunk )
+                # drop what has already been consumed before growing the buffer
+                self._buffer = self._buffer[self._pos:] + chunk
+                self._pos = 0
+                return True
+        self._exhausted = True
+        return False
+
+    def _skipWhitespace( self ) -> None:
+        while True:
+            while self._pos < len( self._buffer ) and self._buffer[self._pos] in ' \t\r\n':
+                self._pos += 1
+            if self._pos < len( self._buffer ) or not self._fill():
+                return
+
+    def consumeIf( self, token: str ) -> bool:
+        self._skipWhitespace()
+        if self._buffer.startswith( token, self._pos ):
+            self._pos += 1
+            return True
+        return False
+
+    def expect( self, token: str ) -> None:
+        if not self.consumeIf( token ):
+            found = self._buffer[self._pos:self._pos + 20] or 'end of response'
+            raise ValueError( f"Malformed EPA response: expected '{token}' but found '{found}'" )
+
+    def readValue( self ):
+        self._skipWhitespace()
+        while True:
+            try:
+                value, end = self._decoder.raw_decode( self._buffer, self._pos )
+                # A number at the very end of the buffer may continue in the next chunk
+                if end < len( self._buffer ) or self._exhausted or not isinstance( value, ( int, float ) ):
+                    self._pos = end
+                    return value
+                if not self._fill():
+                    self._pos = end
+                    return value
+            except json.JSONDecodeError:
+                if not self._fill():
+                    raise
+
+class _ColumnBuffers:
+    """
+        Growable typed column storage for decoded EPA records.
+    """
+    def __init__( self, columns: list[tuple[str, str]], capacity: int ):
+        self._columns = columns
+        self._capacity = max( capacity, 1 )
+        self._size = 0
+        self._values = {}
+        self._masks = {}
+        self._categories = {}
+        self._dateCache = {}
+        for name, kind in self._columns:
+            if kind == 'category':
+                self._values[name] = np.full( self._capacity, -1, dtype = np.int32 )
+                self._categories[name] = {}
+            elif kind == 'float':
+                self._values[name] = np.full( self._capacity, np.nan, dtype = np.float64 )
+            elif kind == 'int':
+                self._values[name] = np.zeros( self._capacity, dtype = np.int16 )
+                self._masks[name] = np.ones( self._capacity, dtype = bool )
+            elif kind == 'date':
+                self._values[name] = np.full( self._capacity, np.datetime64( 'NaT' ), dtype = 'datetime64[D]' )
+
+    def _grow( self ) -> None:
+        new_capacity = self._capacity * 2
+        for name, kind in self._columns:
+            old = self._values[name]
+            if kind == 'category':
+                new = np.full( new_capacity, -1, dtype = old.dtype )
+            elif kind == 'float':
+                new = np.full( new_capacity, np.nan, dtype = old.dtype )
+            elif kind == 'int':
+                new = np.zeros( new_capacity, dtype = old.dtype )
+                mask = np.ones( new_capacity, dtype = bool )
+                mask[:self._size] = self._masks[name][:self._size]
+                self._masks[name] = mask
+            else:
+                new = np.full( new_capacity, np.datetime64( 'NaT' ), dtype = old.dtype )
+            new[:self._size] = old[:self._size]
+            self._values[name] = new
+        self._capacity = new_capacity
+
+    def append( self, record: dict ) -> None:
+        if self._size == self._capacity:
+            self._grow()
+        i = self._size
+        for name, kind in self._columns:
+            value = record.get( name )
+            if value is None:
+                continue
+            if kind == 'category':
+                lookup = self._categories[name]
+                code = lookup.get( value )
+                if code is None:
+                    code = lookup[value] = len( lookup )
+                self._values[name][i] = code
+            elif kind == 'float':
+                self._values[name][i] = value
+            elif kind == 'int':
+                self._values[name][i] = value
+                self._masks[name][i] = False
+            else:
+                parsed = self._dateCache.get( value )
+                if parsed is None:
+                    parsed = self._dateCache[value] = np.datetime64( value, 'D' )
+                self._values[name][i] = parsed
+        self._size += 1
+
+    def toBatch( self, schema: RecordSchema ) -> RecordBatch:
+        # the batch views the filled part of the buffers, codes index the categories in first-seen order
+        n = self._size
+        return RecordBatch(
+            schema
+            , n
+            , { name: values[:n] for name, values in self._values.items() }
+            , { name: mask[:n] for name, mask in self._masks.items() }
+            , { name: list( lookup ) for name, lookup in self._categories.items() }
+        )
@@ -0,0 +1,551 @@
+"""
+    airquality - single command line entry point for the update background tasks.
+
+    Usage:
+        python airquality.py [--config FILE] run-airnow [--job NAME ...] [--all] [--once]
+        python airquality.py [--config FILE] backfill-epa [--job NAME] [--begin YYYY-MM-DD] [--end YYYY-MM-DD] [--no-reconcile]
+        python airquality.py [--config FILE] backfill-airnow [--job NAME] [--days N] [--begin YYYY-MM-DD] [--end YYYY-MM-DD]
+        python airquality.py [--config FILE] compact-staging [--kind airnow|epa] [--job NAME]
+        python airquality.py [--config FILE] load-sites [--skip-breakpoints]
+        python airquality.py [--config FILE] status [--db]
+
+    Jobs are defined in a TOML (or YAML) file, by default config/airquality.toml in the
+    current directory:
+
+        [defaults]
+        env_file = "config/Update_Background_Task.env"
+        log_dir = "logs"
+
+        [airnow.las_vegas]
+        database = "AirQuality_Staging"
+        table = "AirNowData"
+        aqsids = [ "320030043", ... ]
+
+        [epa.las_vegas]
+        database = "AirQuality_Staging"
+        table = "EPA_API_Raw"
+        aqsids = [ "320030043", ... ]
+        params = [ "88101", ... ]
+        begin = "2014-01-01"
+        end = "2024-12-31"
+        daily_horizon_days = 365    # older days come from dailyData summaries, 0 to disable
+
+    Several AirNow jobs (regions) can run in one process, e.g. `run-airnow --all`: each hourly
+    file is then downloaded and parsed once and routed to every region.
+
+    Only the standard library is imported at module load.  pandas, SQLAlchemy, numpy,
+    scipy, selenium and friends are imported inside the subcommand that needs them, so
+    `status` and `--help` start in milliseconds and each scheduled job only carries the
+    modules it uses.
+"""
+import argparse
+import os
+import sys
+from datetime import datetime, timezone
+
+DEFAULT_CONFIG_FILES = [ 'config/airquality.toml', 'config/airquality.yaml', 'config/airquality.yml' ]
+DEFAULT_ENV_FILE = os.path.join( 'config', 'Update_Background_Task.env' )
+
+AIRNOW_DEFAULTS = {
+    'database': 'AirQuality_Staging'
+    , 'table': 'AirNowData'
+    , 'log_name': 'AirNowUpdateBackground'
+    , 'hot_window_hours': 72
+    , 'hot_window_port': 8765
+    , 'raster_dir': 'rasters'
+    , 'wait_minute': 15
+    , 'pipeline_workers': {}
+    , 'pipeline_queue_size': 4
+    , 'retain_days': 30
+    , 'archive_table': None
+    , 'archive_compression': 'COLUMNSTORE'
+    , 'daily_table': None
+    , 'fact_workers': None
+    , 'hourly_backfill_days': 0
+}
+
+EPA_DEFAULTS = {
+    'database': 'AirQuality_Staging'
+    , 'table': 'EPA_API_Raw'
+    , 'log_name': 'EPA_API_UpdateBackground'
+    , 'begin': '2014-01-01'
+    , 'end': None
+    , 'reconcile': True
+    , 'decode_workers': 1
+    , 'target_rows': 50000
+    , 'pipeline_queue_size': 2
+    , 'daily_horizon_days': 0
+    , 'daily_table': 'EPA_API_Daily'
+    , 'retain_days': 90
+    , 'archive_table': None
+    , 'archive_compression': 'COLUMNSTORE'
+}
+
+SITES_DEFAULTS = {
+    'database': 'AirQuality_DW'
+    , 'table': 'Sites'
+    , 'log_name': 'LoadSites'
+}
+
+# =========================================================================
+# Configuration
+# =========================================================================
+def loadConfig( path: str = None ) -> dict:
+    """
+        Reads the job configuration.  TOML is read with the standard library, YAML
+        needs PyYAML and is only imported when a .yaml / .yml file is given.
+
+        Parameters:
+            path (str) - configuration file, None to use $AIRQUALITY_CONFIG or the first of DEFAULT_CONFIG_FILES that exists
+
+        Returns:
+            Configuration dictionary (empty if no file was found)
+    """
+    if path is None:
+        path = os.getenv( 'AIRQUALITY_CONFIG' )
+    if path is None:
+        path = next( ( candidate for candidate in DEFAULT_CONFIG_FILES if os.path.exists( candidate ) ), None )
+    if path is None:
+        return {}
+    if not os.path.exists( path ):
+        raise FileNotFoundError( f"Configuration file not found: {path}" )
+
+    if path.lower().endswith( ( '.yaml', '.yml' ) ):
+        import yaml
+        with open( path ) as f:
+            return yaml.safe_load( f ) or {}
+    import tomllib
+    with open( path, 'rb' ) as f:
+        return tomllib.load( f )
+
+def getJob( config: dict, kind: str, name: str = None, defaults: dict = None ) -> tuple[str, dict]:
+    """
+        Returns ( job name, job settings ) for a section of the configuration ('airnow', 'epa' or 'sites'),
+        with the section defaults applied.  The job name may be omitted when only one job is defined.
+    """
+    jobs = config.get( kind, {} )
+    # a section holding settings directly (no named jobs) is a single unnamed job
+    if jobs and not all( isinstance( value, dict ) for value in jobs.values() ):
+        jobs = { 'default': jobs }
+    if name is None:
+        if len( jobs ) > 1:
+            raise ValueError( f"Several {kind} jobs are configured ({', '.join( jobs )}), choose one with --job." )
+        name = next( iter( jobs ), 'default' )
+    elif name not in jobs:
+        raise KeyError( f"No {kind} job named '{name}' in the configuration." )
+    return name, { **( defaults or {} ), **jobs.get( name, {} ) }
+
+def _parseDate( value ) -> datetime:
+    if value is None or isinstance( value, datetime ):
+        return value
+    return datetime.strptime( str( value ), '%Y-%m-%d' )
+
+# =========================================================================
+# Shared set up
+# =========================================================================
+def _credentials( config: dict ) -> dict:
+    """
+        Loads the environment file holding the database and API credentials.
+    """
+    from dotenv import load_dotenv
+    load_dotenv( config.get( 'defaults', {} ).get( 'env_file', DEFAULT_ENV_FILE ) )
+    return {
+        'username': os.getenv( 'DB_USERNAME' )
+        , 'password': os.getenv( 'DB_PASSWORD' )
+        , 'server': os.getenv( 'DB_SERVER' )
+        , 'epa_email': os.getenv( 'EPA_API_EMAIL' )
+        , 'epa_key': os.getenv( 'EPA_API_KEY' )
+    }
+
+def _logPaths( config: dict, job: dict ) -> tuple[str, str]:
+    log_dir = config.get( 'defaults', {} ).get( 'log_dir', 'logs' )
+    today = datetime.now().strftime( '%Y%m%d' )
+    return ( os.path.join( log_dir, f"{job['log_name']}_INFO_{today}.log" )
+            , os.path.join( log_dir, f"{job['log_name']}_ERROR_{today}.log" ) )
+
+def _profiler( config: dict, job: dict, log ):
+    """
+        Profiler armed at runtime with SIGUSR1 or a profile.request file in the log folder.
+    """
+    from AirQualityProfiler import AirQualityProfiler
+    return AirQualityProfiler(
+        output_dir = config.get( 'defaults', {} ).get( 'log_dir', 'logs' )
+        , cycles = job.get( 'profile_cycles', 3 )
+        , log = log
+    )
+
+def _admin( config: dict, job: dict ):
+    from AirQualityAdmin import AirQualityAdmin
+    info_log, error_log = _logPaths( config, job )
+    return AirQualityAdmin(
+        InfoLogFile = info_log
+        , ErrorLogFile = error_log
+        , logToConsole = config.get( 'defaults', {} ).get( 'log_console', True )
+    )
+
+# =========================================================================
+# Subcommands
+# =========================================================================
+def runAirNow( config: dict, args: argparse.Namespace ) -> int:
+    """
+        Hourly AirNow update: hot window, interpolated surfaces, wind rose and coverage index
+        around AirNow_AirQualityDataUpdater.runUpdate.  With several jobs, the regions share
+        the downloads through AirNow_MultiRegionUpdater.
+    """
+    if args.all:
+        jobs = config.get( 'airnow', {} )
+        names = list( jobs ) if jobs and all( isinstance( value, dict ) for value in jobs.values() ) else [ None ]
+    else:
+        names = args.job or [ None ]
+    jobs = dict( getJob( config, 'airnow', name, AIRNOW_DEFAULTS ) for name in names )
+    daily = [ name for name, job in jobs.items() if job['daily_table'] ]
+    if len( jobs ) > 1 and daily:
+        # checked before any region starts its hot window server
+        raise ValueError( f"Daily file catch-up is not supported with several regions, remove daily_table from: {', '.join( daily )}." )
+    if len( jobs ) == 1 and os.getenv( 'HOT_WINDOW_PORT' ):
+        # the environment override only applies to a single region, several regions need their own ports
+        next( iter( jobs.values() ) )['hot_window_port'] = int( os.getenv( 'HOT_WINDOW_PORT' ) )
+    credentials = _credentials( config )
+    first_job = next( iter( jobs.values() ) )
+    myAirQualityAdmin = _admin( config, first_job )
+    profiler = _profiler( config, first_job, myAirQualityAdmin.Logger )
+
+    regions = { name: _airNowRegion( job, credentials, myAirQualityAdmin.Logger, profiler ) for name, job in jobs.items() }
+    if len( regions ) == 1:
+        updater = next( iter( regions.values() ) )['updater']
+    else:
+        from AirNow_MultiRegionUpdater import AirNow_MultiRegionUpdater
+        updater = AirNow_MultiRegionUpdater(
+            { name: region['updater'] for name, region in regions.items() }
+            , log = myAirQualityAdmin.Logger
+            , profiler = profiler
+            , pipeline_workers = first_job['pipeline_workers']
+            , pipeline_queue_size = first_job['pipeline_queue_size']
+        )
+
+    while True:
+        updater.runUpdate()
+        for region in regions.values():
+            if region['interpolator'] is not None:
+                region['interpolator'].updateFromHotWindow( region['hot_window'] )
+            region['wind_rose'].update()
+        if args.once:
+            for region in regions.values():
+                region['hot_window'].shutdown()
+            return 0
+
+        # Wait until the configured minute of the next hour
+        myAirQualityAdmin.waitUntilNextHour( first_job['wait_minute'] )
+
+def _airNowRegion( job: dict, credentials: dict, log, profiler ) -> dict:
+    """
+        Builds the DB handler, hot window, interpolator, wind rose and updater of one AirNow job.
+        No coverage index is built: run-airnow never plans gaps, that is left to backfill-airnow.
+    """
+    from AirNow_AirQualityDBHandler import AirNow_AirQualityDBHandler
+    from AirNow_AirQualityDataUpdater import AirNow_AirQualityDataUpdater
+    from AirQualityHotWindow import AirQualityHotWindow
+    from AirQualityInterpolator import AirQualityInterpolator
+    from AirQualityFactTables import fullSiteNumber
+    from AirQualityWindRose import AirQualityWindRose
+
+    myDBHandler = AirNow_AirQualityDBHandler(
+        server = credentials['server']
+        , database = job['database']
+        , username = credentials['username']
+        , password = credentials['password']
+        , port = None
+        , log = log
+        , fact_workers = job['fact_workers']
+    )
+
+    hotWindow = AirQualityHotWindow( hours = job['hot_window_hours'], log = log )
+    hotWindow.warmFromFactTables( myDBHandler.Engine )
+    if job['hot_window_port']:
+        hotWindow.serve( port = int( job['hot_window_port'] ) )
+
+    interpolator = None
+    if job['raster_dir']:
+        interpolator = AirQualityInterpolator( output_dir = job['raster_dir'], log = log )
+        interpolator.loadSiteLocations( myDBHandler.Engine, [ fullSiteNumber( aqsid ) for aqsid in job['aqsids'] ] )
+
+    windRose = AirQualityWindRose( myDBHandler.Engine, log = log )
+    windRose.createTables()
+
+    updater = AirNow_AirQualityDataUpdater(
+        database = job['database']
+        , staging_tablename = job['table']
+        , AQSIDs = job['aqsids']
+        , DBHandler = myDBHandler
+        , log = log
+        , hot_window = hotWindow
+        , coverage = None
+        , profiler = profiler
+        , pipeline_workers = job['pipeline_workers']
+        , pipeline_queue_size = job['pipeline_queue_size']
+        , daily_tablename = job['daily_table']
+        , hourly_backfill_days = job['hourly_backfill_days']
+    )
+    return { 'updater': updater, 'hot_window': hotWindow, 'interpolator': interpolator, 'wind_rose': windRose }
+
+def backfillEPA( config: dict, args: argparse.Namespace ) -> int:
+    """
+        Loads the missing windows of validated EPA data, then reconciles them into the fact tables.
+        With daily_horizon_days set, days older than the horizon are loaded from the daily
+        summaries instead and promoted to the daily summary fact table.
+    """
+    from AirQualityCoverageIndex import AirQualityCoverageIndex
+    from EPA_AirQualityDBHandler import EPA_AirQualityDBHandler
+    from EPA_AirQualityDataUpdater import EPA_AirQualityDataUpdater
+    from EPA_RequestPlanner import EPA_RequestPlanner
+
+    _, job = getJob( config, 'epa', args.job, EPA_DEFAULTS )
+    credentials = _credentials( config )
+    myAirQualityAdmin = _admin( config, job )
+
+    myDBHandler = EPA_AirQualityDBHandler(
+        server = credentials['server']
+        , database = job['database']
+        , username = credentials['username']
+        , password = credentials['password']
+        , port = None
+        , log = myAirQualityAdmin.Logger
+    )
+
+    # rows moved out of staging by compact-staging are still loaded
+    archive_table = job['archive_table'] or f"{job['table']}_Archive"
+    coverage = AirQualityCoverageIndex( log = myAirQualityAdmin.Logger )
+    coverage.buildFromDatabase( myDBHandler.Engine, staging_database = job['database'], epa_table = job['table'], include_facts = False
+                               , epa_archive_table = archive_table if myDBHandler.checkIfTableExists( archive_table ) else None )
+
+    # request windows sized from the rows per day already loaded for each site and parameter
+    planner = EPA_RequestPlanner( target_rows = job['target_rows'], log = myAirQualityAdmin.Logger )
+    planner.loadDensity( myDBHandler.Engine, job['database'], job['table'] )
+
+    tiered = bool( job['daily_horizon_days'] )
+    dailyPlanner = None
+    if tiered:
+        dailyPlanner = EPA_RequestPlanner( target_rows = job['target_rows'], default_rows_per_day = EPA_AirQualityDataUpdater.DAILY_ROWS_PER_DAY, log = myAirQualityAdmin.Logger )
+        if myDBHandler.checkIfTableExists( job['daily_table'] ):
+            dailyPlanner.loadDensity( myDBHandler.Engine, job['database'], job['daily_table'] )
+
+    updater = EPA_AirQualityDataUpdater(
+        database = job['database']
+        , staging_tablename = job['table']
+        , EPA_Email = credentials['epa_email']
+        , EPA_Key = credentials['epa_key']
+        , AQSIDs = job['aqsids']
+        , params = job['params']
+        , DBHandler = myDBHandler
+        , log = myAirQualityAdmin.Logger
+        , coverage = coverage
+        , profiler = _profiler( config, job, myAirQualityAdmin.Logger )
+        , decode_workers = job['decode_workers']
+        , pipeline_queue_size = job['pipeline_queue_size']
+        , planner = planner
+        , daily_tablename = job['daily_table'] if tiered else None
+        , daily_planner = dailyPlanner
+    )
+
+    beginDate = _parseDate( args.begin or job['begin'] )
+    endDate = _parseDate( args.end or job['end'] ) or datetime.now()
+    if tiered:
+        updater.runTieredUpdate( beginDate = beginDate, endDate = endDate, horizon_days = job['daily_horizon_days'] )
+    else:
+        updater.repairGaps( beginDate = beginDate, endDate = endDate )
+
+    if job['reconcile'] and not args.no_reconcile:
+        from AirQualityReconciler import AirQualityReconciler
+        reconciler = AirQualityReconciler( myDBHandler.Engine, staging_database = job['database'], epa_table = job['table'], log = myAirQualityAdmin.Logger )
+        reconciler.run()
+        if tiered:
+            myDBHandler.createDailyFactTable()
+            myDBHandler.updateDailyFactTable()
+    return 0
+
+def backfillAirNow( config: dict, args: argparse.Namespace ) -> int:
+    """
+        Loads the hourly files of every day run-airnow caught up from daily files (daily_table
+        jobs) and, with --begin, the hourly files the coverage index reports as missing between
+        --begin and --end (GMT), then updates the fact tables.
+    """
+    from AirQualityCoverageIndex import AirQualityCoverageIndex
+    from AirNow_AirQualityDBHandler import AirNow_AirQualityDBHandler
+    from AirNow_AirQualityDataUpdater import AirNow_AirQualityDataUpdater
+
+    _, job = getJob( config, 'airnow', args.job, AIRNOW_DEFAULTS )
+    credentials = _credentials( config )
+    myAirQualityAdmin = _admin( config, job )
+
+    myDBHandler = AirNow_AirQualityDBHandler(
+        server = credentials['server']
+        , database = job['database']
+        , username = credentials['username']
+        , password = credentials['password']
+        , port = None
+        , log = myAirQualityAdmin.Logger
+        , fact_workers = job['fact_workers']
+    )
+    coverage = None
+    if args.begin:
+        coverage = AirQualityCoverageIndex( log = myAirQualityAdmin.Logger )
+        coverage.buildFromDatabase( myDBHandler.Engine, staging_database = job['database'], airnow_table = job['table'] )
+
+    updater = AirNow_AirQualityDataUpdater(
+        database = job['database']
+        , staging_tablename = job['table']
+        , AQSIDs = job['aqsids']
+        , DBHandler = myDBHandler
+        , log = myAirQualityAdmin.Logger
+        , coverage = coverage
+        , profiler = _profiler( config, job, myAirQualityAdmin.Logger )
+        , pipeline_workers = job['pipeline_workers']
+        , pipeline_queue_size = job['pipeline_queue_size']
+        , daily_tablename = job['daily_table']
+    )
+    if job['daily_table']:
+        updater.backfillHourlyDays( args.days )
+    if args.begin:
+        updater.repairGaps( _parseDate( args.begin ), _parseDate( args.end ) or datetime.now( timezone.utc ).replace( tzinfo = None ) )
+    myDBHandler.updateDWFactTables()
+    return 0
+
+def compactStaging( config: dict, args: argparse.Namespace ) -> int:
+    """
+        Retention job for the staging tables: extends the monthly partitions, creates any missing
+        index and moves the rows already promoted to the fact tables into the compressed archive.
+    """
+    import logging
+    from AirNow_AirQualityDBHandler import AirNow_AirQualityDBHandler
+    from EPA_AirQualityDBHandler import EPA_AirQualityDBHandler
+
+    credentials = _credentials( config )
+    for kind, defaults, handler_class in ( ( 'airnow', AIRNOW_DEFAULTS, AirNow_AirQualityDBHandler ), ( 'epa', EPA_DEFAULTS, EPA_AirQualityDBHandler ) ):
+        if args.kind and args.kind != kind:
+            continue
+        jobs = config.get( kind, {} )
+        if jobs and not all( isinstance( value, dict ) for value in jobs.values() ):
+            jobs = { 'default': jobs }
+        for name in jobs:
+            if args.job and name != args.job:
+                continue
+            _, job = getJob( config, kind, name, defaults )
+            handler = handler_class( server = credentials['server'], database = job['database']
+                                    , username = credentials['username'], password = credentials['password'], port = None
+                                    , log = logging.getLogger( 'airquality' ) )
+            if not handler.setStagingTable( job['table'], False ):
+                print( f"{kind}.{name}: {job['database']}.dbo.{job['table']} does not exist, skipped" )
+                continue
+            archived = handler.archivePromotedRows( archiveTable = job['archive_table'], retainDays = job['retain_days'], compression = job['archive_compression'] )
+            print( f"{kind}.{name}: archived {archived} rows from {job['database']}.dbo.{job['table']}" )
+    return 0
+
+def loadSites( config: dict, args: argparse.Namespace ) -> int:
+    """
+        Reloads the Sites table (and the AQI breakpoints lookup) with Database_Setup/02_LoadMetaTables.py.
+    """
+    import importlib.util
+    _, job = getJob( config, 'sites', None, SITES_DEFAULTS )
+    credentials = _credentials( config )
+
+    # the setup script lives beside this folder and its name is not a valid module name
+    script = os.path.join( os.path.dirname( os.path.abspath( __file__ ) ), '..', 'Database_Setup', '02_LoadMetaTables.py' )
+    spec = importlib.util.spec_from_file_location( 'LoadMetaTables', script )
+    metaTables = importlib.util.module_from_spec( spec )
+    spec.loader.exec_module( metaTables )
+
+    Engine = metaTables.createEngine( credentials['server'], credentials['username'], credentials['password'], job['database'] )
+    metaTables.loadSites( Engine, job['database'], job['table'] )
+    if not args.skip_breakpoints:
+        metaTables.loadAQIBreakpoints( Engine, job['database'] )
+    return 0
+
+def status( config: dict, args: argparse.Namespace ) -> int:
+    """
+        Lists the configured jobs with the last line of today's log.  With --db, also reports
+        the latest loaded hour of each AirNow job (this imports the database stack).
+    """
+    for kind, defaults in ( ( 'airnow', AIRNOW_DEFAULTS ), ( 'epa', EPA_DEFAULTS ) ):
+        jobs = config.get( kind, {} )
+        if jobs and not all( isinstance( value, dict ) for value in jobs.values() ):
+            jobs = { 'default': jobs }
+        for name in jobs:
+            _, job = getJob( config, kind, name, defaults )
+            info_log, error_log = _logPaths( config, job )
+            print( f"{kind}.{name}: {job['database']}.dbo.{job['table']}, {len( job.get( 'aqsids', [] ) )} sites" )
+            print( f"    last log:   {_lastLine( info_log ) or '-'}" )
+            error = _lastLine( error_log )
+            if error:
+                print( f"    last error: {error}" )
+
+            if args.db and kind == 'airnow':
+                import logging
+                from AirNow_AirQualityDBHandler import AirNow_AirQualityDBHandler
+                credentials = _credentials( config )
+                handler = AirNow_AirQualityDBHandler( server = credentials['server'], database = job['database']
+                                                     , username = credentials['username'], password = credentials['password'], port = None
+                                                     , log = logging.getLogger( 'airquality' ) )
+                handler.setStagingTable( job['table'] )
+                last_date, last_hour = handler.getLastInsertedDate( job['aqsids'] )
+                print( f"    last loaded: {last_date} {last_hour:02d}:00 GMT" )
+    return 0
+
+def _lastLine( path: str ) -> str:
+    if not os.path.exists( path ):
+        return None
+    with open( path, 'rb' ) as f:
+        # only the tail of the file is read, logs can be large
+        f.seek( 0, os.SEEK_END )
+        f.seek( max( 0, f.tell() - 4096 ) )
+        lines = f.read().decode( 'utf-8', errors = 'replace' ).strip().splitlines()
+    return lines[-1] if lines else None
+
+# =========================================================================
+# Entry point
+# =========================================================================
+def buildParser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser( prog = 'airquality', description = 'Air quality update background tasks.' )
+    parser.add_argument( '--config', help = 'TOML or YAML job configuration (default: config/airquality.toml)' )
+    subparsers = parser.add_subparsers( dest = 'command', required = True )
+
+    airnow = subparsers.add_parser( 'run-airnow', help = 'Run the hourly AirNow update' )
+    airnow.add_argument( '--job', action = 'append', help = 'name of the [airnow.<job>] section, repeat to run several regions off one download' )
+    airnow.add_argument( '--all', action = 'store_true', help = 'run every configured [airnow.<job>] region off one download' )
+    airnow.add_argument( '--once', action = 'store_true', help = 'run a single update cycle and exit (for cron / systemd timers)' )
+    airnow.set_defaults( handler = runAirNow )
+
+    epa = subparsers.add_parser( 'backfill-epa', help = 'Fill gaps with validated EPA data and reconcile the fact tables' )
+    epa.add_argument( '--job', help = 'name of the [epa.<job>] section' )
+    epa.add_argument( '--begin', help = 'YYYY-MM-DD, overrides the job begin date' )
+    epa.add_argument( '--end', help = 'YYYY-MM-DD, overrides the job end date' )
+    epa.add_argument( '--no-reconcile', action = 'store_true', help = 'only load the staging table' )
+    epa.set_defaults( handler = backfillEPA )
+
+    airnowBackfill = subparsers.add_parser( 'backfill-airnow', help = 'Load the hourly files of caught up days and fill AirNow coverage gaps' )
+    airnowBackfill.add_argument( '--job', help = 'name of the [airnow.<job>] section' )
+    airnowBackfill.add_argument( '--days', type = int, help = 'at most this many queued caught up days (default: all)' )
+    airnowBackfill.add_argument( '--begin', help = 'YYYY-MM-DD, also repair the coverage gaps from this GMT date' )
+    airnowBackfill.add_argument( '--end', help = 'YYYY-MM-DD, end of the gap repair (default: now)' )
+    airnowBackfill.set_defaults( handler = backfillAirNow )
+
+    compact = subparsers.add_parser( 'compact-staging', help = 'Archive promoted staging rows and maintain staging partitions and indexes' )
+    compact.add_argument( '--kind', choices = [ 'airnow', 'epa' ], help = 'only the jobs of this section' )
+    compact.add_argument( '--job', help = 'only the jobs with this name' )
+    compact.set_defaults( handler = compactStaging )
+
+    sites = subparsers.add_parser( 'load-sites', help = 'Reload the Sites table from the EPA sites file' )
+    sites.add_argument( '--skip-breakpoints', action = 'store_true', help = 'do not recreate lkp_AQI_Breakpoints' )
+    sites.set_defaults( handler = loadSites )
+
+    state = subparsers.add_parser( 'status', help = 'Show the configured jobs and their latest log lines' )
+    state.add_argument( '--db', action = 'store_true', help = 'also query the latest loaded hour' )
+    state.set_defaults( handler = status )
+    return parser
+
+def main( argv: list[str] = None ) -> int:
+    args = buildParser().parse_args( argv )
+    config = loadConfig( args.config )
+    return args.handler( config, args )
+
+if __name__ == "__main__":
+    sys.exit( main() )